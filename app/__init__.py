@@ -10,6 +10,7 @@ def create_app():
 
     - Loads environment via .env
     - Sets secret key
+    - Creates the process-wide database engine/session registry
     - Registers routes from the `app.routes` package
     """
     app = Flask(__name__, template_folder='templates', static_folder='static')
@@ -17,10 +18,62 @@ def create_app():
     
     # Tăng kích thước tối đa cho upload file và request body
     # Mặc định Flask là 16MB, tăng lên 50MB để cho phép upload ảnh lớn và nội dung bài viết dài
+    # Form đặt xe đọc body theo luồng với giới hạn riêng (UPLOAD_MAX_* trong app/uploads.py)
     app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 
+    # Engine + connection pool được tạo một lần cho mỗi process
+    from .extensions import init_db
+    init_db(app)
+
+    from . import search, payment_stats, media_store, pricing
+    search.init_app(app)
+    payment_stats.register_listeners()
+    media_store.register_listeners()
+    pricing.register_listeners()
+
+    from .page_cache import page_cache
+    page_cache.init_app(app)
+
+    # Fingerprint static files (url_for thêm ?v=<hash>) và cache lâu dài
+    from .assets import asset_manifest
+    asset_manifest.init_app(app)
+
+    # /img/<width>/<path> + helper responsive_img() cho template
+    from .image_variants import image_variants
+    image_variants.init_app(app)
+
+    # Job định kỳ (hủy giữ chỗ quá hạn, đối soát VNPay, dọn ảnh...) - app/housekeeping.py
+    from . import jobs
+    jobs.init_app(app)
+
+    # Hàng đợi task bền trong DB (xử lý ảnh upload...) - app/tasks.py, `flask worker`
+    from . import tasks
+    tasks.init_app(app)
+
+    from .commands import register_commands
+    register_commands(app)
+
     # Register routes
     from .routes import bp
     app.register_blueprint(bp)
 
+    # Thread nền chỉ chạy trong process web (gunicorn.conf.py, runlocal.py);
+    # BACKGROUND_THREADS=1 bật ngay tại đây, vd. cho `flask run`
+    if os.getenv('BACKGROUND_THREADS', '0').lower() in ('1', 'true', 'yes'):
+        start_background(app)
+
     return app
+
+
+def start_background(app):
+    """Start the background threads of a web server process.
+
+    VNPay inbox worker, job scheduler and in-process task workers. create_app()
+    does not start them, so `flask` commands (db-upgrade, worker, jobs-run...),
+    scripts and tests never spin up pollers; each component keeps its own
+    off switch (VNPAY_IPN_WORKER, JOB_SCHEDULER, TASK_INPROCESS_WORKERS).
+    """
+    from . import jobs, tasks, vnpay_ipn
+    vnpay_ipn.start_worker()
+    jobs.start_scheduler()
+    tasks.start_workers()
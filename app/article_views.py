@@ -0,0 +1,48 @@
+"""
+Lượt xem bài viết (Article.view_count).
+
+Mỗi lượt xem chỉ cộng vào bộ đếm trong bộ nhớ của process; job
+'article-views' (app/housekeeping.py, chạy trong mọi process) ghi cả lô
+xuống DB bằng một câu UPDATE ... view_count = view_count + :n. Process bị
+dừng đột ngột chỉ mất lượt xem của phút cuối.
+"""
+from collections import Counter
+import threading
+
+from sqlalchemy import bindparam, update
+
+from app.models import Article
+
+
+_pending = Counter()
+_lock = threading.Lock()
+
+
+def record(article_id, views=1):
+    with _lock:
+        _pending[article_id] += views
+
+
+def flush(session):
+    """Write buffered views in one executemany UPDATE; return the number of articles touched."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, Counter()
+    if not pending:
+        return 0
+    table = Article.__table__
+    try:
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam('article_id'))
+            # Giữ nguyên updated_at: lượt xem không phải là sửa bài
+            .values(view_count=table.c.view_count + bindparam('views'), updated_at=table.c.updated_at),
+            [{'article_id': article_id, 'views': views} for article_id, views in pending.items()],
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        with _lock:
+            _pending.update(pending)
+        raise
+    return len(pending)
@@ -0,0 +1,189 @@
+"""
+Fingerprint và cache lâu dài cho file trong app/static (không cần bước build).
+
+ - Khi khởi động: tính hash nội dung cho mọi file static. Kết quả lưu ở
+   instance/asset_manifest.json kèm (size, mtime) nên lần khởi động sau chỉ
+   cần stat file, không phải đọc lại ~30 MB.
+ - url_for('static', filename=...) tự thêm `?v=<hash>`; request có hash khớp
+   được trả `Cache-Control: public, max-age=31536000, immutable`.
+ - File nén được (css/js/svg/...) được nén gzip (và brotli nếu cài gói
+   `brotli`) ở lần đầu được yêu cầu, lưu trong instance/static_compressed và
+   trả về khi trình duyệt gửi Accept-Encoding phù hợp.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import request, send_file, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # tùy chọn
+    brotli = None
+
+
+ONE_YEAR = 365 * 24 * 3600
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.json', '.txt', '.xml', '.map', '.ttf', '.eot'}
+MIN_COMPRESS_SIZE = 1024
+
+
+class AssetManifest:
+    def __init__(self):
+        self.static_folder = None
+        self.manifest_path = None
+        self.compressed_dir = None
+        self.hashes = {}    # filename -> hash
+        self._stats = {}    # filename -> [size, mtime_ns]
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.manifest_path = os.path.join(app.instance_path, 'asset_manifest.json')
+        self.compressed_dir = os.path.join(app.instance_path, 'static_compressed')
+        if os.getenv('STATIC_FINGERPRINT', '1').lower() not in ('1', 'true', 'yes'):
+            return
+        self.build()
+        app.url_defaults(self._add_version)
+        app.view_functions['static'] = self.serve
+
+    # ---------- manifest ----------
+
+    @staticmethod
+    def _hash_file(path):
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:12]
+
+    def build(self):
+        """Hash every static file, reusing cached hashes when size/mtime are unchanged."""
+        cached = {}
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        hashes, stats = {}, {}
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                key = [st.st_size, st.st_mtime_ns]
+                entry = cached.get(filename)
+                if entry and entry[1:] == key:
+                    hashes[filename] = entry[0]
+                else:
+                    hashes[filename] = self._hash_file(path)
+                stats[filename] = key
+
+        with self._lock:
+            self.hashes, self._stats = hashes, stats
+        self._save()
+
+    def _save(self):
+        data = {name: [h] + self._stats[name] for name, h in self.hashes.items() if name in self._stats}
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            print(f"Không ghi được asset manifest: {e}")
+
+    def version(self, filename):
+        filename = filename.lstrip('/')
+        version = self.hashes.get(filename)
+        if version is None:
+            # File tạo sau khi khởi động (ảnh upload): hash một lần rồi nhớ lại
+            path = safe_join(self.static_folder, filename)
+            if not path or not os.path.isfile(path):
+                return None
+            version = self._hash_file(path)
+            with self._lock:
+                self.hashes[filename] = version
+        return version
+
+    def _add_version(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            version = self.version(values['filename'])
+            if version:
+                values['v'] = version
+
+    # ---------- serving ----------
+
+    def _compressed_variant(self, filename, path, encoding):
+        ext = '.br' if encoding == 'br' else '.gz'
+        target = os.path.join(self.compressed_dir, filename + ext)
+        try:
+            if os.stat(target).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                return target
+        except OSError:
+            pass
+        with open(path, 'rb') as f:
+            data = f.read()
+        if encoding == 'br':
+            compressed = brotli.compress(data)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) >= len(data):
+            return None
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f'{target}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, target)
+        return target
+
+    def serve(self, filename):
+        path = safe_join(self.static_folder, filename)
+        if not path or not os.path.isfile(path):
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        ext = os.path.splitext(filename)[1].lower()
+        compressible = ext in COMPRESSIBLE_EXTENSIONS and os.path.getsize(path) >= MIN_COMPRESS_SIZE
+
+        send_path, encoding = path, None
+        if compressible:
+            accepted = request.accept_encodings
+            for candidate in ('br', 'gzip'):
+                if candidate == 'br' and brotli is None:
+                    continue
+                if accepted[candidate]:
+                    try:
+                        variant = self._compressed_variant(filename, path, candidate)
+                    except OSError:
+                        variant = None
+                    if variant:
+                        send_path, encoding = variant, candidate
+                        break
+
+        resp = send_file(send_path, mimetype=mimetype, conditional=True)
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        if compressible:
+            resp.vary.add('Accept-Encoding')
+
+        version = request.args.get('v')
+        if version and version == self.version(filename):
+            resp.cache_control.public = True
+            resp.cache_control.max_age = ONE_YEAR
+            resp.cache_control.immutable = True
+        else:
+            resp.cache_control.public = True
+            resp.cache_control.no_cache = True
+        return resp
+
+
+asset_manifest = AssetManifest()
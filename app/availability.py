@@ -0,0 +1,292 @@
+"""
+Availability engine - trả lời "xe nào của loại X còn trống từ ngày A đến ngày B".
+
+Index được giữ trong bộ nhớ (mỗi process một bản):
+ - category_id -> danh sách id xe thuộc loại đó
+ - motorcycle_id -> các khoảng ngày [start, end] (tính theo ordinal, bao gồm
+   cả hai đầu) của các RentalItem đang hoạt động, sắp xếp theo start, kèm
+   mảng prefix-max của end để kiểm tra giao nhau bằng một lần bisect.
+
+Index được nạp lười ở lần truy vấn đầu tiên, cập nhật từng phần khi đơn thuê
+hoặc xe thay đổi (sync_rental, sync_motorcycle, remove_motorcycle) và được
+nạp lại toàn bộ sau AVAILABILITY_REFRESH_SECONDS để bắt kịp thay đổi từ các
+worker khác. Khi đặt xe, kết quả luôn được kiểm tra lại với database
+(verify_free) nên index cũ chỉ ảnh hưởng tốc độ, không ảnh hưởng tính đúng.
+Lần kiểm tra cuối trước khi ghi đơn chạy sau `lock_motorcycles` (SELECT ... FOR
+UPDATE trên các xe đã chọn, theo thứ tự id để hai đơn không khóa chéo nhau),
+nên hai request đặt cùng xe ở hai process được xếp hàng thay vì cùng thấy xe
+còn trống.
+"""
+from bisect import bisect_right, insort
+import os
+import threading
+import time
+
+from app.models import Motorcycles, Rental, RentalItem
+
+
+# Đơn ở các trạng thái này đang giữ xe
+ACTIVE_RENTAL_STATUSES = ('pending', 'confirmed', 'rented')
+
+# Xe ở các trạng thái này không cho thuê bất kể lịch
+UNRENTABLE_MOTORCYCLE_STATUSES = ('maintenance',)
+
+REFRESH_SECONDS = int(os.getenv('AVAILABILITY_REFRESH_SECONDS', '60'))
+
+
+def _day(value):
+    """Convert a date/datetime to an inclusive day number."""
+    return value.toordinal()
+
+
+class _BikeSchedule:
+    """Sorted booked intervals of one motorcycle."""
+    __slots__ = ('starts', 'entries', 'max_ends')
+
+    def __init__(self):
+        self.starts = []
+        self.entries = []   # (start, end, rental_id)
+        self.max_ends = []  # max_ends[i] = max(end for entries[:i + 1])
+
+    def _rebuild_max(self):
+        running = None
+        max_ends = []
+        for _, end, _ in self.entries:
+            running = end if running is None or end > running else running
+            max_ends.append(running)
+        self.max_ends = max_ends
+
+    def add(self, start, end, rental_id):
+        insort(self.entries, (start, end, rental_id))
+        self.starts = [entry[0] for entry in self.entries]
+        self._rebuild_max()
+
+    def remove_rental(self, rental_id):
+        kept = [entry for entry in self.entries if entry[2] != rental_id]
+        if len(kept) != len(self.entries):
+            self.entries = kept
+            self.starts = [entry[0] for entry in kept]
+            self._rebuild_max()
+
+    def is_free(self, start, end, exclude_rental_id=None):
+        # Chỉ những khoảng có start <= end truy vấn mới có thể giao nhau
+        i = bisect_right(self.starts, end)
+        if i == 0 or self.max_ends[i - 1] < start:
+            return True
+        if exclude_rental_id is None:
+            return False
+        for entry_start, entry_end, rental_id in self.entries[:i]:
+            if entry_end >= start and rental_id != exclude_rental_id:
+                return False
+        return True
+
+
+class AvailabilityIndex:
+    """In-memory interval index over active rentals, grouped by category."""
+
+    def __init__(self, refresh_seconds=REFRESH_SECONDS):
+        self._lock = threading.RLock()
+        self.refresh_seconds = refresh_seconds
+        self._loaded_at = None
+        self._category_bikes = {}   # category_id -> [motorcycle_id, ...]
+        self._bike_category = {}    # motorcycle_id -> category_id
+        self._bike_status = {}      # motorcycle_id -> status
+        self._schedules = {}        # motorcycle_id -> _BikeSchedule
+        self._rental_bikes = {}     # rental_id -> {motorcycle_id, ...}
+
+    # ---------- loading ----------
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def ensure_loaded(self, session):
+        with self._lock:
+            stale = (
+                self._loaded_at is None or
+                (self.refresh_seconds and time.monotonic() - self._loaded_at > self.refresh_seconds)
+            )
+            if stale:
+                self.rebuild(session)
+
+    def rebuild(self, session):
+        """Reload the whole index with two queries."""
+        bikes = session.query(
+            Motorcycles.id, Motorcycles.category_id, Motorcycles.status
+        ).all()
+        bookings = session.query(
+            RentalItem.motorcycle_id, Rental.id, Rental.start_date, Rental.end_date
+        ).join(Rental, RentalItem.rental_id == Rental.id).filter(
+            RentalItem.motorcycle_id.isnot(None),
+            Rental.status.in_(ACTIVE_RENTAL_STATUSES),
+            Rental.start_date.isnot(None),
+            Rental.end_date.isnot(None),
+        ).all()
+
+        with self._lock:
+            self._category_bikes = {}
+            self._bike_category = {}
+            self._bike_status = {}
+            self._schedules = {}
+            self._rental_bikes = {}
+            for bike_id, category_id, status in bikes:
+                self._set_bike(bike_id, category_id, status)
+
+            grouped = {}
+            for bike_id, rental_id, start_date, end_date in bookings:
+                grouped.setdefault(bike_id, []).append((_day(start_date), _day(end_date), rental_id))
+                self._rental_bikes.setdefault(rental_id, set()).add(bike_id)
+            for bike_id, entries in grouped.items():
+                schedule = self._schedules.setdefault(bike_id, _BikeSchedule())
+                entries.sort()
+                schedule.entries = entries
+                schedule.starts = [entry[0] for entry in entries]
+                schedule._rebuild_max()
+
+            self._loaded_at = time.monotonic()
+
+    # ---------- incremental updates ----------
+
+    def _set_bike(self, bike_id, category_id, status):
+        old_category = self._bike_category.get(bike_id)
+        if old_category is not None and old_category != category_id:
+            self._category_bikes[old_category].remove(bike_id)
+        if old_category != category_id:
+            self._category_bikes.setdefault(category_id, []).append(bike_id)
+        self._bike_category[bike_id] = category_id
+        self._bike_status[bike_id] = status
+
+    def sync_motorcycle(self, bike_id, category_id, status):
+        """Register a new/edited motorcycle."""
+        with self._lock:
+            if self._loaded_at is not None:
+                self._set_bike(bike_id, category_id, status)
+
+    def remove_motorcycle(self, bike_id):
+        with self._lock:
+            category_id = self._bike_category.pop(bike_id, None)
+            if category_id is not None:
+                self._category_bikes[category_id].remove(bike_id)
+            self._bike_status.pop(bike_id, None)
+            self._schedules.pop(bike_id, None)
+
+    def release_rental(self, rental_id):
+        """Drop every interval booked by a rental."""
+        with self._lock:
+            for bike_id in self._rental_bikes.pop(rental_id, ()):
+                schedule = self._schedules.get(bike_id)
+                if schedule:
+                    schedule.remove_rental(rental_id)
+
+    def record_rental(self, rental_id, motorcycle_ids, start_date, end_date, status='pending'):
+        """Replace the intervals of a rental with the given assignment."""
+        with self._lock:
+            self.release_rental(rental_id)
+            if self._loaded_at is None or status not in ACTIVE_RENTAL_STATUSES:
+                return
+            if not start_date or not end_date:
+                return
+            start, end = _day(start_date), _day(end_date)
+            bikes = set()
+            for bike_id in motorcycle_ids:
+                if bike_id is None:
+                    continue
+                self._schedules.setdefault(bike_id, _BikeSchedule()).add(start, end, rental_id)
+                bikes.add(bike_id)
+            if bikes:
+                self._rental_bikes[rental_id] = bikes
+
+    def sync_rental(self, session, rental_id):
+        """Re-read one rental from the database and update its intervals."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+        rental = session.query(
+            Rental.start_date, Rental.end_date, Rental.status
+        ).filter(Rental.id == rental_id).first()
+        if not rental:
+            self.release_rental(rental_id)
+            return
+        bike_ids = [row[0] for row in session.query(RentalItem.motorcycle_id).filter(
+            RentalItem.rental_id == rental_id,
+            RentalItem.motorcycle_id.isnot(None)
+        ).all()]
+        self.record_rental(rental_id, bike_ids, rental.start_date, rental.end_date, rental.status)
+
+    # ---------- queries ----------
+
+    def free_motorcycle_ids(self, session, category_id, start_date, end_date, exclude_rental_id=None):
+        """Return ids of motorcycles in the category free for the whole interval."""
+        self.ensure_loaded(session)
+        start, end = _day(start_date), _day(end_date)
+        with self._lock:
+            free = []
+            for bike_id in self._category_bikes.get(category_id, ()):
+                if self._bike_status.get(bike_id) in UNRENTABLE_MOTORCYCLE_STATUSES:
+                    continue
+                schedule = self._schedules.get(bike_id)
+                if schedule is None or schedule.is_free(start, end, exclude_rental_id):
+                    free.append(bike_id)
+            return free
+
+    def count_free(self, session, category_id, start_date, end_date):
+        return len(self.free_motorcycle_ids(session, category_id, start_date, end_date))
+
+    def is_free(self, session, bike_id, start_date, end_date, exclude_rental_id=None):
+        self.ensure_loaded(session)
+        with self._lock:
+            schedule = self._schedules.get(bike_id)
+            if schedule is None:
+                return True
+            return schedule.is_free(_day(start_date), _day(end_date), exclude_rental_id)
+
+
+availability_index = AvailabilityIndex()
+
+
+def lock_motorcycles(session, motorcycle_ids):
+    """Row-lock the motorcycles (ascending id) until the transaction ends."""
+    ids = sorted(set(motorcycle_ids))
+    if ids:
+        session.query(Motorcycles.id).filter(Motorcycles.id.in_(ids))\
+            .order_by(Motorcycles.id).with_for_update().all()
+
+
+def verify_free(session, motorcycle_ids, start_date, end_date, exclude_rental_id=None):
+    """Authoritative DB check: return the subset of ids with no overlapping active rental."""
+    if not motorcycle_ids:
+        return []
+    query = session.query(RentalItem.motorcycle_id).join(
+        Rental, RentalItem.rental_id == Rental.id
+    ).filter(
+        RentalItem.motorcycle_id.in_(list(motorcycle_ids)),
+        Rental.status.in_(ACTIVE_RENTAL_STATUSES),
+        Rental.start_date <= end_date,
+        Rental.end_date >= start_date,
+    )
+    if exclude_rental_id is not None:
+        query = query.filter(Rental.id != exclude_rental_id)
+    busy = {row[0] for row in query.all()}
+    return [bike_id for bike_id in motorcycle_ids if bike_id not in busy]
+
+
+def pick_free_motorcycles(session, category_id, start_date, end_date, quantity):
+    """Choose `quantity` free motorcycles of a category, or None if not enough.
+
+    Returns (chosen_ids, free_count).
+    """
+    candidates = availability_index.free_motorcycle_ids(session, category_id, start_date, end_date)
+    if len(candidates) < quantity:
+        return None, len(candidates)
+    chosen = []
+    # Kiểm tra theo lô với DB để bỏ qua các xe mà index (của worker này) chưa biết đã bận
+    offset = 0
+    batch = max(quantity * 2, 20)
+    while len(chosen) < quantity and offset < len(candidates):
+        window = candidates[offset:offset + batch]
+        chosen.extend(verify_free(session, window, start_date, end_date))
+        offset += batch
+    if len(chosen) < quantity:
+        availability_index.invalidate()
+        return None, len(chosen)
+    return chosen[:quantity], len(candidates)
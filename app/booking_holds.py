@@ -0,0 +1,131 @@
+"""
+Giữ chỗ có thời hạn cho đơn đặt xe đang chờ thanh toán VNPay.
+
+ - Khi submit, đơn 'pending' được gán xe như trước và có `hold_expires_at`
+   = hạn thanh toán VNPay (vnp_ExpireDate, HOLD_MINUTES) + GRACE_MINUTES để
+   IPN của giao dịch trả đúng hạn vẫn kịp về. `hold_expires_at` luôn lưu
+   giờ UTC naive (như `datetime.utcnow()`), không phụ thuộc múi giờ server;
+   chỉ khi gửi VNPay mới đổi sang giờ VN (vnpay_helper.vnpay_timestamp).
+ - Thanh toán thành công (hoặc thất bại) qua vnpay_ipn: giữ chỗ được gỡ,
+   đơn thành 'confirmed' (hoặc 'cancelled') như trước.
+ - Hết hạn mà chưa thanh toán: `expire_holds` hủy đơn, đánh dấu payment
+   'failed' và trả xe về lịch trống. Job 'booking-holds' (app/housekeeping.py)
+   quét mỗi phút; chạy tay song song cũng không đụng nhau nhờ FOR UPDATE
+   SKIP LOCKED.
+
+Trong lúc form đặt xe còn đang upload ảnh, các xe đã chọn được giữ tạm trong
+chỉ mục availability (`reserve` / `release_reservation`) nên request đặt xe
+song song trong cùng process không chọn trùng xe. `held_counts` đếm số xe
+đang được giữ theo loại xe bằng một câu GROUP BY (lệnh booking-holds-expire).
+"""
+from datetime import datetime, timedelta
+import itertools
+import os
+
+from sqlalchemy import func
+
+from app import payment_stats
+from app.availability import availability_index
+from app.models import Motorcycles, Payment, Rental, RentalItem
+
+
+HOLD_MINUTES = int(os.getenv('BOOKING_HOLD_MINUTES', '15'))
+GRACE_MINUTES = int(os.getenv('BOOKING_HOLD_GRACE_MINUTES', '5'))
+BATCH_SIZE = 200
+
+# Khóa tạm trong chỉ mục availability dùng số âm để không trùng id đơn thuê
+_reservation_keys = itertools.count(-1, -1)
+
+
+def payment_deadline(now=None):
+    """Last moment VNPay accepts the payment (naive UTC; sent as vnp_ExpireDate)."""
+    return (now or datetime.utcnow()) + timedelta(minutes=HOLD_MINUTES)
+
+
+def hold_deadline(payment_expires_at):
+    return payment_expires_at + timedelta(minutes=GRACE_MINUTES)
+
+
+def reserve(motorcycle_ids, start_date, end_date):
+    """Keep bikes picked by an in-flight submit out of the index; return the reservation key."""
+    key = next(_reservation_keys)
+    availability_index.record_rental(key, motorcycle_ids, start_date, end_date)
+    return key
+
+
+def release_reservation(key):
+    if key is not None:
+        availability_index.release_rental(key)
+
+
+def held_counts(session, now=None):
+    """Bikes held by unpaid, unexpired bookings per category: {category_id: count}."""
+    now = now or datetime.utcnow()
+    rows = session.query(Motorcycles.category_id, func.count(RentalItem.id))\
+        .join(RentalItem, RentalItem.motorcycle_id == Motorcycles.id)\
+        .join(Rental, RentalItem.rental_id == Rental.id)\
+        .filter(Rental.status == 'pending', Rental.hold_expires_at > now)\
+        .group_by(Motorcycles.category_id).all()
+    return dict(rows)
+
+
+def expire_holds(session, now=None, limit=BATCH_SIZE):
+    """Cancel unpaid bookings whose hold has expired; return the rental ids released.
+
+    Rentals and payments are taken with SKIP LOCKED: a booking whose payment
+    a VNPay callback is applying right now is left alone (the callback decides).
+    """
+    now = now or datetime.utcnow()
+    rental_ids = [row[0] for row in session.query(Rental.id).filter(
+        Rental.status == 'pending',
+        Rental.hold_expires_at.isnot(None),
+        Rental.hold_expires_at <= now,
+    ).order_by(Rental.hold_expires_at).limit(limit).with_for_update(skip_locked=True).all()]
+    if not rental_ids:
+        session.rollback()
+        return []
+
+    locked = session.query(Payment.id, Payment.rental_id, Payment.amount).filter(
+        Payment.rental_id.in_(rental_ids), Payment.payment_status == 'pending'
+    ).with_for_update(skip_locked=True).all()
+    locked_ids = [row.id for row in locked]
+    busy_query = session.query(Payment.rental_id).filter(
+        Payment.rental_id.in_(rental_ids), Payment.payment_status == 'pending'
+    )
+    if locked_ids:
+        busy_query = busy_query.filter(Payment.id.notin_(locked_ids))
+    busy = {row[0] for row in busy_query.all()}
+    expired = [rental_id for rental_id in rental_ids if rental_id not in busy]
+    if not expired:
+        session.rollback()
+        return []
+
+    payments = [row for row in locked if row.rental_id not in busy]
+    if payments:
+        session.query(Payment).filter(Payment.id.in_([row.id for row in payments]))\
+            .update({Payment.payment_status: 'failed', Payment.version: Payment.version + 1},
+                    synchronize_session=False)
+        payment_stats.record_bulk_transition(
+            session.connection(), 'pending', 'failed', len(payments), sum(row.amount or 0 for row in payments)
+        )
+    session.query(Rental).filter(Rental.id.in_(expired))\
+        .update({Rental.status: 'cancelled', Rental.payment_status: 'failed',
+                 Rental.hold_expires_at: None, Rental.version: Rental.version + 1},
+                synchronize_session=False)
+    session.commit()
+
+    for rental_id in expired:
+        availability_index.release_rental(rental_id)
+    return expired
+
+
+def sweep(session):
+    """Expire every due hold; return how many expired."""
+    total = 0
+    while True:
+        expired = expire_holds(session)
+        total += len(expired)
+        if len(expired) < BATCH_SIZE:
+            break
+    return total
+
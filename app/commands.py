@@ -0,0 +1,332 @@
+"""Flask CLI commands (chạy bằng `flask --app wsgi <command>`)."""
+from datetime import timedelta
+import time
+
+import click
+from sqlalchemy import func
+
+import app.models as models
+from app import search, payment_stats, migrations, media_store, vnpay_ipn, booking_holds, jobs, tasks
+from app.extensions import get_engine, get_db_session
+from app.page_cache import page_cache
+
+
+def register_commands(app):
+    """Attach maintenance commands to the Flask CLI."""
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Tạo các bảng còn thiếu trong database."""
+        models.Base.metadata.create_all(get_engine())
+        search.ensure_search_schema(get_engine())
+        migrations.upgrade(get_engine(), echo=click.echo)
+        click.echo('Bảng đã được tạo (nếu chưa tồn tại).')
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade_command():
+        """Áp dụng các migration chưa chạy."""
+        applied = migrations.upgrade(get_engine(), echo=click.echo)
+        if not applied:
+            click.echo('Database đã ở phiên bản mới nhất.')
+
+    @app.cli.command('db-current')
+    def db_current_command():
+        """In phiên bản schema hiện tại và các migration đang chờ."""
+        click.echo(f'Phiên bản hiện tại: {migrations.current_version(get_engine()) or "(chưa có)"}')
+        for version, description, _ in migrations.pending_migrations(get_engine()):
+            click.echo(f'  chờ áp dụng: {version} - {description}')
+
+    @app.cli.command('db-explain')
+    def db_explain_command():
+        """Kiểm tra bằng EXPLAIN rằng các truy vấn nóng trong routes dùng index."""
+        session = get_db_session()
+        failed = 0
+        try:
+            for name, query in migrations.hot_queries(session):
+                uses_index, plan = migrations.explain_uses_index(session, query)
+                click.echo(f'[{"OK" if uses_index else "SCAN"}] {name}')
+                if not uses_index:
+                    failed += 1
+                    click.echo('    ' + plan.replace('\n', '\n    '))
+        finally:
+            session.close()
+        if failed:
+            raise SystemExit(1)
+
+    @app.cli.command('search-reindex')
+    def search_reindex_command():
+        """Tạo lại toàn bộ dữ liệu tìm kiếm (khách hàng, đơn thuê, giao dịch)."""
+        session = get_db_session()
+        try:
+            total = search.reindex_all(session)
+        finally:
+            session.close()
+        click.echo(f'Đã đánh chỉ mục {total} bản ghi.')
+
+    @app.cli.command('payment-stats-reconcile')
+    def payment_stats_reconcile_command():
+        """Tính lại bảng payment_summary từ bảng payment và báo chênh lệch."""
+        session = get_db_session()
+        try:
+            drift = payment_stats.reconcile(session)
+        finally:
+            session.close()
+        if not drift:
+            click.echo('payment_summary khớp với bảng payment.')
+            return
+        for status, (expected, stored) in sorted(drift.items()):
+            click.echo(f'[{status or "(null)"}] đúng: {expected[0]} / {expected[1]} - đã lưu: {stored[0]} / {stored[1]}')
+        click.echo(f'Đã sửa {len(drift)} trạng thái bị lệch.')
+
+    @app.cli.command('media-gc')
+    @click.option('--grace-hours', default=24, show_default=True,
+                  help='Chỉ xóa file không còn tham chiếu cũ hơn số giờ này.')
+    @click.option('--dry-run', is_flag=True, help='Chỉ báo cáo, không xóa.')
+    def media_gc_command(grace_hours, dry_run):
+        """Đếm lại tham chiếu tới kho ảnh và xóa file mồ côi."""
+        session = get_db_session()
+        try:
+            recounted, removed, freed = media_store.collect_garbage(
+                session, grace=timedelta(hours=grace_hours), dry_run=dry_run
+            )
+        finally:
+            session.close()
+        prefix = '[dry-run] ' if dry_run else ''
+        click.echo(f'{prefix}Sửa ref_count cho {recounted} file.')
+        click.echo(f'{prefix}Xóa {removed} file mồ côi ({freed / (1024 * 1024):.1f} MB).')
+
+    @app.cli.command('media-import-legacy')
+    @click.option('--dry-run', is_flag=True, help='Chỉ đếm, không sao chép.')
+    def media_import_legacy_command(dry_run):
+        """Chuyển ảnh cũ (ngoài kho) của khách hàng, bài viết, loại xe vào kho ảnh."""
+        session = get_db_session()
+        try:
+            moved = media_store.import_legacy_files(session, dry_run=dry_run)
+        finally:
+            session.close()
+        click.echo(f'{"[dry-run] " if dry_run else ""}Đã chuyển {moved} đường dẫn vào kho ảnh.')
+        if moved and not dry_run:
+            click.echo('File cũ vẫn còn nguyên; xóa thủ công sau khi kiểm tra.')
+
+    @app.cli.command('article-extract-images')
+    @click.option('--batch-size', default=20, show_default=True)
+    @click.option('--dry-run', is_flag=True, help='Chỉ đếm, không ghi.')
+    def article_extract_images_command(batch_size, dry_run):
+        """Tách ảnh base64 trong nội dung bài viết cũ ra kho ảnh (chạy một lần)."""
+        session = get_db_session()
+        try:
+            changed, moved, saved = media_store.extract_article_images(
+                session, batch_size=batch_size, dry_run=dry_run
+            )
+        finally:
+            session.close()
+        prefix = '[dry-run] ' if dry_run else ''
+        click.echo(f'{prefix}{changed} bài viết, {moved} ảnh được tách ra'
+                   f' (giảm {saved / (1024 * 1024):.1f} MB nội dung).')
+        if changed and not dry_run:
+            page_cache.invalidate('article')
+
+    @app.cli.command('vnpay-inbox-process')
+    @click.option('--retry-failed', is_flag=True, help=f'Thử lại cả dòng đã lỗi >= {vnpay_ipn.MAX_ATTEMPTS} lần.')
+    def vnpay_inbox_process_command(retry_failed):
+        """Áp dụng các callback VNPay còn tồn trong inbox (khi worker không chạy)."""
+        session = get_db_session()
+        try:
+            if retry_failed:
+                reset = session.query(models.VnpayInbox).filter(
+                    models.VnpayInbox.processed_at.is_(None)
+                ).update({models.VnpayInbox.attempts: 0}, synchronize_session=False)
+                session.commit()
+                click.echo(f'Đặt lại {reset} dòng lỗi.')
+            total = 0
+            while True:
+                done = vnpay_ipn.process_pending(session)
+                total += done
+                if done < vnpay_ipn.BATCH_SIZE:
+                    break
+        finally:
+            session.close()
+        click.echo(f'Đã xử lý {total} callback VNPay.')
+
+    @app.cli.command('booking-holds-expire')
+    def booking_holds_expire_command():
+        """Hủy các đơn chờ thanh toán đã quá hạn giữ chỗ (khi thread giữ chỗ không chạy)."""
+        session = get_db_session()
+        try:
+            expired = booking_holds.sweep(session)
+            counts = booking_holds.held_counts(session)
+        finally:
+            session.close()
+        click.echo(f'Đã hủy {expired} đơn quá hạn.')
+        for category_id, held in sorted(counts.items()):
+            click.echo(f'  loại xe #{category_id}: {held} xe đang giữ chỗ')
+
+    @app.cli.command('jobs-status')
+    def jobs_status_command():
+        """Lịch và số đo của các job định kỳ."""
+        session = get_db_session()
+        try:
+            states = {state.name: state for state in session.query(models.ScheduledJob)}
+        finally:
+            session.close()
+        for name, job in sorted(jobs.JOBS.items()):
+            state = states.get(name)
+            where = 'leader' if job.leader else 'mọi process'
+            click.echo(f'{name} [{job.cron.expr}] ({where})')
+            if state is None or not state.run_count:
+                next_run = state.next_run_at if state is not None else None
+                click.echo('    chưa chạy' + (f', lần tới {next_run:%Y-%m-%d %H:%M}' if next_run else ''))
+                continue
+            average = state.total_duration_ms / state.run_count
+            click.echo(f'    lần cuối {state.last_started_at:%Y-%m-%d %H:%M:%S}: {state.last_status}, '
+                       f'{state.last_duration_ms} ms - {state.last_result or state.last_error or ""}')
+            click.echo(f'    {state.run_count} lần, {state.failure_count} lỗi, trung bình {average:.0f} ms, '
+                       f'lâu nhất {state.max_duration_ms} ms, lần tới {state.next_run_at:%Y-%m-%d %H:%M}')
+
+    @app.cli.command('jobs-run')
+    @click.argument('name')
+    def jobs_run_command(name):
+        """Chạy ngay một job định kỳ (ghi số đo như khi chạy theo lịch)."""
+        job = jobs.JOBS.get(name)
+        if job is None:
+            raise click.BadParameter(f'không có job {name!r} ({", ".join(sorted(jobs.JOBS))})')
+        session = get_db_session()
+        try:
+            if job.leader:
+                status = jobs.run_job(session, job)
+            else:
+                status = jobs.execute(session, job)[0]
+        finally:
+            session.close()
+        click.echo(f'{name}: {status}')
+
+    @app.cli.command('worker')
+    @click.option('--concurrency', default=2, show_default=True, help='Số thread chạy task.')
+    @click.option('--burst', is_flag=True, help='Thoát khi hàng đợi rỗng.')
+    def worker_command(concurrency, burst):
+        """Chạy worker hàng đợi task (nên đặt TASK_INPROCESS_WORKERS=0 cho process web)."""
+        import signal
+
+        runner = tasks.Worker()
+
+        def _shutdown(signum, frame):
+            click.echo('Đang dừng worker (chờ task đang chạy xong)...')
+            runner.stop()
+
+        signal.signal(signal.SIGTERM, _shutdown)
+        signal.signal(signal.SIGINT, _shutdown)
+        click.echo(f'Worker task: {concurrency} thread, task: {", ".join(sorted(tasks.TASKS))}')
+        started = time.monotonic()
+        runner.start(concurrency, burst=burst)
+        runner.join()
+        click.echo(f'Đã chạy {runner.processed} task trong {time.monotonic() - started:.1f}s.')
+
+    @app.cli.command('tasks-status')
+    def tasks_status_command():
+        """Độ sâu hàng đợi task và số đo theo từng loại task."""
+        session = get_db_session()
+        try:
+            depth = tasks.queue_depth(session)
+            stats = {stat.name: stat for stat in session.query(models.TaskStat)}
+            dead = dict(session.query(models.DeadTask.name, func.count(models.DeadTask.id))
+                        .group_by(models.DeadTask.name).all())
+        finally:
+            session.close()
+        names = sorted(set(tasks.TASKS) | set(stats) | {name for name, _ in depth} | set(dead))
+        for name in names:
+            queued, oldest = depth.get((name, 'queued'), (0, None))
+            running = depth.get((name, 'running'), (0, None))[0]
+            click.echo(f'{name}: {queued} chờ, {running} đang chạy, {dead.get(name, 0)} trong dead letter'
+                       + (f', cũ nhất {oldest:%Y-%m-%d %H:%M:%S}' if oldest else ''))
+            stat = stats.get(name)
+            if stat is None:
+                continue
+            line = f'    {stat.succeeded} thành công, {stat.retried} thử lại, {stat.dead} chết'
+            if stat.succeeded:
+                line += (f'; chờ trung bình {stat.total_latency_ms / stat.succeeded:.0f} ms '
+                         f'(lâu nhất {stat.max_latency_ms} ms), chạy trung bình '
+                         f'{stat.total_run_ms / stat.succeeded:.0f} ms (lâu nhất {stat.max_run_ms} ms)')
+            click.echo(line)
+
+    @app.cli.command('tasks-retry-dead')
+    @click.option('--name', default=None, help='Chỉ đưa lại task có tên này.')
+    def tasks_retry_dead_command(name):
+        """Đưa các task trong dead letter trở lại hàng đợi."""
+        session = get_db_session()
+        try:
+            count = tasks.retry_dead(session, name)
+        finally:
+            session.close()
+        click.echo(f'Đã đưa lại {count} task vào hàng đợi.')
+
+    @app.cli.command('motorcycles-import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--dry-run', is_flag=True, help='Chỉ kiểm tra, không ghi.')
+    @click.option('--strict', is_flag=True, help='Không ghi gì nếu có dòng lỗi.')
+    def motorcycles_import_command(path, dry_run, strict):
+        """Nhập xe hàng loạt từ file CSV/XLSX (cột: license_plate, category_id|category, model_year, status, description)."""
+        from app import motorcycle_io
+
+        session = get_db_session()
+        started = time.monotonic()
+        try:
+            with open(path, 'rb') as stream:
+                inserted, errors = motorcycle_io.import_motorcycles(session, stream, path,
+                                                                    dry_run=dry_run, strict=strict)
+        except motorcycle_io.ImportFileError as e:
+            raise click.ClickException(str(e))
+        finally:
+            session.close()
+        for line, message in errors:
+            click.echo(f'  dòng {line}: {message}')
+        if dry_run:
+            click.echo(f'[dry-run] {inserted} xe hợp lệ, {len(errors)} dòng lỗi.')
+        elif strict and errors:
+            click.echo(f'Không ghi gì: {len(errors)} dòng lỗi.')
+        else:
+            click.echo(f'Đã thêm {inserted} xe trong {time.monotonic() - started:.1f}s, {len(errors)} dòng lỗi.')
+
+    @app.cli.command('motorcycles-export')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--category-id', type=int, default=None, help='Chỉ xuất xe của một loại.')
+    def motorcycles_export_command(path, category_id):
+        """Xuất danh sách xe ra file CSV."""
+        from app import motorcycle_io
+
+        session = get_db_session()
+        try:
+            with open(path, 'w', encoding='utf-8', newline='') as out:
+                for chunk in motorcycle_io.export_csv(session, category_id):
+                    out.write(chunk)
+        finally:
+            session.close()
+        click.echo(f'Đã xuất ra {path}.')
+
+    @app.cli.command('vnpay-reconcile')
+    @click.option('--batch-size', default=500, show_default=True)
+    @click.option('--workers', type=int, default=None, help='Số truy vấn song song (mặc định VNPAY_QUERY_WORKERS hoặc 8).')
+    @click.option('--rate', type=float, default=None, help='Giới hạn request/giây, 0 = không giới hạn (mặc định VNPAY_QUERY_RATE hoặc 20).')
+    @click.option('--min-age-minutes', default=15, show_default=True, help='Bỏ qua giao dịch mới tạo.')
+    @click.option('--limit', type=int, default=None, help='Chỉ truy vấn tối đa N giao dịch.')
+    @click.option('--api-url', default=None, help='URL querydr khác (vd. server giả lập fake_vnpay.py).')
+    @click.option('--dry-run', is_flag=True, help='Chỉ truy vấn và thống kê, không ghi.')
+    def vnpay_reconcile_command(batch_size, workers, rate, min_age_minutes, limit, api_url, dry_run):
+        """Đối soát các thanh toán VNPay còn 'pending' với API truy vấn giao dịch."""
+        from app import vnpay_query, vnpay_reconcile
+
+        session = get_db_session()
+        try:
+            click.echo(f'{vnpay_reconcile.count_pending(session)} thanh toán VNPay đang chờ.')
+            started = time.monotonic()
+            with vnpay_query.client_from_env(workers=workers, rate=rate, api_url=api_url) as client:
+                stats = vnpay_reconcile.reconcile(
+                    session, client, batch_size=batch_size, min_age=timedelta(minutes=min_age_minutes),
+                    limit=limit, dry_run=dry_run, echo=click.echo,
+                )
+            elapsed = time.monotonic() - started
+        finally:
+            session.close()
+        prefix = '[dry-run] ' if dry_run else ''
+        click.echo(f'{prefix}' + ', '.join(f'{key}={value}' for key, value in sorted(stats.items())))
+        if stats['queried']:
+            click.echo(f'{stats["queried"]} giao dịch trong {elapsed:.1f}s ({stats["queried"] / elapsed:.0f}/s).')
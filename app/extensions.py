@@ -1,17 +1,110 @@
 import os
+import threading
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 import app.models as models
 
 
-def get_db_session():
-    """Create and return a new database session.
-    
-    IMPORTANT: Caller must close() the session after use to prevent memory leaks.
-    Better practice: use try/finally or context managers.
-    """
+# Process-wide engine (one connection pool per gunicorn worker) and a
+# thread-local session registry bound to it. The engine is built once in
+# create_app() via init_db(); scripts that never create the Flask app get a
+# lazily created engine on first use.
+_engine = None
+_engine_lock = threading.Lock()
+Session = scoped_session(sessionmaker())
+
+
+def get_database_url():
+    """Return the configured database URL, falling back to local SQLite."""
     db_url = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_LOCAL')
     if not db_url:
         db_url = 'sqlite:///local_dev.db'
-    engine = models.create_tables(url=db_url)
-    Session = sessionmaker(bind=engine)
+    return db_url
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def default_db_config():
+    """Pool settings read from the environment (overridable via app.config)."""
+    return {
+        'DB_POOL_SIZE': int(os.getenv('DB_POOL_SIZE', '5')),
+        'DB_MAX_OVERFLOW': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'DB_POOL_PRE_PING': _env_bool('DB_POOL_PRE_PING', True),
+        'DB_POOL_RECYCLE': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'DB_CREATE_TABLES': _env_bool('DB_CREATE_TABLES', True),
+        'DB_AUTO_MIGRATE': _env_bool('DB_AUTO_MIGRATE', True),
+    }
+
+
+def _build_engine(url, config):
+    options = {
+        'echo': False,
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    # SQLite (đặc biệt là :memory:) không dùng QueuePool nên bỏ qua size/overflow
+    if not url.startswith('sqlite'):
+        options['pool_size'] = config['DB_POOL_SIZE']
+        options['max_overflow'] = config['DB_MAX_OVERFLOW']
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+    return create_engine(url, **options)
+
+
+def init_db(app):
+    """Create the engine once for this process and register session teardown.
+
+    Schema creation and pending migrations run here a single time per
+    process (disable with DB_CREATE_TABLES=0 / DB_AUTO_MIGRATE=0 when the
+    schema is managed by `flask init-db` / `flask db-upgrade`).
+    """
+    global _engine
+    for key, value in default_db_config().items():
+        app.config.setdefault(key, value)
+    app.config.setdefault('DATABASE_URL', get_database_url())
+
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = _build_engine(app.config['DATABASE_URL'], app.config)
+        Session.remove()
+        Session.configure(bind=_engine)
+
+    if app.config['DB_CREATE_TABLES']:
+        models.Base.metadata.create_all(_engine)
+    if app.config['DB_AUTO_MIGRATE']:
+        from app import migrations
+        migrations.upgrade(_engine)
+
+    app.teardown_appcontext(shutdown_session)
+    return _engine
+
+
+def get_engine():
+    """Return the process-wide engine, creating it from env if needed."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _build_engine(get_database_url(), default_db_config())
+                Session.configure(bind=_engine)
+    return _engine
+
+
+def get_db_session():
+    """Return the session for the current request/thread.
+
+    The same session is returned for every call within a request and is
+    removed in teardown_appcontext, so handlers only pay for one pooled
+    connection checkout. Calling close() early is still allowed.
+    """
+    get_engine()
     return Session()
+
+
+def shutdown_session(exception=None):
+    """Return the request's connection to the pool."""
+    Session.remove()
@@ -0,0 +1,96 @@
+"""
+Các job dọn dẹp định kỳ (đăng ký vào app/jobs.py khi app khởi động).
+
+ - booking-holds: hủy đơn chờ thanh toán quá hạn giữ chỗ (mỗi phút).
+ - vnpay-reconcile: đối soát payment VNPay còn 'pending' (bị bỏ dở hoặc mất
+   IPN) qua API querydr, mỗi 30 phút, tối đa RECONCILE_LIMIT giao dịch.
+ - abandoned-booking-images: gỡ ảnh CCCD của khách chỉ có đơn đã hủy lâu
+   hơn ABANDONED_IMAGE_DAYS ngày (0 = tắt); file được media-gc dọn sau đó.
+ - media-gc: đếm lại tham chiếu kho ảnh và xóa file mồ côi (hằng đêm).
+ - payment-stats-fold: gộp payment_summary_delta vào payment_summary (mỗi phút).
+ - payment-stats-reconcile: sửa payment_summary nếu bị lệch (hằng đêm).
+ - article-views: ghi lượt xem bài viết từ bộ nhớ xuống DB (mọi process).
+"""
+from datetime import datetime, timedelta
+import os
+
+from sqlalchemy import exists, func, or_
+
+from app import article_views, booking_holds, media_store, payment_stats, vnpay_query, vnpay_reconcile
+from app.jobs import job
+from app.models import Customer, Rental
+
+
+RECONCILE_LIMIT = int(os.getenv('VNPAY_RECONCILE_LIMIT', '2000'))
+ABANDONED_IMAGE_DAYS = int(os.getenv('ABANDONED_IMAGE_DAYS', '30'))
+BATCH_SIZE = 200
+
+CCCD_COLUMNS = ('citizen_id_front_image', 'citizen_id_back_image',
+                'citizen_id_front_thumbnail', 'citizen_id_back_thumbnail')
+
+
+@job('booking-holds', '* * * * *')
+def expire_booking_holds(ctx):
+    session = ctx.session
+    expired = ctx.batches(lambda: len(booking_holds.expire_holds(session)), booking_holds.BATCH_SIZE)
+    return f'{expired} đơn quá hạn'
+
+
+@job('vnpay-reconcile', '*/30 * * * *', max_seconds=900)
+def reconcile_vnpay(ctx):
+    with vnpay_query.client_from_env() as client:
+        stats = vnpay_reconcile.reconcile(
+            ctx.session, client, min_age=timedelta(minutes=30), limit=RECONCILE_LIMIT
+        )
+    return (f'{stats["queried"]} truy vấn, {stats["paid"]} thành công, '
+            f'{stats["marked_failed"]} thất bại, {stats["error"]} lỗi')
+
+
+def _clear_abandoned_images(session, cutoff):
+    """Drop CCCD images of one batch of customers whose bookings all died before `cutoff`."""
+    live_rental = exists().where(
+        Rental.customer_id == Customer.id,
+        or_(func.coalesce(Rental.status, '') != 'cancelled', Rental.updated_at >= cutoff),
+    )
+    has_image = or_(*(getattr(Customer, name).isnot(None) for name in CCCD_COLUMNS))
+    customers = session.query(Customer).filter(
+        has_image, Customer.rentals.any(), ~live_rental
+    ).order_by(Customer.id).limit(BATCH_SIZE).all()
+    for customer in customers:
+        # Qua ORM để media_store trừ ref_count trong cùng transaction
+        for name in CCCD_COLUMNS:
+            setattr(customer, name, None)
+    session.commit()
+    return len(customers)
+
+
+@job('abandoned-booking-images', '15 3 * * *')
+def purge_abandoned_booking_images(ctx):
+    if ABANDONED_IMAGE_DAYS <= 0:
+        return 'tắt'
+    cutoff = datetime.utcnow() - timedelta(days=ABANDONED_IMAGE_DAYS)
+    cleared = ctx.batches(lambda: _clear_abandoned_images(ctx.session, cutoff), BATCH_SIZE)
+    return f'{cleared} khách hàng'
+
+
+@job('media-gc', '30 3 * * *', max_seconds=1800)
+def collect_media_garbage(ctx):
+    recounted, removed, freed = media_store.collect_garbage(ctx.session)
+    return f'sửa {recounted} ref_count, xóa {removed} file ({freed / (1024 * 1024):.1f} MB)'
+
+
+@job('payment-stats-fold', '* * * * *')
+def fold_payment_stats(ctx):
+    folded = ctx.batches(lambda: payment_stats.fold(ctx.session), payment_stats.FOLD_BATCH)
+    return f'{folded} delta'
+
+
+@job('payment-stats-reconcile', '0 4 * * *')
+def reconcile_payment_stats(ctx):
+    drift = payment_stats.reconcile(ctx.session)
+    return f'{len(drift)} trạng thái lệch'
+
+
+@job('article-views', '* * * * *', leader=False)
+def flush_article_views(ctx):
+    return f'{article_views.flush(ctx.session)} bài viết'
@@ -0,0 +1,193 @@
+"""
+Ảnh theo kích thước màn hình cho trang công khai: /img/<width>/<path>.
+
+ - Ảnh trong app/static được thu nhỏ theo yêu cầu về một trong các chiều
+   rộng cho phép (WIDTHS) và mã hóa AVIF/WebP tùy Accept của trình duyệt
+   (JPEG/PNG nếu không hỗ trợ), lưu trong instance/image_variants để lần
+   sau chỉ việc gửi file.
+ - Helper Jinja `responsive_img(...)` sinh thẻ <img> có srcset/sizes,
+   loading="lazy" và decoding="async"; URL mang `?v=<hash>` của ảnh gốc nên
+   được cache lâu dài giống file static.
+
+Nếu không cài Pillow, helper trả về thẻ <img> trỏ thẳng tới file static.
+"""
+import os
+import threading
+
+from flask import abort, redirect, request, send_file, url_for
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+WIDTHS = (160, 320, 480, 640, 768, 1024, 1280, 1600, 2000)
+DEFAULT_WIDTHS = (320, 480, 768, 1024, 1600)
+SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+ONE_YEAR = 365 * 24 * 3600
+QUALITY = {'avif': 55, 'webp': 80, 'jpeg': 82}
+MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+def _avif_supported():
+    if Image is None:
+        return False
+    try:
+        import pillow_avif  # noqa: F401  (plugin cho Pillow < 11.2)
+    except ImportError:
+        pass
+    return 'AVIF' in Image.SAVE
+
+
+class ImageVariants:
+    def __init__(self):
+        self.static_folder = None
+        self.cache_dir = None
+        self.avif = False
+        self._sizes = {}    # (filename, version) -> (width, height)
+        self._lock = threading.Lock()
+        self._encoding = threading.BoundedSemaphore(int(os.getenv('IMAGE_VARIANT_WORKERS', '2')))
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.cache_dir = os.path.join(app.instance_path, 'image_variants')
+        self.avif = _avif_supported()
+        app.add_url_rule('/img/<int:width>/<path:filename>', 'image_variant', self.serve)
+        app.jinja_env.globals['responsive_img'] = self.responsive_img
+
+    # ---------- helpers ----------
+
+    def _source(self, filename):
+        if os.path.splitext(filename)[1].lower() not in SOURCE_EXTENSIONS:
+            return None
+        path = safe_join(self.static_folder, filename)
+        if not path or not os.path.isfile(path):
+            return None
+        return path
+
+    def _version(self, filename):
+        from app.assets import asset_manifest
+        return asset_manifest.version(filename)
+
+    def source_size(self, filename):
+        """(width, height) of a static image, read from its header once per version."""
+        key = (filename, self._version(filename))
+        size = self._sizes.get(key)
+        if size is None:
+            path = self._source(filename)
+            if path is None or Image is None:
+                return None
+            try:
+                with Image.open(path) as img:
+                    size = img.size
+            except Exception:
+                return None
+            with self._lock:
+                self._sizes[key] = size
+        return size
+
+    def _negotiate(self, source_ext):
+        accept = request.accept_mimetypes
+        if self.avif and accept['image/avif']:
+            return 'avif'
+        if accept['image/webp']:
+            return 'webp'
+        return 'png' if source_ext == '.png' else 'jpeg'
+
+    def _render(self, source, target, width, fmt):
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.width > width:
+                img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+            if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            elif img.mode not in ('RGB', 'RGBA', 'L'):
+                img = img.convert('RGBA')
+            options = {'quality': QUALITY[fmt]} if fmt in QUALITY else {'optimize': True}
+            if fmt == 'jpeg':
+                options.update(progressive=True, optimize=True)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+            img.save(tmp_path, fmt.upper(), **options)
+        os.replace(tmp_path, target)
+
+    # ---------- view ----------
+
+    def serve(self, width, filename):
+        if width not in WIDTHS:
+            abort(404)
+        source = self._source(filename)
+        if source is None:
+            abort(404)
+        if Image is None:
+            return redirect(url_for('static', filename=filename))
+
+        fmt = self._negotiate(os.path.splitext(filename)[1].lower())
+        target = os.path.join(self.cache_dir, str(width), f'{filename}.{fmt}')
+        try:
+            fresh = os.stat(target).st_mtime_ns >= os.stat(source).st_mtime_ns
+        except OSError:
+            fresh = False
+        if not fresh:
+            # Giới hạn số ảnh được mã hóa cùng lúc (AVIF/WebP tốn CPU)
+            with self._encoding:
+                try:
+                    self._render(source, target, width, fmt)
+                except Exception as e:
+                    print(f"Không tạo được ảnh {width}px cho {filename}: {e}")
+                    return redirect(url_for('static', filename=filename))
+
+        resp = send_file(target, mimetype=MIMETYPES[fmt], conditional=True)
+        resp.vary.add('Accept')
+        resp.cache_control.public = True
+        version = request.args.get('v')
+        if version and version == self._version(filename):
+            resp.cache_control.max_age = ONE_YEAR
+            resp.cache_control.immutable = True
+        else:
+            resp.cache_control.no_cache = True
+        return resp
+
+    # ---------- Jinja ----------
+
+    def srcset(self, filename, widths=DEFAULT_WIDTHS):
+        """`url 320w, url 480w, ...`, capped at the source width."""
+        size = self.source_size(filename)
+        if size is None:
+            return ''
+        version = self._version(filename)
+        candidates = [w for w in widths if w in WIDTHS and w < size[0]]
+        if any(w >= size[0] for w in widths):
+            # Không phóng to: bản lớn nhất giữ nguyên chiều rộng ảnh gốc
+            candidates.append(next((w for w in WIDTHS if w >= size[0]), WIDTHS[-1]))
+        return ', '.join(
+            f"{url_for('image_variant', width=w, filename=filename, v=version)} {min(w, size[0])}w"
+            for w in candidates
+        )
+
+    def responsive_img(self, filename, alt='', sizes='100vw', widths=DEFAULT_WIDTHS,
+                       lazy=True, fallback=None, **attrs):
+        """<img> with srcset/sizes for a static image; plain <img> for URLs or without Pillow."""
+        filename = filename or fallback
+        if not filename:
+            return Markup('')
+        if filename.startswith(('http://', 'https://')):
+            src, srcset = filename, ''
+        else:
+            src = url_for('static', filename=filename)
+            srcset = self.srcset(filename, widths) if Image is not None else ''
+
+        html = [f'<img src="{escape(src)}" alt="{escape(alt)}"']
+        if srcset:
+            html.append(f'srcset="{escape(srcset)}" sizes="{escape(sizes)}"')
+        html.append('loading="lazy" decoding="async"' if lazy else 'decoding="async" fetchpriority="high"')
+        for name, value in attrs.items():
+            if value is not None:
+                html.append(f'{name.rstrip("_").replace("_", "-")}="{escape(value)}"')
+        return Markup(' '.join(html) + '>')
+
+
+image_variants = ImageVariants()
@@ -0,0 +1,127 @@
+"""
+Xử lý ảnh upload ngoài luồng request (ảnh CCCD và ảnh loại xe).
+
+Ảnh gốc từ điện thoại (5-12 MB) được lưu ngay như trước để request trả về
+nhanh, sau đó task nền (app/tasks.py, ghi cùng transaction với request) sẽ:
+ - xoay ảnh theo EXIF orientation,
+ - thu nhỏ và lưu bản WebP chính (MASTER_MAX_SIZE) + thumbnail (THUMB_SIZE)
+   vào kho ảnh (app/media_store.py),
+ - cập nhật đường dẫn trong database; ảnh gốc không còn được tham chiếu sẽ
+   được `flask media-gc` dọn.
+
+Nếu không cài Pillow thì mọi hàm đều bỏ qua và giữ nguyên ảnh gốc.
+"""
+import io
+import os
+
+from app import media_store
+from app.tasks import enqueue, task
+from app.models import Customer, Catagory_Motorcycle
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow là dependency tùy chọn ở môi trường dev
+    Image = None
+
+
+MASTER_MAX_SIZE = int(os.getenv('IMAGE_MASTER_MAX_SIZE', '1600'))
+THUMB_SIZE = int(os.getenv('IMAGE_THUMB_SIZE', '320'))
+WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', '80'))
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+
+
+def _encode_webp(img, max_size, quality):
+    resized = img.copy()
+    resized.thumbnail((max_size, max_size))
+    buf = io.BytesIO()
+    resized.save(buf, 'WEBP', quality=quality, method=4)
+    buf.seek(0)
+    return buf
+
+
+def make_variants(session, rel_path, thumbnail=True, perceptual=False):
+    """Store a WebP master (+ thumbnail) of a static image in the media store.
+
+    Returns (master_rel_path, thumb_rel_path or None). Originals inside the
+    store are left for `flask media-gc`; legacy files outside it are removed.
+    """
+    src = os.path.join(STATIC_DIR, rel_path)
+    with Image.open(src) as img:
+        img.load()
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        if rel_path.endswith('.webp') and max(img.size) <= MASTER_MAX_SIZE:
+            # Đã là bản master (ví dụ khách upload lại ảnh trùng)
+            master_rel = rel_path
+        else:
+            master_rel = media_store.store_stream(
+                session, _encode_webp(img, MASTER_MAX_SIZE, WEBP_QUALITY), 'webp', perceptual=perceptual
+            )
+        thumb_rel = None
+        if thumbnail:
+            thumb_rel = media_store.store_stream(
+                session, _encode_webp(img, THUMB_SIZE, WEBP_QUALITY - 5), 'webp', perceptual=False
+            )
+
+    if master_rel != rel_path and not media_store.is_managed(rel_path):
+        try:
+            os.remove(src)
+        except OSError:
+            pass
+    return master_rel, thumb_rel
+
+
+# ---------- tasks ----------
+
+_CUSTOMER_SIDES = {
+    'front': ('citizen_id_front_image', 'citizen_id_front_thumbnail'),
+    'back': ('citizen_id_back_image', 'citizen_id_back_thumbnail'),
+}
+
+
+@task('images.citizen_id')
+def _process_citizen_id(session, customer_id, side, rel_path):
+    image_attr, thumb_attr = _CUSTOMER_SIDES[side]
+    customer = session.get(Customer, customer_id)
+    if customer is None or getattr(customer, image_attr) != rel_path:
+        return  # đã xử lý (task chạy lại) hoặc khách đã đổi ảnh
+    session.rollback()
+    # Ảnh CCCD không dùng perceptual hash: thẻ của hai khách có thể trùng dHash
+    master_rel, thumb_rel = make_variants(session, rel_path, perceptual=False)
+    # Chỉ cập nhật nếu khách hàng chưa upload ảnh khác trong lúc chờ xử lý;
+    # gán qua ORM để media_store đếm lại tham chiếu
+    customer = session.get(Customer, customer_id, with_for_update=True)
+    if customer is not None and getattr(customer, image_attr) == rel_path:
+        setattr(customer, image_attr, master_rel)
+        setattr(customer, thumb_attr, thumb_rel)
+
+
+@task('images.category')
+def _process_category_image(session, category_id, rel_path):
+    category = session.get(Catagory_Motorcycle, category_id)
+    if category is None or category.image != rel_path:
+        return
+    session.rollback()
+    master_rel, _ = make_variants(session, rel_path, thumbnail=False, perceptual=True)
+    category = session.get(Catagory_Motorcycle, category_id, with_for_update=True)
+    if category is not None and category.image == rel_path:
+        category.image = master_rel
+        from app.page_cache import page_cache
+        return lambda: page_cache.invalidate('catalog')
+
+
+def process_customer_images(session, customer_id, front_rel_path=None, back_rel_path=None):
+    """Queue CCCD images of a customer for recompression + thumbnails (committed by the caller)."""
+    if Image is None:
+        return
+    for side, rel_path in (('front', front_rel_path), ('back', back_rel_path)):
+        if rel_path:
+            enqueue(session, 'images.citizen_id', customer_id=customer_id, side=side, rel_path=rel_path)
+
+
+def process_category_image(session, category_id, rel_path):
+    """Queue a catalog image (local static file only) for recompression (committed by the caller)."""
+    if Image is not None and rel_path and not rel_path.startswith('http'):
+        enqueue(session, 'images.category', category_id=category_id, rel_path=rel_path)
@@ -0,0 +1,408 @@
+"""
+Bộ lập lịch job định kỳ (dọn dẹp, đối soát...) chạy ngay trong process web.
+
+ - Job được khai báo bằng `@job(name, 'phút giờ ngày tháng thứ')`, cú pháp
+   cron 5 trường (*, */n, a-b, a-b/n, danh sách a,b; thứ 0 hoặc 7 = Chủ
+   nhật). Các job dọn dẹp nằm trong app/housekeeping.py.
+ - Mỗi process web có một thread `JobScheduler` (app.start_background; lệnh
+   `flask ...` và script không chạy) thức dậy mỗi TICK_SECONDS. Chỉ
+   process giữ lease 'jobs' trong bảng scheduler_lease (gia hạn mỗi tick và
+   giữa các lô, hết hạn sau LEASE_SECONDS) mới chạy job `leader=True`: nhiều
+   worker gunicorn thì mỗi job vẫn chỉ chạy ở một nơi, leader chết thì
+   process khác nhận lease khi hết hạn. Trong lúc job chạy (có thể lâu hơn
+   lease nhiều lần) một thread heartbeat gia hạn lease mỗi LEASE_SECONDS/3,
+   và lượt chạy được "nhận" trước bằng cách dời next_run_at có điều kiện,
+   nên leader mới cũng không chạy lại lượt đang chạy. Job `leader=False`
+   (vd. đẩy bộ đếm trong bộ nhớ xuống DB) chạy trong mọi process.
+ - Lịch (next_run_at) và số đo của từng job leader (số lần chạy / lỗi, thời
+   gian lần cuối / tổng / lâu nhất, kết quả, lỗi) nằm trong bảng
+   scheduled_job; job chạy trong mọi process chỉ có số đo trong bộ nhớ.
+   Lỡ lịch (không có leader) thì chạy bù một lần, không chạy dồn.
+ - Job nhận `JobContext`; `ctx.batches(step, batch_size)` gọi step() (mỗi
+   lần một transaction nhỏ) tới khi hết việc hoặc hết `max_seconds` của job.
+
+`flask jobs-status` xem lịch và số đo, `flask jobs-run NAME` chạy tay.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.models import ScheduledJob, SchedulerLease
+
+
+TICK_SECONDS = float(os.getenv('JOB_SCHEDULER_TICK_SECONDS', '30'))
+LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', str(TICK_SECONDS * 3)))
+LEASE_NAME = 'jobs'
+DEFAULT_MAX_SECONDS = 300
+
+
+# ---------- cron ----------
+
+class Cron:
+    """Five-field cron expression evaluated in local time."""
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f'Lịch cron cần 5 trường: {expr!r}')
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)
+        )
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self._any_day = parts[2] == '*'
+        self._any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(part, low, high):
+        values = set()
+        for item in part.split(','):
+            body, _, step = item.partition('/')
+            try:
+                step = int(step) if step else 1
+                if body == '*':
+                    start, end = low, high
+                elif '-' in body:
+                    start, end = (int(value) for value in body.split('-', 1))
+                else:
+                    start = int(body)
+                    end = high if step > 1 else start
+            except ValueError:
+                raise ValueError(f'Trường cron không hợp lệ: {part!r}')
+            if step < 1 or not low <= start <= end <= high:
+                raise ValueError(f'Trường cron không hợp lệ: {part!r}')
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, moment):
+        in_month = moment.day in self.days
+        in_week = moment.isoweekday() % 7 in self.weekdays
+        # Như cron: khi cả ngày-trong-tháng và thứ đều bị giới hạn thì khớp một trong hai là đủ
+        if self._any_day:
+            return in_week
+        if self._any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, moment):
+        """First matching minute strictly after `moment`."""
+        current = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = current + timedelta(days=366 * 4)
+        while current < limit:
+            if current.month not in self.months:
+                year, month = divmod(current.month, 12)
+                current = current.replace(year=current.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(current):
+                current = (current + timedelta(days=1)).replace(hour=0, minute=0)
+            elif current.hour not in self.hours:
+                current = (current + timedelta(hours=1)).replace(minute=0)
+            elif current.minute not in self.minutes:
+                current += timedelta(minutes=1)
+            else:
+                return current
+        raise ValueError(f'Lịch cron không bao giờ khớp: {self.expr!r}')
+
+
+# ---------- registry ----------
+
+Job = namedtuple('Job', 'name cron func leader max_seconds')
+
+JOBS = {}
+
+
+def job(name, schedule, leader=True, max_seconds=DEFAULT_MAX_SECONDS):
+    """Register `func(ctx)` to run on a cron schedule; its return value is stored as the result."""
+    def decorator(func):
+        JOBS[name] = Job(name, Cron(schedule), func, leader, max_seconds)
+        return func
+    return decorator
+
+
+class JobContext:
+    """What a running job gets: its session and a time-boxed batch loop."""
+
+    def __init__(self, session, job, renew=None):
+        self.session = session
+        self.job = job
+        self._renew = renew
+        self.deadline = time.monotonic() + job.max_seconds
+        self.batches_run = 0
+
+    def time_left(self):
+        return self.deadline - time.monotonic()
+
+    def batches(self, step, batch_size):
+        """Call step() (which commits and returns rows handled) until a short batch or the deadline."""
+        total = 0
+        while True:
+            done = step()
+            total += done
+            self.batches_run += 1
+            if done < batch_size or self.time_left() <= 0:
+                break
+            if self._renew is not None and not self._renew():
+                break   # mất lease: dừng ở đây, leader mới chạy tiếp lần sau
+        return total
+
+
+# ---------- leader lease ----------
+
+class Lease:
+    """Row in scheduler_lease owned by one process until it stops renewing it."""
+
+    def __init__(self, name, seconds=LEASE_SECONDS, engine=None):
+        self.name = name
+        self.seconds = seconds
+        self._engine = engine
+        self._owner = None
+        self._pid = None
+
+    @property
+    def owner(self):
+        # Process con sau fork (gunicorn --preload) phải có owner riêng
+        if self._pid != os.getpid():
+            self._owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self._pid = os.getpid()
+        return self._owner
+
+    def _get_engine(self):
+        if self._engine is None:
+            from app.extensions import get_engine
+            return get_engine()
+        return self._engine
+
+    def acquire(self):
+        """Take or renew the lease; return True if this process holds it."""
+        table = SchedulerLease.__table__
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.seconds)
+        with self._get_engine().begin() as conn:
+            result = conn.execute(
+                update(table)
+                .where(table.c.name == self.name, or_(table.c.owner == self.owner, table.c.expires_at < now))
+                .values(owner=self.owner, expires_at=expires_at)
+            )
+            if result.rowcount:
+                return True
+            if conn.execute(select(table.c.name).where(table.c.name == self.name)).first():
+                return False
+        try:
+            with self._get_engine().begin() as conn:
+                conn.execute(insert(table).values(name=self.name, owner=self.owner, expires_at=expires_at))
+            return True
+        except IntegrityError:
+            return False    # process khác vừa tạo dòng này
+
+    @contextmanager
+    def keep_alive(self):
+        """Renew the lease from a heartbeat thread every seconds/3 while the block runs."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.seconds / 3):
+                try:
+                    self.acquire()
+                except Exception as e:
+                    print(f"Lỗi gia hạn lease {self.name}: {e}")
+
+        thread = threading.Thread(target=beat, name=f'lease-{self.name}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self):
+        table = SchedulerLease.__table__
+        with self._get_engine().begin() as conn:
+            conn.execute(
+                update(table)
+                .where(table.c.name == self.name, table.c.owner == self.owner)
+                .values(expires_at=datetime.now())
+            )
+
+
+# ---------- running ----------
+
+def _empty_stats(name):
+    return {'name': name, 'next_run_at': None, 'last_started_at': None, 'last_finished_at': None,
+            'last_duration_ms': None, 'last_status': None, 'last_result': None, 'last_error': None,
+            'run_count': 0, 'failure_count': 0, 'total_duration_ms': 0, 'max_duration_ms': 0}
+
+
+def _record(stats, started_at, duration_ms, status, result, error, next_run_at):
+    """Update a ScheduledJob row or a local stats dict with one run."""
+    values = {
+        'last_started_at': started_at,
+        'last_finished_at': datetime.now(),
+        'last_duration_ms': duration_ms,
+        'last_status': status,
+        'last_result': None if result is None else str(result)[:255],
+        'last_error': error,
+        'next_run_at': next_run_at,
+    }
+    get = stats.get if isinstance(stats, dict) else lambda key: getattr(stats, key)
+    values['run_count'] = (get('run_count') or 0) + 1
+    values['failure_count'] = (get('failure_count') or 0) + (status != 'ok')
+    values['total_duration_ms'] = (get('total_duration_ms') or 0) + duration_ms
+    values['max_duration_ms'] = max(get('max_duration_ms') or 0, duration_ms)
+    for key, value in values.items():
+        if isinstance(stats, dict):
+            stats[key] = value
+        else:
+            setattr(stats, key, value)
+
+
+def execute(session, job, renew=None):
+    """Run a job once; return (status, result, error, started_at, duration_ms)."""
+    started_at = datetime.now()
+    started = time.perf_counter()
+    result, error = None, None
+    try:
+        result = job.func(JobContext(session, job, renew))
+        status = 'ok'
+    except Exception as e:
+        session.rollback()
+        status, error = 'error', f'{type(e).__name__}: {e}'[:2000]
+        print(f"Lỗi job {job.name}: {error}")
+    return status, result, error, started_at, int((time.perf_counter() - started) * 1000)
+
+
+def run_job(session, job, renew=None):
+    """Run a leader job now and store its timing in scheduled_job; return the status."""
+    status, result, error, started_at, duration_ms = execute(session, job, renew)
+    session.rollback()
+    state = session.get(ScheduledJob, job.name)
+    if state is None:
+        state = ScheduledJob(name=job.name)
+        session.add(state)
+    _record(state, started_at, duration_ms, status, result, error, job.cron.next_after(datetime.now()))
+    session.commit()
+    return status
+
+
+def claim_run(session, job, due_at, now):
+    """Move a due job's next_run_at past `now` before running it; False if another process claimed it."""
+    table = ScheduledJob.__table__
+    claimed = session.execute(
+        update(table).where(table.c.name == job.name, table.c.next_run_at == due_at)
+        .values(next_run_at=job.cron.next_after(now))
+    ).rowcount
+    session.commit()
+    return claimed == 1
+
+
+class JobScheduler:
+    """Per-process thread: local jobs every tick, leader jobs only while holding the lease."""
+
+    def __init__(self):
+        self.lease = Lease(LEASE_NAME)
+        self.local_stats = {}     # name -> dict, số đo job chạy trong mọi process
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        from app.extensions import get_engine, Session
+        get_engine()
+        while not self._stop.wait(TICK_SECONDS):
+            session = Session.session_factory()
+            try:
+                self.tick(session)
+            except Exception as e:
+                print(f"Lỗi bộ lập lịch job: {e}")
+            finally:
+                session.close()
+
+    def tick(self, session, now=None):
+        """Run every job that is due; return the names run."""
+        now = now or datetime.now()
+        ran = self._run_local(session, now)
+        if any(job.leader for job in JOBS.values()) and self.lease.acquire():
+            ran += self._run_leader(session, now)
+        return ran
+
+    def _run_local(self, session, now):
+        ran = []
+        for job in JOBS.values():
+            if job.leader:
+                continue
+            stats = self.local_stats.setdefault(job.name, _empty_stats(job.name))
+            if stats['next_run_at'] is None:
+                stats['next_run_at'] = job.cron.next_after(now)
+            if stats['next_run_at'] > now:
+                continue
+            status, result, error, started_at, duration_ms = execute(session, job)
+            _record(stats, started_at, duration_ms, status, result, error, job.cron.next_after(datetime.now()))
+            ran.append(job.name)
+        return ran
+
+    def _run_leader(self, session, now):
+        ran = []
+        states = {state.name: state.next_run_at for state in session.query(ScheduledJob)}
+        session.rollback()
+        for job in JOBS.values():
+            if not job.leader:
+                continue
+            next_run_at = states.get(job.name)
+            if next_run_at is None:
+                # Job mới: chỉ lên lịch, chạy ở lần khớp đầu tiên
+                state = session.get(ScheduledJob, job.name) or ScheduledJob(name=job.name)
+                state.next_run_at = job.cron.next_after(now)
+                session.add(state)
+                session.commit()
+                continue
+            if next_run_at > now:
+                continue
+            if not self.lease.acquire():
+                break
+            if not claim_run(session, job, next_run_at, now):
+                continue
+            with self.lease.keep_alive():
+                run_job(session, job, renew=self.lease.acquire)
+            ran.append(job.name)
+        return ran
+
+
+scheduler = JobScheduler()
+
+
+def _release_lease():
+    try:
+        scheduler.lease.release()
+    except Exception:
+        pass
+
+
+def init_app(app):
+    from app import housekeeping  # noqa: F401  (đăng ký các job dọn dẹp)
+
+
+def start_scheduler():
+    """Start the scheduler thread of a web process (JOB_SCHEDULER=0 disables it)."""
+    if os.getenv('JOB_SCHEDULER', '1').lower() in ('1', 'true', 'yes'):
+        scheduler.start()
+        # Dừng bình thường thì nhả lease để process khác nhận ngay
+        atexit.register(_release_lease)
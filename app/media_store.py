@@ -0,0 +1,435 @@
+"""
+Kho ảnh upload theo nội dung (content-addressed), dùng chung cho rental.py,
+article.py, motorcycle.py và pipeline ảnh.
+
+ - File được lưu tại static/uploads/store/<ab>/<cd>/<sha256>.<ext>: cùng nội
+   dung thì cùng một file (khách quen upload lại CCCD không tạo file mới), và
+   mỗi thư mục con chỉ chứa một phần nhỏ số file.
+ - Bật UPLOAD_PHASH=1 để so thêm perceptual hash (dHash 64 bit): ảnh bị nén
+   lại / đổi định dạng nhưng trông giống hệt vẫn dùng lại file cũ. Chỉ áp
+   dụng cho ảnh loại xe và ảnh bài viết (perceptual=True); ảnh CCCD của các
+   khách cùng một mẫu thẻ nên có thể trùng dHash, luôn chỉ so sha256.
+ - Bảng `stored_file` đếm số tham chiếu từ Customer, Article (kể cả ảnh
+   nhúng trong nội dung bài viết) và Catagory_Motorcycle bằng ORM event
+   trong cùng transaction.
+ - File không còn ai tham chiếu không bị xóa ngay (có thể đang được dùng bởi
+   request chưa commit); `flask media-gc` đếm lại tham chiếu và dọn file
+   mồ côi cũ hơn thời gian chờ. Upload dùng lại một file làm mới created_at
+   của nó, còn GC chỉ xóa file khi câu DELETE ... WHERE ref_count <= 0 AND
+   created_at < hạn của chính nó xóa được dòng, nên file vừa được dùng lại
+   không bị dọn mất.
+"""
+import base64
+import binascii
+from collections import Counter
+from datetime import datetime, timedelta
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from sqlalchemy import bindparam, delete, event, inspect, update
+from sqlalchemy.exc import IntegrityError
+
+from app.models import Article, Catagory_Motorcycle, Customer, StoredFile
+from app.uploads import UploadError, sniff_image_type
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+STORE_PREFIX = 'uploads/store/'
+STORE_DIR = os.path.join(STATIC_DIR, *STORE_PREFIX.strip('/').split('/'))
+USE_PHASH = os.getenv('UPLOAD_PHASH', '0').lower() in ('1', 'true', 'yes')
+CHUNK_SIZE = 64 * 1024
+
+# Các cột giữ đường dẫn file trong kho
+REFERENCE_COLUMNS = {
+    Customer: ('citizen_id_front_image', 'citizen_id_back_image',
+               'citizen_id_front_thumbnail', 'citizen_id_back_thumbnail'),
+    Article: ('featured_image',),
+    Catagory_Motorcycle: ('image',),
+}
+
+# Cột HTML tham chiếu ảnh trong kho qua URL /static/uploads/store/...
+HTML_COLUMNS = {
+    Article: ('content',),
+}
+
+_STORE_URL_RE = re.compile(
+    r'/static/(' + re.escape(STORE_PREFIX) + r'[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+)'
+)
+_DATA_URI_RE = re.compile(
+    r'''(src\s*=\s*)(["'])data:image/[a-z0-9.+-]+;base64,([A-Za-z0-9+/=\s]+?)\2''', re.IGNORECASE
+)
+
+_listeners_registered = False
+
+
+def is_managed(path):
+    return bool(path) and path.startswith(STORE_PREFIX)
+
+
+def shard_path(sha256, extension):
+    return f'{STORE_PREFIX}{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}'
+
+
+def perceptual_hash(path):
+    """64-bit difference hash as 16 hex chars (None without Pillow / for non-images)."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            pixels = list(img.convert('L').resize((9, 8)).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f'{bits:016x}'
+
+
+def _existing(session, sha256, phash):
+    stored = session.query(StoredFile).filter(StoredFile.sha256 == sha256).first()
+    if stored is None and phash:
+        stored = session.query(StoredFile).filter(StoredFile.phash == phash)\
+            .order_by(StoredFile.id.desc()).first()
+    if stored is None:
+        return None
+    full_path = os.path.join(STATIC_DIR, stored.path)
+    if not os.path.isfile(full_path):
+        return None
+    # Làm mới created_at để media-gc không xóa file mồ côi vừa được dùng lại;
+    # không còn dòng nào thì GC vừa xóa nó -> lưu như file mới
+    refreshed = session.execute(
+        update(StoredFile).where(StoredFile.id == stored.id).values(created_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False},
+    )
+    if refreshed.rowcount != 1:
+        return None
+    try:
+        os.utime(full_path)
+    except OSError:
+        return None
+    return stored
+
+
+def store_stream(session, stream, extension, perceptual=False):
+    """Store the bytes of `stream` and return their static-relative path.
+
+    The data is hashed while being copied to a temp file inside the store,
+    then either discarded (duplicate) or renamed into its shard directory.
+    `perceptual` also reuses a look-alike file (public catalog/article images only).
+    """
+    os.makedirs(STORE_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=STORE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        sha256 = digest.hexdigest()
+        phash = perceptual_hash(tmp_path) if USE_PHASH and perceptual else None
+
+        stored = _existing(session, sha256, phash)
+        if stored is not None:
+            return stored.path
+
+        rel_path = shard_path(sha256, extension)
+        target = os.path.join(STATIC_DIR, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+        tmp_path = None
+
+        try:
+            with session.begin_nested():
+                row = session.query(StoredFile).filter(StoredFile.sha256 == sha256).first()
+                if row is None:
+                    session.add(StoredFile(sha256=sha256, phash=phash, path=rel_path, size=size))
+                elif row.path != rel_path:
+                    return row.path
+        except IntegrityError:
+            # Request khác vừa lưu cùng nội dung
+            pass
+        return rel_path
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def store_upload(session, file, perceptual=False):
+    """Store an uploaded image (werkzeug FileStorage or uploads.UploadedImage).
+
+    The type is taken from the magic bytes; non-images raise UploadError.
+    """
+    stream = file.stream
+    extension = getattr(file, 'extension', None)
+    if extension is None:
+        head = stream.read(12)
+        stream.seek(0)
+        extension = sniff_image_type(head)
+        if extension is None:
+            raise UploadError(f'File {file.filename} không phải ảnh JPG, PNG, GIF hoặc WEBP!', 415)
+    stream.seek(0)
+    return store_stream(session, stream, extension, perceptual=perceptual)
+
+
+# ---------- reference counting ----------
+
+def _tracked_attrs(model):
+    return REFERENCE_COLUMNS.get(model, ()) + HTML_COLUMNS.get(model, ())
+
+
+def _paths_in(model, attr, value):
+    """Managed paths referenced by one column value."""
+    if not value:
+        return []
+    if attr in HTML_COLUMNS.get(model, ()):
+        return _STORE_URL_RE.findall(value)
+    return [value] if is_managed(value) else []
+
+
+def _apply_counts(connection, counts):
+    for path, delta in counts.items():
+        if delta:
+            connection.execute(
+                update(StoredFile)
+                .where(StoredFile.path == path)
+                .values(ref_count=StoredFile.ref_count + delta)
+            )
+
+
+def _after_insert(mapper, connection, target):
+    model = type(target)
+    counts = Counter()
+    for attr in _tracked_attrs(model):
+        counts.update(_paths_in(model, attr, getattr(target, attr)))
+    _apply_counts(connection, counts)
+
+
+def _after_update(mapper, connection, target):
+    model = type(target)
+    state = inspect(target)
+    counts = Counter()
+    for attr in _tracked_attrs(model):
+        history = state.attrs[attr].history
+        if not history.has_changes():
+            continue
+        for value in history.deleted:
+            counts.subtract(_paths_in(model, attr, value))
+        for value in history.added:
+            counts.update(_paths_in(model, attr, value))
+    _apply_counts(connection, counts)
+
+
+def _after_delete(mapper, connection, target):
+    model = type(target)
+    loaded = inspect(target).dict
+    counts = Counter()
+    for attr in _tracked_attrs(model):
+        # Cột chưa load (deferred) không đọc lại được sau DELETE; media-gc sẽ đếm lại
+        counts.subtract(_paths_in(model, attr, loaded.get(attr)))
+    _apply_counts(connection, counts)
+
+
+def register_listeners():
+    """Keep stored_file.ref_count in sync with the referencing columns (call once)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for model in set(REFERENCE_COLUMNS) | set(HTML_COLUMNS):
+        event.listen(model, 'after_insert', _after_insert)
+        event.listen(model, 'after_update', _after_update)
+        event.listen(model, 'after_delete', _after_delete)
+    _listeners_registered = True
+
+
+# ---------- inline images ----------
+
+def extract_inline_images(session, html):
+    """Move base64 data-URI <img> sources into the store.
+
+    Returns (html, moved) with every extracted src rewritten to /static/<path>.
+    Non-image payloads (e.g. SVG placeholders) are left untouched.
+    """
+    if not html or 'data:image' not in html:
+        return html, 0
+    moved = 0
+
+    def replace(match):
+        nonlocal moved
+        try:
+            data = base64.b64decode(match.group(3))
+        except (binascii.Error, ValueError):
+            return match.group(0)
+        extension = sniff_image_type(data[:12])
+        if extension is None:
+            return match.group(0)
+        path = store_stream(session, io.BytesIO(data), extension, perceptual=True)
+        moved += 1
+        return f'{match.group(1)}{match.group(2)}/static/{path}{match.group(2)}'
+
+    return _DATA_URI_RE.sub(replace, html), moved
+
+
+def extract_article_images(session, batch_size=20, dry_run=False):
+    """One-off pass moving inline images out of existing Article.content rows.
+
+    Returns (articles_changed, images_moved, bytes_saved).
+    """
+    ids = [article_id for (article_id,) in session.query(Article.id)
+           .filter(Article.content.like('%data:image%')).order_by(Article.id)]
+    changed, moved_total, saved = 0, 0, 0
+    for offset in range(0, len(ids), batch_size):
+        for article in session.query(Article).filter(Article.id.in_(ids[offset:offset + batch_size])):
+            before = len(article.content or '')
+            if dry_run:
+                moved = len(_DATA_URI_RE.findall(article.content or ''))
+                content = None
+            else:
+                content, moved = extract_inline_images(session, article.content)
+            if not moved:
+                continue
+            changed += 1
+            moved_total += moved
+            if content is not None:
+                saved += before - len(content)
+                article.content = content
+        if not dry_run:
+            session.commit()
+        session.expunge_all()
+    return changed, moved_total, saved
+
+
+# ---------- garbage collection ----------
+
+def count_references(session):
+    """Exact reference count per managed path, straight from the source columns."""
+    counts = Counter()
+    for model, attrs in REFERENCE_COLUMNS.items():
+        for attr in attrs:
+            column = getattr(model, attr)
+            rows = session.query(column).filter(column.like(STORE_PREFIX + '%'))
+            counts.update(path for (path,) in rows)
+    for model, attrs in HTML_COLUMNS.items():
+        for attr in attrs:
+            column = getattr(model, attr)
+            rows = session.query(column).filter(column.like('%/static/' + STORE_PREFIX + '%'))
+            for (html,) in rows:
+                counts.update(_STORE_URL_RE.findall(html))
+    return counts
+
+
+def collect_garbage(session, grace=timedelta(hours=24), dry_run=False):
+    """Recount references, then delete unreferenced files older than `grace`.
+
+    Returns (recounted_rows, removed_files, freed_bytes).
+    """
+    counts = count_references(session)
+    fixes = [
+        {'file_id': file_id, 'old_count': ref_count, 'new_count': counts.get(path, 0)}
+        for file_id, path, ref_count in session.query(StoredFile.id, StoredFile.path, StoredFile.ref_count)
+        if ref_count != counts.get(path, 0)
+    ]
+    if fixes and not dry_run:
+        # Chỉ sửa dòng chưa đổi từ lúc đếm: tham chiếu mới của request khác không bị ghi đè
+        table = StoredFile.__table__
+        session.execute(
+            update(table).where(table.c.id == bindparam('file_id'), table.c.ref_count == bindparam('old_count'))
+            .values(ref_count=bindparam('new_count')),
+            fixes,
+        )
+        session.commit()
+
+    cutoff = datetime.utcnow() - grace
+    cutoff_ts = cutoff.timestamp()
+    removed, freed = 0, 0
+    orphans = session.query(StoredFile.id, StoredFile.path, StoredFile.size)\
+        .filter(StoredFile.ref_count <= 0, StoredFile.created_at < cutoff).all()
+    session.rollback()
+    for file_id, path, size in orphans:
+        if counts.get(path):
+            continue
+        if not dry_run:
+            # Upload vừa dùng lại file (created_at mới / ref_count tăng) thì DELETE không khớp
+            deleted = session.execute(delete(StoredFile).where(
+                StoredFile.id == file_id, StoredFile.ref_count <= 0, StoredFile.created_at < cutoff
+            )).rowcount
+            session.commit()
+            if deleted != 1:
+                continue
+            full_path = os.path.join(STATIC_DIR, path)
+            try:
+                # File vừa được ghi lại (cùng nội dung, sau khi dòng đã xóa) thì giữ
+                if os.stat(full_path).st_mtime < cutoff_ts:
+                    os.remove(full_path)
+            except OSError:
+                pass
+        removed += 1
+        freed += size or 0
+
+    # File trong kho không có dòng stored_file (ghi dở khi process bị dừng)
+    known = {path for (path,) in session.query(StoredFile.path)}
+    for root, _, files in os.walk(STORE_DIR):
+        for name in files:
+            full_path = os.path.join(root, name)
+            rel_path = os.path.relpath(full_path, STATIC_DIR).replace(os.sep, '/')
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            if rel_path in known or st.st_mtime > cutoff_ts:
+                continue
+            removed += 1
+            freed += st.st_size
+            if not dry_run:
+                try:
+                    os.remove(full_path)
+                except OSError:
+                    pass
+    return len(fixes), removed, freed
+
+
+def move_into_store(session, rel_path, perceptual=False):
+    """Copy a legacy static file into the store; return its new path (or None)."""
+    full_path = os.path.join(STATIC_DIR, rel_path)
+    if not os.path.isfile(full_path):
+        return None
+    with open(full_path, 'rb') as f:
+        extension = sniff_image_type(f.read(12))
+        if extension is None:
+            return None
+        f.seek(0)
+        return store_stream(session, f, extension, perceptual=perceptual)
+
+
+def import_legacy_files(session, dry_run=False):
+    """Point every non-store local image path at a store copy (old files are left in place)."""
+    moved = 0
+    for model, attrs in REFERENCE_COLUMNS.items():
+        for row in session.query(model).all():
+            for attr in attrs:
+                path = getattr(row, attr)
+                if not path or is_managed(path) or path.startswith('http'):
+                    continue
+                if dry_run:
+                    moved += 1
+                    continue
+                new_path = move_into_store(session, path, perceptual=model is not Customer)
+                if new_path:
+                    setattr(row, attr, new_path)
+                    moved += 1
+        if not dry_run:
+            session.commit()
+    return moved
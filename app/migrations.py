@@ -0,0 +1,288 @@
+"""
+Migration có đánh số phiên bản cho schema (thay cho việc chỉ dựa vào create_all).
+
+create_all chỉ tạo bảng mới, không thêm index/cột vào bảng đã có. Mỗi
+migration dưới đây là một hàm nhận connection, được áp dụng đúng một lần và
+ghi vào bảng `schema_migration`. Trên PostgreSQL toàn bộ lượt upgrade giữ
+advisory lock để nhiều worker khởi động cùng lúc không chạy trùng.
+
+Thêm migration mới: viết hàm `_NNNN_xxx(conn, echo)` và thêm vào
+MIGRATIONS. Index được khai báo tường minh trong từng migration (không đọc
+từ models.py, vì models luôn là schema mới nhất): mỗi index được tạo ở
+migration thêm cột của nó.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from app import search
+from app.models import (
+    Base, DeadTask, IdBlock, PaymentSummaryDelta, ScheduledJob, SchedulerLease, SchemaMigration, SearchDocument,
+    StoredFile, Task, TaskStat, VnpayInbox,
+)
+
+
+_ADVISORY_LOCK_KEY = 727_001
+
+
+def _create_indexes(conn, indexes):
+    """CREATE INDEX IF NOT EXISTS for (name, table, columns[, unique]) tuples."""
+    for name, table_name, columns, *unique in indexes:
+        kind = 'UNIQUE INDEX' if unique and unique[0] else 'INDEX'
+        conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table_name} ({', '.join(columns)})"))
+
+
+def _0001_hot_lookup_indexes(conn, echo):
+    """Indexes for the lookups in payment_return, admin lists and the public pages."""
+    conn.execute(text("DROP INDEX IF EXISTS ix_motorcycles_license"))
+    _create_indexes(conn, [
+        ('ix_motorcycles_category_id', 'motorcycles', ('category_id',)),
+        ('ix_rental_customer_created', 'rental', ('customer_id', 'created_at')),
+        ('ix_rental_created_id', 'rental', ('created_at', 'id')),
+        ('ix_rental_status_created', 'rental', ('status', 'created_at')),
+        ('ix_rental_vnpay_transaction_id', 'rental', ('vnpay_transaction_id',)),
+        ('ix_rental_item_rental_id', 'rental_item', ('rental_id',)),
+        ('ix_rental_item_motorcycle_id', 'rental_item', ('motorcycle_id',)),
+        # Thay bằng ux_payment_payment_code ở 0005, sau khi sửa các mã trùng
+        ('ix_payment_payment_code', 'payment', ('payment_code',)),
+        ('ix_payment_rental_id', 'payment', ('rental_id',)),
+        ('ix_payment_status_id', 'payment', ('payment_status', 'id')),
+        ('ix_customer_created_id', 'customer', ('created_at', 'id')),
+        ('ix_article_published', 'article', ('is_published', 'published_at')),
+        ('ix_article_published_created', 'article', ('is_published', 'created_at')),
+    ])
+
+
+def _add_columns(conn, table_name, column_names):
+    """ALTER TABLE ADD COLUMN for columns declared in models but missing in the DB."""
+    existing = {column['name'] for column in inspect(conn).get_columns(table_name)}
+    table = Base.metadata.tables[table_name]
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {name} {column_type}'))
+
+
+def _0002_customer_image_thumbnails(conn, echo):
+    """Thumbnail paths produced by the image pipeline."""
+    _add_columns(conn, 'customer', ('citizen_id_front_thumbnail', 'citizen_id_back_thumbnail'))
+
+
+def _0003_stored_file(conn, echo):
+    """Content-addressed upload store; ref counts are filled by `flask media-gc`."""
+    StoredFile.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, [
+        ('ix_stored_file_phash', 'stored_file', ('phash',)),
+        ('ix_stored_file_refs_created', 'stored_file', ('ref_count', 'created_at')),
+    ])
+
+
+def _0004_vnpay_inbox(conn, echo):
+    """Inbox for VNPay IPN / return callbacks."""
+    VnpayInbox.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, [
+        ('ux_vnpay_inbox_txn', 'vnpay_inbox', ('txn_ref', 'transaction_no'), True),
+        ('ix_vnpay_inbox_pending', 'vnpay_inbox', ('processed_at', 'id')),
+    ])
+
+
+def _0005_order_ids(conn, echo):
+    """Block counter for order IDs and a unique payment_code.
+
+    Codes that already collided (old random suffix) keep the oldest row; the
+    newer ones get `-<id>` appended so the unique index can be built.
+    """
+    IdBlock.__table__.create(conn, checkfirst=True)
+    duplicates = conn.execute(text(
+        "SELECT p.id, p.payment_code FROM payment p"
+        " WHERE p.payment_code IS NOT NULL AND EXISTS ("
+        "   SELECT 1 FROM payment o WHERE o.payment_code = p.payment_code AND o.id < p.id)"
+    )).fetchall()
+    for payment_id, code in duplicates:
+        conn.execute(text("UPDATE payment SET payment_code = :code WHERE id = :id"),
+                     {'code': f'{code}-{payment_id}', 'id': payment_id})
+        echo(f"payment #{payment_id}: mã trùng {code} -> {code}-{payment_id}")
+    conn.execute(text("DROP INDEX IF EXISTS ix_payment_payment_code"))
+    _create_indexes(conn, [('ux_payment_payment_code', 'payment', ('payment_code',), True)])
+
+
+def _0006_row_versions(conn, echo):
+    """version columns for optimistic locking of rental / payment."""
+    for table_name in ('rental', 'payment'):
+        existing = {column['name'] for column in inspect(conn).get_columns(table_name)}
+        if 'version' not in existing:
+            conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+
+
+def _0007_rental_item_tier_prices(conn, echo):
+    """Week / month prices snapshotted on rental items."""
+    _add_columns(conn, 'rental_item', ('price_per_week', 'price_per_month'))
+
+
+def _0008_booking_holds(conn, echo):
+    """Payment deadline of pending bookings."""
+    _add_columns(conn, 'rental', ('hold_expires_at',))
+    _create_indexes(conn, [('ix_rental_status_hold', 'rental', ('status', 'hold_expires_at'))])
+
+
+def _0009_job_scheduler(conn, echo):
+    """Leader lease and per-job state for the periodic job scheduler."""
+    SchedulerLease.__table__.create(conn, checkfirst=True)
+    ScheduledJob.__table__.create(conn, checkfirst=True)
+
+
+def _0010_task_queue(conn, echo):
+    """Background task queue, dead letters and per-task metrics."""
+    for model in (Task, DeadTask, TaskStat):
+        model.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, [
+        ('ix_task_queue_claim', 'task_queue', ('status', 'run_at', 'id')),
+        ('ix_task_dead_letter_name', 'task_dead_letter', ('name', 'id')),
+    ])
+
+
+def _0011_payment_summary_deltas(conn, echo):
+    """Append-only payment_summary deltas; summary rows filled and pre-seeded so writers never insert them."""
+    PaymentSummaryDelta.__table__.create(conn, checkfirst=True)
+    now = datetime.utcnow()
+    if conn.execute(text("SELECT COUNT(*) FROM payment_summary")).scalar() == 0:
+        conn.execute(text(
+            "INSERT INTO payment_summary (payment_status, payment_count, total_amount, updated_at)"
+            " SELECT COALESCE(payment_status, ''), COUNT(*), COALESCE(SUM(amount), 0), :now"
+            " FROM payment GROUP BY COALESCE(payment_status, '')"
+        ), {'now': now})
+    for status in ('', 'pending', 'paid', 'failed'):
+        exists = conn.execute(text("SELECT 1 FROM payment_summary WHERE payment_status = :status"),
+                              {'status': status}).first()
+        if exists is None:
+            conn.execute(text(
+                "INSERT INTO payment_summary (payment_status, payment_count, total_amount, updated_at)"
+                " VALUES (:status, 0, 0, :now)"
+            ), {'status': status, 'now': now})
+
+
+def _0012_clear_citizen_id_phash(conn, echo):
+    """CCCD images must never be matched by perceptual hash; drop the hashes already stored."""
+    columns = ('citizen_id_front_image', 'citizen_id_back_image',
+               'citizen_id_front_thumbnail', 'citizen_id_back_thumbnail')
+    paths = ' UNION '.join(f'SELECT {column} FROM customer WHERE {column} IS NOT NULL' for column in columns)
+    result = conn.execute(text(f"UPDATE stored_file SET phash = NULL WHERE phash IS NOT NULL AND path IN ({paths})"))
+    if result.rowcount:
+        echo(f"Đã bỏ perceptual hash của {result.rowcount} ảnh CCCD")
+
+
+def _0013_search_documents(conn, echo):
+    """Index the customers, rentals and payments that predate the search listeners."""
+    SearchDocument.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, [('ux_search_document_kind_ref', 'search_document', ('kind', 'ref_id'), True)])
+    search.create_search_schema(conn)
+    total = search.reindex(conn)
+    echo(f"Đã đánh chỉ mục tìm kiếm cho {total} khách / đơn / thanh toán")
+
+
+MIGRATIONS = [
+    ('0001', 'Composite indexes for hot lookup columns', _0001_hot_lookup_indexes),
+    ('0002', 'Customer CCCD thumbnail columns', _0002_customer_image_thumbnails),
+    ('0003', 'Content-addressed upload store', _0003_stored_file),
+    ('0004', 'VNPay callback inbox', _0004_vnpay_inbox),
+    ('0005', 'Order ID blocks, unique payment_code', _0005_order_ids),
+    ('0006', 'Row versions for rental / payment', _0006_row_versions),
+    ('0007', 'Week / month prices on rental items', _0007_rental_item_tier_prices),
+    ('0008', 'Expiring holds on pending bookings', _0008_booking_holds),
+    ('0009', 'Periodic job scheduler tables', _0009_job_scheduler),
+    ('0010', 'Background task queue', _0010_task_queue),
+    ('0011', 'Append-only payment summary deltas', _0011_payment_summary_deltas),
+    ('0012', 'No perceptual hash on CCCD images', _0012_clear_citizen_id_phash),
+    ('0013', 'Backfill admin search documents', _0013_search_documents),
+]
+
+
+def applied_versions(conn):
+    if not inspect(conn).has_table(SchemaMigration.__tablename__):
+        return set()
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migration"))}
+
+
+def pending_migrations(engine):
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return [migration for migration in MIGRATIONS if migration[0] not in done]
+
+
+def _quiet(message):
+    pass
+
+
+def upgrade(engine, echo=print):
+    """Apply every pending migration in order; return the versions applied."""
+    applied = []
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': _ADVISORY_LOCK_KEY})
+        SchemaMigration.__table__.create(conn, checkfirst=True)
+        done = applied_versions(conn)
+        for version, description, func in MIGRATIONS:
+            if version in done:
+                continue
+            func(conn, echo or _quiet)
+            conn.execute(SchemaMigration.__table__.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+            applied.append(version)
+            if echo:
+                echo(f"Đã áp dụng migration {version}: {description}")
+    return applied
+
+
+def current_version(engine):
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return max(done) if done else None
+
+
+# ---------- EXPLAIN check ----------
+
+def hot_queries(session):
+    """(name, query) pairs for the lookups the routes depend on."""
+    from app.models import Article, Payment, Rental, RentalItem, Customer
+    from sqlalchemy import desc
+
+    return [
+        ('payment by payment_code', session.query(Payment).filter(Payment.payment_code == 'X')),
+        ('rental by vnpay_transaction_id', session.query(Rental).filter(Rental.vnpay_transaction_id == 'X')),
+        ('payments of rental', session.query(Payment).filter(Payment.rental_id == 1)),
+        ('rental items of rental', session.query(RentalItem).filter(RentalItem.rental_id == 1)),
+        ('rental items of motorcycle', session.query(RentalItem).filter(RentalItem.motorcycle_id == 1)),
+        ('rentals of customer', session.query(Rental).filter(Rental.customer_id == 1)
+            .order_by(desc(Rental.created_at))),
+        ('rentals by status', session.query(Rental).filter(Rental.status == 'pending')
+            .order_by(desc(Rental.created_at)).limit(20)),
+        ('rental list page', session.query(Rental).order_by(desc(Rental.created_at), desc(Rental.id)).limit(20)),
+        ('customer list page', session.query(Customer).order_by(desc(Customer.created_at), desc(Customer.id)).limit(20)),
+        ('payments by status', session.query(Payment).filter(Payment.payment_status == 'paid')
+            .order_by(desc(Payment.id)).limit(20)),
+        ('published articles', session.query(Article).filter(Article.is_published == True)
+            .order_by(desc(Article.published_at))),
+    ]
+
+
+def explain_uses_index(session, query):
+    """Return (uses_index, plan_text) for a query on PostgreSQL or SQLite."""
+    bind = session.get_bind()
+    dialect = bind.dialect.name
+    sql = str(query.statement.compile(bind, compile_kwargs={'literal_binds': True}))
+    if dialect == 'postgresql':
+        # Bảng nhỏ thì planner chọn seq scan; tắt để kiểm tra index có dùng được không
+        session.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = '\n'.join(row[0] for row in session.execute(text('EXPLAIN ' + sql)))
+        session.rollback()
+        return ('Index' in plan), plan
+    if dialect == 'sqlite':
+        rows = session.execute(text('EXPLAIN QUERY PLAN ' + sql)).all()
+        plan = '\n'.join(str(row[-1]) for row in rows)
+        scans = [line for line in plan.splitlines() if line.startswith(('SCAN', 'SEARCH'))]
+        uses_index = bool(scans) and all('INDEX' in line or 'PRIMARY KEY' in line for line in scans[:1])
+        return uses_index, plan
+    raise RuntimeError(f'EXPLAIN check không hỗ trợ {dialect}')
@@ -9,6 +9,18 @@ Includes models for:
  - Rental
  - RentalItem
  - Payment
+ - PaymentSummary
+ - PaymentSummaryDelta
+ - SearchDocument
+ - SchemaMigration
+ - StoredFile
+ - VnpayInbox
+ - IdBlock
+ - SchedulerLease
+ - ScheduledJob
+ - Task
+ - DeadTask
+ - TaskStat
 
 Run this file directly to create tables using DATABASE_URL from .env.
 """
@@ -19,6 +31,7 @@ import os
 from sqlalchemy import (
     Column,
     Integer,
+    BigInteger,
     String,
     Text,
     DateTime,
@@ -136,6 +149,8 @@ class Customer(Base, TimestampMixin):
     citizen_id = Column(String(100), nullable=True, unique=True)
     citizen_id_front_image = Column(String(1000), nullable=True)
     citizen_id_back_image = Column(String(1000), nullable=True)
+    citizen_id_front_thumbnail = Column(String(1000), nullable=True)
+    citizen_id_back_thumbnail = Column(String(1000), nullable=True)
     driver_license_number = Column(String(100), nullable=True)
     driver_license_image = Column(String(1000), nullable=True)
 
@@ -164,11 +179,17 @@ class Rental(Base, TimestampMixin):
     vnpay_transaction_id = Column(String(255), nullable=True)
     vnpay_bank_code = Column(String(100), nullable=True)
     notes = Column(Text, nullable=True)
+    # Đơn 'pending' tự hủy sau thời điểm này (giờ UTC) nếu chưa thanh toán (app/booking_holds.py)
+    hold_expires_at = Column(DateTime, nullable=True)
+    # Optimistic lock: every ORM UPDATE checks and bumps it (StaleDataError on conflict)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     customer = relationship("Customer", back_populates="rentals")
     items = relationship("RentalItem", back_populates="rental", cascade="all, delete-orphan")
     payments = relationship("Payment", back_populates="rental", cascade="all, delete-orphan")
 
+    __mapper_args__ = {"version_id_col": version}
+
     def __repr__(self):
         return f"<Rental id={self.id} customer_id={self.customer_id} status={self.status!r}>"
 
@@ -180,6 +201,8 @@ class RentalItem(Base):
     rental_id = Column(Integer, ForeignKey("rental.id", ondelete="CASCADE"), nullable=False)
     motorcycle_id = Column(Integer, ForeignKey("motorcycles.id", ondelete="SET NULL"), nullable=True)
     price_per_day = Column(Numeric(12, 2), nullable=True)
+    price_per_week = Column(Numeric(12, 2), nullable=True)
+    price_per_month = Column(Numeric(12, 2), nullable=True)
     rental = relationship("Rental", back_populates="items")
     motorcycle = relationship("Motorcycles")
 
@@ -200,15 +223,226 @@ class Payment(Base):
     vnpay_bank_code = Column(String(100), nullable=True)
     vnpay_pay_date = Column(DateTime, nullable=True)
     payment_date = Column(DateTime, nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     rental = relationship("Rental", back_populates="payments")
 
+    __mapper_args__ = {"version_id_col": version}
+
     def __repr__(self):
         return f"<Payment id={self.id} rental_id={self.rental_id} amount={self.amount}>"
 
 
-# helpful indexes
-Index("ix_motorcycles_license", Motorcycles.license_plate)
+class PaymentSummary(Base):
+    """Running count/amount of payments per payment_status (admin stats panel)."""
+    __tablename__ = "payment_summary"
+
+    payment_status = Column(String(100), primary_key=True)
+    payment_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Numeric(14, 2), nullable=False, default=Decimal("0.00"))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<PaymentSummary status={self.payment_status!r} count={self.payment_count}>"
+
+
+class PaymentSummaryDelta(Base):
+    """Append-only change to payment_summary, folded into it by app/payment_stats.fold."""
+    __tablename__ = "payment_summary_delta"
+
+    id = Column(Integer, primary_key=True)
+    payment_status = Column(String(100), nullable=False)
+    count_delta = Column(Integer, nullable=False, default=0)
+    amount_delta = Column(Numeric(14, 2), nullable=False, default=Decimal("0.00"))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<PaymentSummaryDelta status={self.payment_status!r} count={self.count_delta}>"
+
+
+class SearchDocument(Base):
+    """Normalized (lowercase, no diacritics) text used by the admin search boxes."""
+    __tablename__ = "search_document"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)
+    ref_id = Column(Integer, nullable=False)
+    document = Column(Text, nullable=False, default="")
+
+    def __repr__(self):
+        return f"<SearchDocument kind={self.kind!r} ref_id={self.ref_id}>"
+
+
+class SchemaMigration(Base):
+    """Versions applied by app/migrations.py."""
+    __tablename__ = "schema_migration"
+
+    version = Column(String(50), primary_key=True)
+    description = Column(String(255), nullable=True)
+    applied_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<SchemaMigration version={self.version!r}>"
+
+
+class StoredFile(Base):
+    """Content-addressed upload (see app/media_store.py), shared by every row pointing at `path`."""
+    __tablename__ = "stored_file"
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    phash = Column(String(16), nullable=True)
+    path = Column(String(255), nullable=False, unique=True)
+    size = Column(Integer, nullable=False, default=0)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<StoredFile path={self.path!r} refs={self.ref_count}>"
+
+
+class VnpayInbox(Base):
+    """Every verified VNPay callback (IPN or return), once per TxnRef + TransactionNo."""
+    __tablename__ = "vnpay_inbox"
+
+    id = Column(Integer, primary_key=True)
+    txn_ref = Column(String(255), nullable=False)
+    transaction_no = Column(String(255), nullable=False, default="")
+    source = Column(String(20), nullable=False, default="ipn")
+    payload = Column(Text, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = Column(DateTime, nullable=True)
+    result = Column(String(50), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+    def __repr__(self):
+        return f"<VnpayInbox txn_ref={self.txn_ref!r} transaction_no={self.transaction_no!r} result={self.result!r}>"
+
+
+class IdBlock(Base):
+    """Next free value of a counter handed out in blocks (see app/order_ids.py)."""
+    __tablename__ = "id_block"
+
+    name = Column(String(50), primary_key=True)
+    next_value = Column(BigInteger, nullable=False, default=1)
+
+    def __repr__(self):
+        return f"<IdBlock name={self.name!r} next_value={self.next_value}>"
+
+
+class SchedulerLease(Base):
+    """Time-limited leadership of a background role (see app/jobs.py)."""
+    __tablename__ = "scheduler_lease"
+
+    name = Column(String(50), primary_key=True)
+    owner = Column(String(255), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<SchedulerLease name={self.name!r} owner={self.owner!r}>"
+
+
+class ScheduledJob(Base):
+    """Schedule state and timing metrics of one periodic job."""
+    __tablename__ = "scheduled_job"
+
+    name = Column(String(100), primary_key=True)
+    next_run_at = Column(DateTime, nullable=True)
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True)
+    last_duration_ms = Column(Integer, nullable=True)
+    last_status = Column(String(20), nullable=True)
+    last_result = Column(String(255), nullable=True)
+    last_error = Column(Text, nullable=True)
+    run_count = Column(Integer, nullable=False, default=0)
+    failure_count = Column(Integer, nullable=False, default=0)
+    total_duration_ms = Column(BigInteger, nullable=False, default=0)
+    max_duration_ms = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ScheduledJob name={self.name!r} last_status={self.last_status!r}>"
+
+
+class Task(Base):
+    """Queued background task (see app/tasks.py); deleted once it succeeds."""
+    __tablename__ = "task_queue"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False, default="{}")
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    locked_by = Column(String(255), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    def __repr__(self):
+        return f"<Task id={self.id} name={self.name!r} status={self.status!r}>"
+
+
+class DeadTask(Base):
+    """Task that failed max_attempts times, kept for inspection / manual retry."""
+    __tablename__ = "task_dead_letter"
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, nullable=False)
+    name = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    failed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<DeadTask id={self.id} name={self.name!r}>"
+
+
+class TaskStat(Base):
+    """Running totals per task name: outcomes, queue latency and run time."""
+    __tablename__ = "task_stat"
+
+    name = Column(String(100), primary_key=True)
+    succeeded = Column(Integer, nullable=False, default=0)
+    retried = Column(Integer, nullable=False, default=0)
+    dead = Column(Integer, nullable=False, default=0)
+    total_latency_ms = Column(BigInteger, nullable=False, default=0)
+    max_latency_ms = Column(BigInteger, nullable=False, default=0)
+    total_run_ms = Column(BigInteger, nullable=False, default=0)
+    max_run_ms = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<TaskStat name={self.name!r} succeeded={self.succeeded}>"
+
+
+# helpful indexes (existing databases get each one from the migration that added it)
+# license_plate đã unique nên không cần index riêng
+Index("ix_motorcycles_category_id", Motorcycles.category_id)
+Index("ix_rental_customer_created", Rental.customer_id, Rental.created_at)
+Index("ix_rental_created_id", Rental.created_at, Rental.id)
+Index("ix_rental_status_created", Rental.status, Rental.created_at)
+Index("ix_rental_vnpay_transaction_id", Rental.vnpay_transaction_id)
+Index("ix_rental_status_hold", Rental.status, Rental.hold_expires_at)
+Index("ix_rental_item_rental_id", RentalItem.rental_id)
+Index("ix_rental_item_motorcycle_id", RentalItem.motorcycle_id)
+Index("ux_payment_payment_code", Payment.payment_code, unique=True)
+Index("ix_payment_rental_id", Payment.rental_id)
+Index("ix_payment_status_id", Payment.payment_status, Payment.id)
+Index("ix_customer_created_id", Customer.created_at, Customer.id)
+Index("ix_article_published", Article.is_published, Article.published_at)
+Index("ix_article_published_created", Article.is_published, Article.created_at)
+Index("ux_search_document_kind_ref", SearchDocument.kind, SearchDocument.ref_id, unique=True)
+Index("ix_stored_file_phash", StoredFile.phash)
+Index("ix_stored_file_refs_created", StoredFile.ref_count, StoredFile.created_at)
+Index("ux_vnpay_inbox_txn", VnpayInbox.txn_ref, VnpayInbox.transaction_no, unique=True)
+Index("ix_vnpay_inbox_pending", VnpayInbox.processed_at, VnpayInbox.id)
+Index("ix_task_queue_claim", Task.status, Task.run_at, Task.id)
+Index("ix_task_dead_letter_name", DeadTask.name, DeadTask.id)
 
 
 def create_tables(url=None):
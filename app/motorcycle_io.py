@@ -0,0 +1,233 @@
+"""
+Nhập / xuất danh sách xe hàng loạt (CSV, hoặc XLSX nếu cài openpyxl).
+
+Cột của file nhập (dòng đầu là tiêu đề, thứ tự tùy ý):
+  license_plate (bắt buộc), category_id hoặc category (tên loại xe),
+  model_year, status (ready / rented / maintenance, mặc định ready),
+  description. Các cột khác (vd. id trong file xuất) được bỏ qua.
+
+Mọi dòng được kiểm tra trong bộ nhớ: loại xe tra trong một lần đọc bảng
+loại xe, biển số trùng trong file hoặc đã có trong DB (truy vấn IN theo lô
+PLATE_CHUNK biển số) đều báo lỗi theo số dòng. Dòng hợp lệ được ghi bằng
+bulk_insert_mappings theo lô INSERT_BATCH trong một transaction, nên 100k
+xe chỉ tốn vài trăm câu lệnh. Xuất CSV đọc theo lô (yield_per) và trả về
+từng dòng, không giữ cả bảng trong bộ nhớ.
+"""
+import csv
+from datetime import datetime
+import io
+
+from sqlalchemy import func
+
+from app.availability import availability_index
+from app.models import Catagory_Motorcycle, Motorcycles
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl là dependency tùy chọn, chỉ cần cho file .xlsx
+    openpyxl = None
+
+
+STATUSES = ('ready', 'rented', 'maintenance')
+COLUMNS = ('id', 'license_plate', 'category_id', 'category', 'model_year', 'status', 'description')
+PLATE_CHUNK = 900       # dưới giới hạn 999 tham số của SQLite cũ
+INSERT_BATCH = 1000
+EXPORT_BATCH = 2000
+MAX_PLATE_LENGTH = Motorcycles.license_plate.type.length
+
+
+class ImportFileError(ValueError):
+    """The file itself cannot be read (format, missing header...)."""
+
+
+# ---------- đọc file ----------
+
+def _clean(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)      # ô số trong Excel (2021.0)
+    return str(value).strip()
+
+
+def _csv_rows(stream):
+    text = stream.read().decode('utf-8-sig', errors='replace')
+    try:
+        # Excel bản tiếng Việt thường lưu CSV bằng dấu ';'
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(text), dialect)
+
+
+def _xlsx_rows(stream):
+    if openpyxl is None:
+        raise ImportFileError('Chưa cài openpyxl, hãy dùng file CSV')
+    try:
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFileError(f'Không đọc được file Excel: {e}')
+    return workbook.active.iter_rows(values_only=True)
+
+
+def read_rows(stream, filename):
+    """Yield (line_number, {column: text}) for every non-empty data row of a CSV/XLSX file."""
+    name = (filename or '').lower()
+    if name.endswith('.xlsx'):
+        rows = _xlsx_rows(stream)
+    elif name.endswith(('.csv', '.txt')) or not name:
+        rows = _csv_rows(stream)
+    else:
+        raise ImportFileError('Chỉ hỗ trợ file .csv hoặc .xlsx')
+
+    rows = iter(rows)
+    header = [_clean(cell).lower() for cell in next(rows, None) or ()]
+    if 'license_plate' not in header:
+        raise ImportFileError('Thiếu cột license_plate ở dòng tiêu đề')
+    if 'category_id' not in header and 'category' not in header:
+        raise ImportFileError('Thiếu cột category_id hoặc category ở dòng tiêu đề')
+    for line, cells in enumerate(rows, start=2):
+        values = {column: _clean(cell) for column, cell in zip(header, cells) if column}
+        if any(values.values()):
+            yield line, values
+
+
+# ---------- kiểm tra + ghi ----------
+
+def _existing_plates(session, plates):
+    found = set()
+    plates = list(plates)
+    for i in range(0, len(plates), PLATE_CHUNK):
+        chunk = plates[i:i + PLATE_CHUNK]
+        found.update(row[0] for row in session.query(Motorcycles.license_plate)
+                     .filter(Motorcycles.license_plate.in_(chunk)).all())
+    return found
+
+
+def validate(session, rows):
+    """Check rows in memory; return (mappings ready to insert, [(line, message)] errors)."""
+    categories = session.query(Catagory_Motorcycle.id, Catagory_Motorcycle.name).all()
+    category_ids = {category_id for category_id, _ in categories}
+    category_names = {}
+    for category_id, name in categories:
+        category_names.setdefault((name or '').strip().lower(), category_id)
+
+    now = datetime.utcnow()
+    valid, errors, seen = [], [], {}
+    for line, values in rows:
+        plate = values.get('license_plate', '')
+        if not plate:
+            errors.append((line, 'Biển số xe là bắt buộc'))
+            continue
+        if len(plate) > MAX_PLATE_LENGTH:
+            errors.append((line, f'Biển số dài quá {MAX_PLATE_LENGTH} ký tự'))
+            continue
+        if plate in seen:
+            errors.append((line, f'Biển số {plate} trùng với dòng {seen[plate]}'))
+            continue
+        seen[plate] = line
+
+        raw_category = values.get('category_id', '')
+        if raw_category:
+            category_id = int(raw_category) if raw_category.isdigit() else None
+            if category_id not in category_ids:
+                errors.append((line, f'Loại xe #{raw_category} không tồn tại'))
+                continue
+        else:
+            category_id = category_names.get(values.get('category', '').lower())
+            if category_id is None:
+                errors.append((line, f'Loại xe "{values.get("category", "")}" không tồn tại'))
+                continue
+
+        model_year = values.get('model_year', '')
+        if model_year:
+            try:
+                model_year = int(model_year)
+            except ValueError:
+                errors.append((line, f'Năm sản xuất không hợp lệ: {model_year}'))
+                continue
+        status = (values.get('status') or 'ready').lower()
+        if status not in STATUSES:
+            errors.append((line, f'Trạng thái không hợp lệ: {status} ({", ".join(STATUSES)})'))
+            continue
+
+        valid.append({
+            'category_id': category_id,
+            'license_plate': plate,
+            'model_year': model_year or None,
+            'description': values.get('description') or None,
+            'status': status,
+            'created_at': now,
+            'updated_at': now,
+            '_line': line,
+        })
+
+    existing = _existing_plates(session, (row['license_plate'] for row in valid))
+    if existing:
+        errors.extend((row['_line'], f'Biển số {row["license_plate"]} đã tồn tại')
+                      for row in valid if row['license_plate'] in existing)
+        valid = [row for row in valid if row['license_plate'] not in existing]
+    for row in valid:
+        del row['_line']
+    errors.sort()
+    return valid, errors
+
+
+def import_motorcycles(session, stream, filename, dry_run=False, strict=False):
+    """Validate and insert a file of motorcycles in one transaction.
+
+    Invalid rows are skipped and reported; with `strict` nothing is written
+    if any row is invalid. Returns (inserted count, errors); with `dry_run`
+    the count is the number of rows that would be inserted. Raises
+    ImportFileError for unreadable files and IntegrityError if another
+    request added one of the plates meanwhile (nothing is written then).
+    """
+    valid, errors = validate(session, read_rows(stream, filename))
+    if dry_run:
+        session.rollback()
+        return len(valid), errors
+    if (strict and errors) or not valid:
+        session.rollback()
+        return 0, errors
+    try:
+        for i in range(0, len(valid), INSERT_BATCH):
+            session.bulk_insert_mappings(Motorcycles, valid[i:i + INSERT_BATCH])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    # Nạp lại chỉ mục availability một lần thay vì sync từng xe
+    availability_index.invalidate()
+    return len(valid), errors
+
+
+# ---------- xuất ----------
+
+def export_rows(session, category_id=None):
+    """Yield COLUMNS tuples for every motorcycle, ordered by id, reading EXPORT_BATCH rows at a time."""
+    query = session.query(
+        Motorcycles.id, Motorcycles.license_plate, Motorcycles.category_id,
+        func.coalesce(Catagory_Motorcycle.name, ''), Motorcycles.model_year,
+        Motorcycles.status, Motorcycles.description,
+    ).outerjoin(Catagory_Motorcycle, Motorcycles.category_id == Catagory_Motorcycle.id)
+    if category_id:
+        query = query.filter(Motorcycles.category_id == category_id)
+    for row in query.order_by(Motorcycles.id).yield_per(EXPORT_BATCH):
+        yield tuple('' if value is None else value for value in row)
+
+
+def export_csv(session, category_id=None):
+    """Yield the CSV export as text chunks (header first, then EXPORT_BATCH rows per chunk)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')     # BOM để Excel mở đúng tiếng Việt
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in export_rows(session, category_id):
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_BATCH == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
@@ -0,0 +1,101 @@
+"""
+Mã đơn hàng / vnp_TxnRef không trùng giữa các process.
+
+Mã có dạng `yyyymmddHHMMSS` + 10 chữ số: phần thời gian là giờ VN (GMT+7,
+vnpay_timestamp) và chính là vnp_CreateDate gửi VNPay, nên `vnpay_reconcile`
+dựng lại được vnp_TransactionDate từ mã; phần số lấy từ bộ đếm chung
+trong bảng `id_block`. Mỗi process xin một khối ORDER_ID_BLOCK số bằng một
+câu UPDATE (khóa dòng) rồi cấp dần trong bộ nhớ, nên chỉ cần một round-trip
+database cho mỗi khối và hai process không bao giờ nhận cùng một số. Số bị
+bỏ dở khi process dừng chỉ để lại khoảng trống, không gây trùng.
+
+Trong một process mã tăng dần (phần thời gian không lùi kể cả khi đồng hồ
+bị chỉnh). Kiểm tra tải: `python stress_order_ids.py`.
+"""
+import os
+import threading
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.models import IdBlock
+from app.vnpay_helper import vnpay_timestamp
+
+
+BLOCK_SIZE = int(os.getenv('ORDER_ID_BLOCK', '200'))
+COUNTER_DIGITS = 10
+
+
+class BlockAllocator:
+    """Hands out values of a named DB counter, reserving BLOCK_SIZE at a time."""
+
+    def __init__(self, name, block_size=BLOCK_SIZE, engine=None):
+        self.name = name
+        self.block_size = block_size
+        self._engine = engine
+        self._next = 0
+        self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        self.blocks_allocated = 0
+
+    def _get_engine(self):
+        if self._engine is None:
+            from app.extensions import get_engine
+            return get_engine()
+        return self._engine
+
+    def _reserve(self):
+        """Atomically advance the counter by one block; return its first value."""
+        table = IdBlock.__table__
+        while True:
+            with self._get_engine().begin() as conn:
+                result = conn.execute(
+                    update(table).where(table.c.name == self.name)
+                    .values(next_value=table.c.next_value + self.block_size)
+                )
+                if result.rowcount:
+                    end = conn.execute(select(table.c.next_value).where(table.c.name == self.name)).scalar()
+                    return end - self.block_size
+            try:
+                with self._get_engine().begin() as conn:
+                    conn.execute(insert(table).values(name=self.name, next_value=1 + self.block_size))
+                return 1
+            except IntegrityError:
+                continue    # process khác vừa tạo dòng này: quay lại UPDATE
+
+    def next_value(self):
+        with self._lock:
+            # Khối đã xin trước khi fork (gunicorn --preload) không được dùng chung
+            if self._next >= self._end or self._pid != os.getpid():
+                self._next = self._reserve()
+                self._end = self._next + self.block_size
+                self._pid = os.getpid()
+                self.blocks_allocated += 1
+            value = self._next
+            self._next += 1
+            return value
+
+
+class OrderIdGenerator:
+    def __init__(self, allocator):
+        self.allocator = allocator
+        self._last_stamp = ''
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            value = self.allocator.next_value()
+            stamp = vnpay_timestamp()
+            if stamp < self._last_stamp:
+                stamp = self._last_stamp
+            self._last_stamp = stamp
+        return f'{stamp}{value % 10 ** COUNTER_DIGITS:0{COUNTER_DIGITS}d}'
+
+
+order_ids = OrderIdGenerator(BlockAllocator('order'))
+
+
+def generate_order_id():
+    """Unique, VNPay-compatible order ID (vnp_TxnRef / Payment.payment_code)."""
+    return order_ids.next_id()
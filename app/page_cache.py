@@ -0,0 +1,190 @@
+"""
+Cache HTML đã render cho các trang công khai (/, /tintuc, /gioithieu, /lienhe).
+
+ - Tầng 1: LRU trong bộ nhớ của mỗi worker, có TTL.
+ - Tầng 2 (tùy chọn, PAGE_CACHE_BACKEND=filesystem): file trong PAGE_CACHE_DIR,
+   dùng chung giữa các worker trên cùng máy.
+
+Mỗi trang gắn với các "tag" dữ liệu nó dùng (store_info, catalog, article).
+Mỗi tag có một file phiên bản trong PAGE_CACHE_DIR; admin lưu thay đổi thì
+gọi invalidate(tag) để ghi lại file đó. Phiên bản của các tag nằm trong
+khóa cache nên mọi worker thấy trang cũ hết hạn ngay ở request kế tiếp, và
+thời điểm invalidate được dùng làm Last-Modified. Response có ETag nên
+trình duyệt truy cập lại nhận 304.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+from flask import request, make_response
+
+
+class LRUCache:
+    """Thread-safe LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class PageCache:
+    def __init__(self):
+        self.enabled = True
+        self.ttl = 300
+        self.directory = None
+        self.shared = False
+        self.memory = LRUCache()
+
+    def init_app(self, app):
+        self.enabled = os.getenv('PAGE_CACHE', '1').lower() in ('1', 'true', 'yes')
+        self.ttl = int(os.getenv('PAGE_CACHE_TTL', '300'))
+        self.memory = LRUCache(int(os.getenv('PAGE_CACHE_MAX_ENTRIES', '128')))
+        self.directory = os.getenv('PAGE_CACHE_DIR') or os.path.join(app.instance_path, 'page_cache')
+        self.shared = os.getenv('PAGE_CACHE_BACKEND', 'memory') == 'filesystem'
+        try:
+            os.makedirs(os.path.join(self.directory, 'pages'), exist_ok=True)
+        except OSError as e:
+            print(f"Không tạo được thư mục page cache, tắt cache: {e}")
+            self.enabled = False
+
+    # ---------- tags ----------
+
+    def _tag_path(self, tag):
+        return os.path.join(self.directory, f'{tag}.version')
+
+    def tag_versions(self, tags):
+        versions = []
+        for tag in tags:
+            try:
+                versions.append(os.stat(self._tag_path(tag)).st_mtime_ns)
+            except OSError:
+                versions.append(0)
+        return tuple(versions)
+
+    def invalidate(self, *tags):
+        """Mark every page depending on one of `tags` as stale (all workers)."""
+        if not self.directory:
+            return
+        for tag in tags:
+            try:
+                with open(self._tag_path(tag), 'w') as f:
+                    f.write(str(time.time_ns()))
+            except OSError as e:
+                print(f"Không thể invalidate page cache '{tag}': {e}")
+        # Khóa cũ không bao giờ được dùng lại, dọn luôn cho nhẹ bộ nhớ/ổ đĩa
+        self.memory.clear()
+        if self.shared:
+            pages_dir = os.path.join(self.directory, 'pages')
+            for name in os.listdir(pages_dir):
+                try:
+                    os.remove(os.path.join(pages_dir, name))
+                except OSError:
+                    pass
+
+    # ---------- storage ----------
+
+    def _page_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'pages', digest + '.pkl')
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None or not self.shared:
+            return entry
+        try:
+            with open(self._page_path(key), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if entry['expires'] < time.time():
+            return None
+        self.memory.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self.memory.set(key, entry)
+        if self.shared:
+            path = self._page_path(key)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(entry, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Không ghi được page cache: {e}")
+
+
+page_cache = PageCache()
+
+
+def _respond(entry):
+    resp = make_response(entry['body'])
+    resp.status_code = 200
+    resp.content_type = entry['content_type']
+    resp.set_etag(entry['etag'])
+    resp.last_modified = datetime.fromtimestamp(entry['last_modified'], tz=timezone.utc)
+    # Trình duyệt được lưu nhưng phải hỏi lại (rẻ: 304) để thấy thay đổi từ admin ngay
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True
+    resp.headers['X-Page-Cache'] = entry.get('source', 'HIT')
+    return resp.make_conditional(request)
+
+
+def cached_page(*tags, ttl=None):
+    """Cache a public GET view's HTML, keyed by path + query + tag versions."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not page_cache.enabled or request.method != 'GET':
+                return view(*args, **kwargs)
+
+            versions = page_cache.tag_versions(tags)
+            key = (request.path, request.query_string, versions)
+            entry = page_cache.get(key)
+            if entry is not None:
+                return _respond(entry)
+
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200 or resp.direct_passthrough:
+                return resp
+            body = resp.get_data()
+            last_change = max(versions) / 1e9 if any(versions) else time.time()
+            entry = {
+                'body': body,
+                'content_type': resp.content_type,
+                'etag': hashlib.sha1(body).hexdigest()[:20],
+                'last_modified': int(last_change),
+                'expires': time.time() + (ttl or page_cache.ttl),
+            }
+            page_cache.set(key, entry)
+            return _respond(dict(entry, source='MISS'))
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+"""
+Keyset (cursor) pagination và đếm gần đúng cho các trang danh sách admin.
+
+Thay vì OFFSET (phải quét bỏ mọi dòng phía trước), mỗi trang lọc theo khóa
+sắp xếp của dòng cuối/đầu trang trước: WHERE (created_at, id) < (:c, :i).
+Cursor là khóa đó được mã hóa base64 nên client không cần biết cấu trúc.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import tuple_, text
+
+
+COUNT_CACHE_SECONDS = int(os.getenv('ADMIN_COUNT_CACHE_SECONDS', '60'))
+COUNT_CACHE_SIZE = 256
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+def encode_cursor(values):
+    """Encode a tuple of sort-key values into an opaque URL-safe token."""
+    packed = []
+    for value in values:
+        if isinstance(value, datetime):
+            packed.append(['d', value.isoformat()])
+        elif isinstance(value, Decimal):
+            packed.append(['n', str(value)])
+        else:
+            packed.append(['v', value])
+    raw = json.dumps(packed, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token; return None if it is malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = []
+        for kind, value in json.loads(raw.decode('utf-8')):
+            if kind == 'd':
+                value = datetime.fromisoformat(value)
+            elif kind == 'n':
+                value = Decimal(value)
+            values.append(value)
+        return tuple(values)
+    except (ValueError, TypeError):
+        return None
+
+
+class KeysetPage:
+    """One page of results plus the cursors to reach its neighbours."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, order_columns, key, cursor=None, direction='next', per_page=20):
+    """Fetch one page ordered by `order_columns` descending.
+
+    - order_columns: column expressions forming a unique key, e.g. (created_at, id)
+    - key: function(row) -> tuple of the same values, used to build cursors
+    - cursor/direction: token from a previous page and 'next' or 'prev'
+    """
+    values = decode_cursor(cursor)
+    backwards = values is not None and direction == 'prev'
+
+    if values is not None:
+        row_key = tuple_(*order_columns)
+        if backwards:
+            query = query.filter(row_key > tuple_(*values))
+        else:
+            query = query.filter(row_key < tuple_(*values))
+
+    if backwards:
+        query = query.order_by(*[column.asc() for column in order_columns])
+    else:
+        query = query.order_by(*[column.desc() for column in order_columns])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([])
+
+    if backwards:
+        next_cursor = encode_cursor(key(rows[-1]))
+        prev_cursor = encode_cursor(key(rows[0])) if has_more else None
+    else:
+        next_cursor = encode_cursor(key(rows[-1])) if has_more else None
+        prev_cursor = encode_cursor(key(rows[0])) if values is not None else None
+    return KeysetPage(rows, next_cursor, prev_cursor)
+
+
+def count_rows(session, query, table_name, filtered=False, exact=False):
+    """Return (count, is_estimate) for a list query.
+
+    Unfiltered lists on PostgreSQL use the planner estimate in
+    pg_class.reltuples; everything else is counted exactly and cached for
+    COUNT_CACHE_SECONDS. Pass exact=True to bypass both.
+    """
+    query = query.order_by(None)
+    if exact:
+        return query.count(), False
+
+    if not filtered and session.get_bind().dialect.name == 'postgresql':
+        estimate = session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name"),
+            {'name': table_name}
+        ).scalar()
+        # reltuples = -1 khi bảng chưa từng được ANALYZE
+        if estimate is not None and estimate >= 0:
+            return int(estimate), True
+
+    compiled = query.statement.compile(session.get_bind())
+    cache_key = (str(compiled), tuple(sorted((k, str(v)) for k, v in compiled.params.items())))
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(cache_key)
+        if cached and cached[0] > now:
+            return cached[1], True
+
+    total = query.count()
+    with _count_cache_lock:
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            _count_cache.clear()
+        _count_cache[cache_key] = (now + COUNT_CACHE_SECONDS, total)
+    return total, False
@@ -0,0 +1,205 @@
+"""
+Thống kê giao dịch cho trang admin/payments.
+
+Bảng `payment_summary` giữ số lượng và tổng tiền theo từng payment_status.
+Mọi thay đổi Payment (tạo mới, đổi trạng thái, đổi số tiền, xóa) đi qua ORM
+nên được ghi thành một dòng chênh lệch trong `payment_summary_delta` bằng
+event trong cùng transaction - dù thay đổi đến từ rental.py, vnpay.py hay
+admin_management.py. Chỉ INSERT (không UPDATE một dòng chung) nên các
+transaction thanh toán không phải xếp hàng chờ khóa dòng của nhau.
+
+Số liệu = payment_summary + tổng các delta chưa gộp. Job 'payment-stats-fold'
+(app/housekeeping.py) gộp delta vào payment_summary mỗi phút; `reconcile()`
+tính lại từ đầu bằng một câu GROUP BY và báo chênh lệch.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import delete, event, func, inspect, insert, update
+
+from app.models import Payment, PaymentSummary, PaymentSummaryDelta
+
+
+# Các dòng payment_summary có sẵn (migration 0011), trạng thái khác được tạo khi gộp
+SEEDED_STATUSES = ('', 'pending', 'paid', 'failed')
+FOLD_BATCH = 5000
+
+_summary_table = PaymentSummary.__table__
+_delta_table = PaymentSummaryDelta.__table__
+_listeners_registered = False
+
+
+def _status_key(status):
+    # payment_status có thể NULL nhưng khóa chính thì không
+    return status or ''
+
+
+def _to_decimal(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+
+def _apply_delta(connection, status, count_delta, amount_delta):
+    if not count_delta and not amount_delta:
+        return
+    connection.execute(insert(_delta_table).values(
+        payment_status=_status_key(status), count_delta=count_delta, amount_delta=amount_delta,
+        created_at=datetime.utcnow(),
+    ))
+
+
+def _old_value(state, attr):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attr)
+
+
+def _after_insert(mapper, connection, target):
+    _apply_delta(connection, target.payment_status, 1, _to_decimal(target.amount))
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    status_changed = state.attrs.payment_status.history.has_changes()
+    amount_changed = state.attrs.amount.history.has_changes()
+    if not status_changed and not amount_changed:
+        return
+    old_status = _old_value(state, 'payment_status')
+    old_amount = _to_decimal(_old_value(state, 'amount'))
+    new_amount = _to_decimal(target.amount)
+    if _status_key(old_status) == _status_key(target.payment_status):
+        _apply_delta(connection, target.payment_status, 0, new_amount - old_amount)
+    else:
+        _apply_delta(connection, old_status, -1, -old_amount)
+        _apply_delta(connection, target.payment_status, 1, new_amount)
+
+
+def _after_delete(mapper, connection, target):
+    _apply_delta(connection, target.payment_status, -1, -_to_decimal(target.amount))
+
+
+def record_bulk_transition(connection, old_status, new_status, count, amount):
+    """Apply a bulk `UPDATE payment SET payment_status` (which skips the ORM events)."""
+    amount = _to_decimal(amount)
+    _apply_delta(connection, old_status, -count, -amount)
+    _apply_delta(connection, new_status, count, amount)
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def register_listeners():
+    """Maintain payment_summary on every Payment flush (call once per process)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    # active_history: nạp giá trị cũ trước khi gán, kể cả khi object đã bị expire
+    # sau commit - nếu không history.deleted rỗng và _after_update không thấy thay đổi
+    for attr in (Payment.payment_status, Payment.amount):
+        event.listen(attr, 'set', _keep_old_value, active_history=True, retval=True)
+    event.listen(Payment, 'after_insert', _after_insert)
+    event.listen(Payment, 'after_update', _after_update)
+    event.listen(Payment, 'after_delete', _after_delete)
+    _listeners_registered = True
+
+
+def compute_totals(session):
+    """Exact totals per status from the payment table in one grouped query."""
+    rows = session.query(
+        Payment.payment_status,
+        func.count(Payment.id),
+        func.coalesce(func.sum(Payment.amount), 0)
+    ).group_by(Payment.payment_status).all()
+    return {_status_key(status): (count, _to_decimal(amount)) for status, count, amount in rows}
+
+
+def read_summary(session):
+    """{status: (count, amount)} = folded summary rows plus the pending deltas."""
+    summary = {
+        row.payment_status: (row.payment_count, _to_decimal(row.total_amount))
+        for row in session.query(PaymentSummary).all()
+    }
+    pending = session.query(
+        PaymentSummaryDelta.payment_status,
+        func.sum(PaymentSummaryDelta.count_delta),
+        func.sum(PaymentSummaryDelta.amount_delta),
+    ).group_by(PaymentSummaryDelta.payment_status).all()
+    for status, count, amount in pending:
+        base_count, base_amount = summary.get(status, (0, Decimal('0')))
+        summary[status] = (base_count + (count or 0), base_amount + _to_decimal(amount or 0))
+    return summary
+
+
+def fold(session, limit=FOLD_BATCH):
+    """Move up to `limit` deltas into payment_summary; return how many were folded.
+
+    Delta rows are taken with SKIP LOCKED and deleted by id, so two folds
+    never count the same row and deltas committed meanwhile wait for the next run.
+    """
+    rows = session.query(
+        PaymentSummaryDelta.id, PaymentSummaryDelta.payment_status,
+        PaymentSummaryDelta.count_delta, PaymentSummaryDelta.amount_delta,
+    ).order_by(PaymentSummaryDelta.id).limit(limit).with_for_update(skip_locked=True).all()
+    if not rows:
+        session.rollback()
+        return 0
+    totals = {}
+    for _, status, count, amount in rows:
+        total_count, total_amount = totals.get(status, (0, Decimal('0')))
+        totals[status] = (total_count + count, total_amount + _to_decimal(amount))
+
+    table = _summary_table
+    for status, (count, amount) in totals.items():
+        result = session.execute(
+            update(table)
+            .where(table.c.payment_status == status)
+            .values(payment_count=table.c.payment_count + count,
+                    total_amount=table.c.total_amount + amount,
+                    updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            session.execute(insert(table).values(
+                payment_status=status, payment_count=count, total_amount=amount, updated_at=datetime.utcnow()
+            ))
+    ids = [row[0] for row in rows]
+    for i in range(0, len(ids), 900):
+        session.execute(delete(_delta_table).where(_delta_table.c.id.in_(ids[i:i + 900])))
+    session.commit()
+    return len(rows)
+
+
+def reconcile(session):
+    """Rebuild payment_summary from scratch; return {status: (expected, stored)} for rows that drifted."""
+    expected = compute_totals(session)
+    stored = read_summary(session)
+    drift = {}
+    for status in set(expected) | set(stored):
+        exp = expected.get(status, (0, Decimal('0')))
+        got = stored.get(status, (0, Decimal('0')))
+        if exp[0] != got[0] or exp[1] != got[1]:
+            drift[status] = (exp, got)
+
+    session.query(PaymentSummaryDelta).delete()
+    session.query(PaymentSummary).delete()
+    for status in set(expected) | set(SEEDED_STATUSES):
+        count, amount = expected.get(status, (0, Decimal('0')))
+        session.add(PaymentSummary(payment_status=status, payment_count=count, total_amount=amount))
+    session.commit()
+    return drift
+
+
+def get_stats(session):
+    """Stats for the admin payments panel (reads only payment_summary)."""
+    summary = read_summary(session)
+
+    def count(status):
+        return summary.get(status, (0, Decimal('0')))[0]
+
+    return {
+        'total': sum(value[0] for value in summary.values()),
+        'paid': count('paid'),
+        'pending': count('pending'),
+        'failed': count('failed'),
+        'total_amount': summary.get('paid', (0, Decimal('0')))[1]
+    }
@@ -0,0 +1,224 @@
+"""
+Tính tiền thuê theo bậc giá ngày / tuần (7 ngày) / tháng (30 ngày).
+
+Với mỗi bộ giá (ngày, tuần, tháng) `PriceTable` tính sẵn một lần chi phí rẻ
+nhất cho mọi thời lượng đến HORIZON_DAYS ngày (quy hoạch động, được phép phủ
+dư: 6 ngày có thể tính bằng 1 tuần nếu rẻ hơn), nên mỗi lần báo giá chỉ là
+một phép tra mảng. Dài hơn HORIZON_DAYS thì phần vượt được tính bằng bậc có
+giá mỗi ngày rẻ nhất (phương án tối ưu dùng các bậc khác cho ít hơn
+30 * (7 + 1) ngày, nên phần còn lại trong bảng vẫn đủ để tối ưu). Bảng được
+cache theo bộ giá, và giá của các loại xe được cache trong process (làm mới
+khi loại xe bị sửa hoặc sau REFRESH_SECONDS).
+
+Mọi chỗ tính tiền (đặt xe, trả xe ở admin, callback VNPay, /api/quote) đều
+dùng module này và chỉ dùng Decimal. RentalItem lưu lại bộ giá lúc đặt/gán
+xe; đơn cũ chỉ có giá ngày nên vẫn được tính như trước.
+"""
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+import threading
+import time
+
+from sqlalchemy import event
+
+from app.models import Catagory_Motorcycle
+
+
+WEEK_DAYS = 7
+MONTH_DAYS = 30
+HORIZON_DAYS = 400
+DEPOSIT_RATE = Decimal('0.5')
+REFRESH_SECONDS = 60
+MAX_QUOTE_ITEMS = 200
+CENT = Decimal('0.01')
+
+Quote = namedtuple('Quote', 'days quantity unit_total total deposit months weeks extra_days')
+
+
+def to_money(value):
+    return Decimal(str(value)).quantize(CENT, ROUND_HALF_UP) if value is not None else Decimal('0.00')
+
+
+def _tier_price(value):
+    if value is None:
+        return None
+    value = to_money(value)
+    return value if value > 0 else None
+
+
+def rental_days(start_date, end_date):
+    """Billable days between two dates, both ends included (at least 1)."""
+    return max(1, (end_date - start_date).days + 1)
+
+
+def deposit_for(total):
+    return to_money(Decimal(total) * DEPOSIT_RATE)
+
+
+class PriceTable:
+    """Cheapest cost (and its month/week/day split) for every duration up to HORIZON_DAYS."""
+
+    def __init__(self, day=None, week=None, month=None):
+        # Bậc dài trước: khi bằng giá thì ưu tiên tháng/tuần
+        self.tiers = [(length, price) for length, price in
+                      ((MONTH_DAYS, month), (WEEK_DAYS, week), (1, day)) if price is not None]
+        # Bậc rẻ nhất tính theo ngày (bằng giá thì bậc dài hơn) - dùng cho phần vượt HORIZON_DAYS
+        self.cheapest = min(self.tiers, key=lambda tier: tier[1] / tier[0]) if self.tiers else None
+        self.cost = [Decimal('0.00')] * (HORIZON_DAYS + 1)
+        self.plan = [(0, 0, 0)] * (HORIZON_DAYS + 1)
+        if not self.tiers:
+            return
+        for days in range(1, HORIZON_DAYS + 1):
+            best = None
+            for length, price in self.tiers:
+                rest = max(0, days - length)
+                cost = self.cost[rest] + price
+                if best is None or cost < best[0]:
+                    best = (cost, rest, length)
+            cost, rest, length = best
+            months, weeks, extra = self.plan[rest]
+            self.cost[days] = cost
+            self.plan[days] = (months + (length == MONTH_DAYS), weeks + (length == WEEK_DAYS),
+                               extra + (length == 1))
+
+    def _split(self, days):
+        """(whole cheapest-per-day units beyond the horizon, remaining days)."""
+        if days <= HORIZON_DAYS or not self.tiers:
+            return 0, min(days, HORIZON_DAYS)
+        length = self.cheapest[0]
+        units = -(-(days - HORIZON_DAYS) // length)
+        return units, days - units * length
+
+    def total(self, days):
+        if days <= 0:
+            return Decimal('0.00')
+        units, rest = self._split(days)
+        extra = units * self.cheapest[1] if units else 0
+        return self.cost[rest] + extra
+
+    def breakdown(self, days):
+        """(months, weeks, days) billed for `days`."""
+        if days <= 0:
+            return 0, 0, 0
+        units, rest = self._split(days)
+        months, weeks, extra = self.plan[rest]
+        if units:
+            length = self.cheapest[0]
+            months += units if length == MONTH_DAYS else 0
+            weeks += units if length == WEEK_DAYS else 0
+            extra += units if length == 1 else 0
+        return months, weeks, extra
+
+    def quote(self, days, quantity=1):
+        unit_total = self.total(days)
+        total = unit_total * quantity
+        months, weeks, extra = self.breakdown(days)
+        return Quote(days, quantity, unit_total, total, deposit_for(total), months, weeks, extra)
+
+
+@lru_cache(maxsize=512)
+def _table(day, week, month):
+    return PriceTable(day, week, month)
+
+
+def price_table(day=None, week=None, month=None):
+    """Shared PriceTable for a (day, week, month) price triple."""
+    return _table(_tier_price(day), _tier_price(week), _tier_price(month))
+
+
+def category_table(category):
+    return price_table(category.price_per_day, category.price_per_week, category.price_per_month)
+
+
+def item_total(item, days):
+    """Price of one RentalItem for `days` (tiers snapshotted on the item)."""
+    return price_table(item.price_per_day, item.price_per_week, item.price_per_month).total(days)
+
+
+def items_total(items, days):
+    return sum((item_total(item, days) for item in items), Decimal('0.00'))
+
+
+def snapshot_prices(category):
+    """RentalItem price columns copied from a category."""
+    return {
+        'price_per_day': category.price_per_day,
+        'price_per_week': category.price_per_week,
+        'price_per_month': category.price_per_month,
+    }
+
+
+# ---------- giá theo loại xe (cache trong process) ----------
+
+class CategoryPrices:
+    def __init__(self, refresh_seconds=REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._prices = None     # category_id -> (day, week, month)
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._prices = None
+
+    def _load(self, session):
+        rows = session.query(
+            Catagory_Motorcycle.id, Catagory_Motorcycle.price_per_day,
+            Catagory_Motorcycle.price_per_week, Catagory_Motorcycle.price_per_month,
+        ).all()
+        prices = {row.id: (row.price_per_day, row.price_per_week, row.price_per_month) for row in rows}
+        with self._lock:
+            self._prices = prices
+            self._loaded_at = time.monotonic()
+        return prices
+
+    def tables(self, session):
+        """{category_id: PriceTable} for every category (one query per refresh)."""
+        prices = self._prices
+        if prices is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            prices = self._load(session)
+        return {category_id: price_table(*triple) for category_id, triple in prices.items()}
+
+
+category_prices = CategoryPrices()
+_listeners_registered = False
+
+
+def _invalidate(mapper, connection, target):
+    category_prices.invalidate()
+
+
+def register_listeners():
+    """Drop cached category prices whenever a category is written (call once per process)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Catagory_Motorcycle, name, _invalidate)
+    _listeners_registered = True
+
+
+def quote_many(session, requests):
+    """Price many (category_id, start_date, end_date, quantity) requests with one table lookup each.
+
+    Returns one dict per request, in order: either the quote or {'error': message}.
+    """
+    tables = category_prices.tables(session)
+    results = []
+    for category_id, start_date, end_date, quantity in requests:
+        table = tables.get(category_id)
+        if table is None:
+            results.append({'category_id': category_id, 'error': 'Không tìm thấy loại xe!'})
+            continue
+        q = table.quote(rental_days(start_date, end_date), quantity)
+        results.append({
+            'category_id': category_id,
+            'days': q.days,
+            'quantity': q.quantity,
+            'unit_total': float(q.unit_total),
+            'total': float(q.total),
+            'deposit': float(q.deposit),
+            'breakdown': {'months': q.months, 'weeks': q.weeks, 'days': q.extra_days},
+        })
+    return results
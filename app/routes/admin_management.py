@@ -3,18 +3,28 @@ Admin routes for managing customers, rentals, and payments
 """
 from flask import render_template, request, redirect, url_for, flash, jsonify
 from sqlalchemy import desc, func
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime
 from decimal import Decimal
 import os
-import random
 from . import bp
 from app.extensions import get_db_session
+from app.order_ids import generate_order_id
 from app.models import Customer, Rental, RentalItem, Payment, Catagory_Motorcycle, Motorcycles
 from app.vnpay_helper import VNPay, get_client_ip
+from app.availability import availability_index
+from app.pagination import keyset_paginate, count_rows
+from app import search as search_index
+from app import payment_stats, pricing
 
 
 # ==================== CUSTOMER MANAGEMENT ====================
 
+# Sortable columns of the customer list (all ordered descending)
+CUSTOMER_SORTS = ('created', 'rentals', 'last_rental', 'paid')
+
+
 @bp.route('/admin/customers')
 def customers():
     """Quản lý khách hàng"""
@@ -22,37 +32,85 @@ def customers():
     try:
         # Get search and filter parameters
         search = request.args.get('search', '').strip()
+        sort = request.args.get('sort', 'created')
+        if sort not in CUSTOMER_SORTS:
+            sort = 'created'
         page = int(request.args.get('page', 1))
+        cursor = request.args.get('cursor')
+        direction = request.args.get('dir', 'next')
+        exact_count = request.args.get('count') == 'exact'
         per_page = 20
         
-        query = session.query(Customer)
+        # Per-customer aggregates computed once, in the same statement as the page
+        rental_stats = session.query(
+            Rental.customer_id.label('customer_id'),
+            func.count(Rental.id).label('rental_count'),
+            func.max(Rental.created_at).label('last_rental_at'),
+            func.sum(Rental.paid_amount).label('paid_total')
+        ).group_by(Rental.customer_id).subquery()
         
-        # Apply search filter
-        if search:
-            query = query.filter(
-                (Customer.full_name.ilike(f'%{search}%')) |
-                (Customer.phone.ilike(f'%{search}%')) |
-                (Customer.email.ilike(f'%{search}%')) |
-                (Customer.citizen_id.ilike(f'%{search}%'))
-            )
+        rental_count = func.coalesce(rental_stats.c.rental_count, 0)
+        paid_total = func.coalesce(rental_stats.c.paid_total, 0)
         
-        # Order by created_at desc
-        query = query.order_by(desc(Customer.created_at))
+        query = session.query(
+            Customer,
+            rental_count.label('rental_count'),
+            rental_stats.c.last_rental_at,
+            paid_total.label('paid_total')
+        ).outerjoin(rental_stats, rental_stats.c.customer_id == Customer.id)
         
-        # Pagination
-        total = query.count()
-        customers_list = query.offset((page - 1) * per_page).limit(per_page).all()
+        # Apply search filter
+        search_filter = None
+        if search:
+            search_filter = search_index.search_filter(session, 'customer', Customer.id, search)
+            query = query.filter(search_filter)
+        
+        pager = None
+        total_is_estimate = False
+        if sort == 'created':
+            # Default order: keyset pagination on (created_at, id)
+            pager = keyset_paginate(query, (Customer.created_at, Customer.id),
+                                    key=lambda row: (row[0].created_at, row[0].id),
+                                    cursor=cursor, direction=direction, per_page=per_page)
+            rows = pager.items
+            count_query = session.query(Customer)
+            if search_filter is not None:
+                count_query = count_query.filter(search_filter)
+            total, total_is_estimate = count_rows(session, count_query, 'customer',
+                                                  filtered=bool(search), exact=exact_count)
+        else:
+            # Aggregate sorts: page numbers, total from the window count of the page rows
+            order_columns = {
+                'rentals': rental_count,
+                'last_rental': rental_stats.c.last_rental_at,
+                'paid': paid_total,
+            }
+            query = query.add_columns(func.count().over().label('total_count'))
+            query = query.order_by(desc(order_columns[sort]), desc(Customer.id))
+            rows = query.offset((page - 1) * per_page).limit(per_page).all()
+            if rows:
+                total = rows[0].total_count
+            else:
+                total = query.count() if page > 1 else 0
         
-        # Get rental counts for each customer
-        for customer in customers_list:
-            customer.rental_count = session.query(Rental).filter(Rental.customer_id == customer.id).count()
+        customers_list = []
+        for row in rows:
+            customer = row[0]
+            customer.rental_count = row.rental_count
+            customer.last_rental_at = row.last_rental_at
+            customer.paid_total = row.paid_total
+            customers_list.append(customer)
         
         return render_template('admin/customers.html',
                              customers=customers_list,
                              search=search,
+                             sort=sort,
                              page=page,
                              per_page=per_page,
+                             pager=pager,
+                             pager_params={'search': search} if search else {},
                              total=total,
+                             total_is_estimate=total_is_estimate,
                              total_pages=(total + per_page - 1) // per_page)
     finally:
         session.close()
@@ -78,6 +136,51 @@ def customer_detail(customer_id):
         session.close()
 
 
+@bp.route('/admin/api/search')
+def admin_search_typeahead():
+    """Gợi ý tìm kiếm (typeahead) cho các ô search admin - trả về JSON"""
+    term = request.args.get('q', '').strip()
+    kinds = [k for k in request.args.get('kind', '').split(',') if k in search_index.SEARCH_FIELDS]
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    if len(term) < 2:
+        return jsonify({'success': True, 'results': []})
+    
+    session = get_db_session()
+    try:
+        hits = search_index.ranked_search(session, term, kinds=kinds or None, limit=limit)
+        
+        # One query per kind to build labels
+        ids_by_kind = {}
+        for kind, ref_id, _ in hits:
+            ids_by_kind.setdefault(kind, []).append(ref_id)
+        labels = {}
+        if ids_by_kind.get('customer'):
+            for c in session.query(Customer.id, Customer.full_name, Customer.phone).filter(
+                    Customer.id.in_(ids_by_kind['customer'])):
+                labels[('customer', c.id)] = (f"{c.full_name} - {c.phone or ''}",
+                                              url_for('admin.customer_detail', customer_id=c.id))
+        if ids_by_kind.get('rental'):
+            for r in session.query(Rental.id, Rental.vnpay_transaction_id).filter(
+                    Rental.id.in_(ids_by_kind['rental'])):
+                labels[('rental', r.id)] = (f"Đơn #{r.id} - {r.vnpay_transaction_id or ''}",
+                                            url_for('admin.rental_detail', rental_id=r.id))
+        if ids_by_kind.get('payment'):
+            for p in session.query(Payment.id, Payment.payment_code).filter(
+                    Payment.id.in_(ids_by_kind['payment'])):
+                labels[('payment', p.id)] = (f"Giao dịch #{p.id} - {p.payment_code or ''}",
+                                             url_for('admin.payment_detail', payment_id=p.id))
+        
+        results = []
+        for kind, ref_id, score in hits:
+            if (kind, ref_id) not in labels:
+                continue
+            label, url = labels[(kind, ref_id)]
+            results.append({'kind': kind, 'id': ref_id, 'label': label, 'url': url, 'score': round(score, 4)})
+        return jsonify({'success': True, 'results': results})
+    finally:
+        session.close()
+
+
 # ==================== RENTAL MANAGEMENT ====================
 
 @bp.route('/admin/rentals')
@@ -88,7 +191,9 @@ def rentals():
         # Get filter parameters
         status = request.args.get('status', '').strip()
         search = request.args.get('search', '').strip()
-        page = int(request.args.get('page', 1))
+        cursor = request.args.get('cursor')
+        direction = request.args.get('dir', 'next')
+        exact_count = request.args.get('count') == 'exact'
         per_page = 20
         
         query = session.query(Rental).outerjoin(Customer)
@@ -99,38 +204,40 @@ def rentals():
         
         # Apply search filter
         if search:
+            text_filter = (
+                search_index.search_filter(session, 'rental', Rental.id, search) |
+                search_index.search_filter(session, 'customer', Rental.customer_id, search)
+            )
             try:
                 # Try to convert search to int for ID search
                 search_int = int(search)
-                query = query.filter(
-                    (Rental.id == search_int) |
-                    (Rental.vnpay_transaction_id.ilike(f'%{search}%')) |
-                    (Customer.full_name.ilike(f'%{search}%')) |
-                    (Customer.phone.ilike(f'%{search}%'))
-                )
+                query = query.filter((Rental.id == search_int) | text_filter)
             except ValueError:
                 # If not a number, search in text fields
-                query = query.filter(
-                    (Rental.vnpay_transaction_id.ilike(f'%{search}%')) |
-                    (Customer.full_name.ilike(f'%{search}%')) |
-                    (Customer.phone.ilike(f'%{search}%'))
-                )
+                query = query.filter(text_filter)
         
-        # Order by created_at desc
-        query = query.order_by(desc(Rental.created_at))
+        # Keyset pagination ordered by (created_at, id) desc
+        pager = keyset_paginate(query, (Rental.created_at, Rental.id),
+                                key=lambda r: (r.created_at, r.id),
+                                cursor=cursor, direction=direction, per_page=per_page)
+        total, total_is_estimate = count_rows(session, query, 'rental',
+                                              filtered=bool(status or search), exact=exact_count)
         
-        # Pagination
-        total = query.count()
-        rentals_list = query.offset((page - 1) * per_page).limit(per_page).all()
+        pager_params = {}
+        if status:
+            pager_params['status'] = status
+        if search:
+            pager_params['search'] = search
         
         return render_template('admin/rentals.html',
-                             rentals=rentals_list,
+                             rentals=pager.items,
                              status=status,
                              search=search,
-                             page=page,
+                             pager=pager,
+                             pager_params=pager_params,
                              per_page=per_page,
                              total=total,
-                             total_pages=(total + per_page - 1) // per_page)
+                             total_is_estimate=total_is_estimate)
     finally:
         session.close()
 
@@ -140,46 +247,29 @@ def rental_detail(rental_id):
     """Chi tiết đơn thuê"""
     session = get_db_session()
     try:
-        rental = session.query(Rental).filter(Rental.id == rental_id).first()
+        # Customer, items (+ motorcycle + category) and payments in a fixed number of queries
+        rental = session.query(Rental).options(
+            joinedload(Rental.customer),
+            selectinload(Rental.items).joinedload(RentalItem.motorcycle).joinedload(Motorcycles.category),
+            selectinload(Rental.payments),
+        ).filter(Rental.id == rental_id).first()
         if not rental:
             flash('Không tìm thấy đơn thuê!', 'error')
             return redirect(url_for('admin.rentals'))
         
-        # Get customer
-        customer = session.query(Customer).filter(Customer.id == rental.customer_id).first() if rental.customer_id else None
-        
-        # Get rental items
-        items = session.query(RentalItem).filter(RentalItem.rental_id == rental_id).all()
-        
-        # Get payments
-        payments = session.query(Payment).filter(Payment.rental_id == rental_id).order_by(desc(Payment.id)).all()
+        customer = rental.customer
+        items = rental.items
+        payments = sorted(rental.payments, key=lambda p: p.id, reverse=True)
         
         # Get available motorcycles from rental items' categories
-        # Find category IDs from rental items
-        category_ids = set()
-        for item in items:
-            if item.motorcycle_id:
-                motorcycle = session.query(Motorcycles).filter(Motorcycles.id == item.motorcycle_id).first()
-                if motorcycle and motorcycle.category_id:
-                    category_ids.add(motorcycle.category_id)
-            # If no motorcycle assigned, try to find category by price_per_day
-            elif item.price_per_day:
-                # Find category with matching price_per_day
-                category = session.query(Catagory_Motorcycle).filter(
-                    Catagory_Motorcycle.price_per_day == item.price_per_day
-                ).first()
-                if category:
-                    category_ids.add(category.id)
+        category_ids = _rental_category_ids(session, items)
         
         # Get all motorcycles from these categories
-        available_motorcycles = []
+        query = session.query(Motorcycles).options(joinedload(Motorcycles.category))
         if category_ids:
-            available_motorcycles = session.query(Motorcycles).filter(
-                Motorcycles.category_id.in_(list(category_ids))
-            ).all()
-        else:
-            # If no category found, get all motorcycles
-            available_motorcycles = session.query(Motorcycles).all()
+            query = query.filter(Motorcycles.category_id.in_(list(category_ids)))
+        # If no category found, get all motorcycles
+        available_motorcycles = query.all()
         
         # Count assigned motorcycles
         assigned_motorcycles_count = len([item for item in items if item.motorcycle_id])
@@ -195,6 +285,38 @@ def rental_detail(rental_id):
         session.close()
 
 
+def _rental_category_ids(session, items):
+    """Categories of a rental's items, from the assigned motorcycle or (if none) by matching price_per_day.
+
+    Expects item.motorcycle to be eager-loaded; unassigned prices are resolved with one query.
+    """
+    category_ids = set()
+    unassigned_prices = set()
+    for item in items:
+        if item.motorcycle_id:
+            if item.motorcycle and item.motorcycle.category_id:
+                category_ids.add(item.motorcycle.category_id)
+        elif item.price_per_day:
+            unassigned_prices.add(item.price_per_day)
+    
+    if unassigned_prices:
+        # First category (lowest id) for each price, like the previous per-item lookup
+        matched = session.query(
+            Catagory_Motorcycle.price_per_day, func.min(Catagory_Motorcycle.id)
+        ).filter(
+            Catagory_Motorcycle.price_per_day.in_(list(unassigned_prices))
+        ).group_by(Catagory_Motorcycle.price_per_day).all()
+        category_ids.update(category_id for _, category_id in matched)
+    return category_ids
+
+
+def _stale_rental_response():
+    return jsonify({
+        'success': False,
+        'message': 'Đơn thuê vừa được cập nhật bởi người khác, vui lòng tải lại trang!'
+    }), 409
+
+
 @bp.route('/admin/rental/<int:rental_id>/update_status', methods=['POST'])
 def rental_update_status(rental_id):
     """Cập nhật trạng thái đơn thuê"""
@@ -204,14 +326,23 @@ def rental_update_status(rental_id):
         if not rental:
             return jsonify({'success': False, 'message': 'Không tìm thấy đơn thuê!'}), 404
         
+        # Trang admin gửi kèm version đã hiển thị: đơn đã đổi từ lúc đó thì không ghi đè
+        expected_version = request.json.get('version')
+        if expected_version is not None and int(expected_version) != rental.version:
+            return _stale_rental_response()
+        
         new_status = request.json.get('status')
         if new_status not in ['pending', 'confirmed', 'rented', 'returned', 'cancelled']:
             return jsonify({'success': False, 'message': 'Trạng thái không hợp lệ!'}), 400
         
         rental.status = new_status
         session.commit()
+        availability_index.sync_rental(session, rental_id)
         
         return jsonify({'success': True, 'message': 'Cập nhật trạng thái thành công!'})
+    except StaleDataError:
+        session.rollback()
+        return _stale_rental_response()
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'}), 500
@@ -224,7 +355,8 @@ def rental_assign_motorcycles(rental_id):
     """Gán xe cho đơn thuê - hỗ trợ gán nhiều xe"""
     session = get_db_session()
     try:
-        rental = session.query(Rental).filter(Rental.id == rental_id).first()
+        # Khóa dòng rental: hai admin gán xe cùng lúc cho một đơn sẽ chạy lần lượt
+        rental = session.query(Rental).filter(Rental.id == rental_id).with_for_update().first()
         if not rental:
             return jsonify({'success': False, 'message': 'Không tìm thấy đơn thuê!'}), 404
         
@@ -262,18 +394,18 @@ def rental_assign_motorcycles(rental_id):
             if not motorcycle_ids or len(motorcycle_ids) == 0:
                 continue
             
-            # Get price_per_day from first motorcycle's category or from existing item
+            # Get prices (day/week/month) from first motorcycle's category or from existing item
             first_motorcycle = session.query(Motorcycles).filter(Motorcycles.id == motorcycle_ids[0]).first()
             if not first_motorcycle:
                 continue
             
-            price_per_day = None
+            prices = None
             if first_motorcycle.category_id:
                 category = session.query(Catagory_Motorcycle).filter(Catagory_Motorcycle.id == first_motorcycle.category_id).first()
-                if category:
-                    price_per_day = category.price_per_day
+                if category and category.price_per_day:
+                    prices = pricing.snapshot_prices(category)
             
-            if not price_per_day:
+            if not prices:
                 # Try to get from existing item if rental_item_id exists
                 if rental_item_id:
                     original_item = session.query(RentalItem).filter(
@@ -281,9 +413,13 @@ def rental_assign_motorcycles(rental_id):
                         RentalItem.rental_id == rental_id
                     ).first()
                     if original_item and original_item.price_per_day:
-                        price_per_day = original_item.price_per_day
+                        prices = {
+                            'price_per_day': original_item.price_per_day,
+                            'price_per_week': original_item.price_per_week,
+                            'price_per_month': original_item.price_per_month,
+                        }
             
-            if not price_per_day:
+            if not prices:
                 continue  # Skip if no price found
             
             # Get or create rental items for each motorcycle
@@ -312,7 +448,8 @@ def rental_assign_motorcycles(rental_id):
                     if original_item:
                         # Update existing item
                         original_item.motorcycle_id = motorcycle_id
-                        original_item.price_per_day = price_per_day
+                        for name, value in prices.items():
+                            setattr(original_item, name, value)
                         # Update motorcycle status
                         if rental.status in ['confirmed', 'rented']:
                             motorcycle.status = 'rented'
@@ -323,7 +460,7 @@ def rental_assign_motorcycles(rental_id):
                 new_item = RentalItem(
                     rental_id=rental_id,
                     motorcycle_id=motorcycle_id,
-                    price_per_day=price_per_day
+                    **prices
                 )
                 session.add(new_item)
                 # Update motorcycle status
@@ -332,6 +469,7 @@ def rental_assign_motorcycles(rental_id):
                 created_count += 1
         
         session.commit()
+        availability_index.sync_rental(session, rental_id)
         
         total = updated_count + created_count
         message = f'Đã gán {total} xe cho đơn thuê!'
@@ -343,6 +481,9 @@ def rental_assign_motorcycles(rental_id):
             'message': message
         })
         
+    except StaleDataError:
+        session.rollback()
+        return _stale_rental_response()
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'}), 500
@@ -355,74 +496,56 @@ def get_available_motorcycles(rental_id):
     """Lấy danh sách xe có thể gán cho đơn thuê"""
     session = get_db_session()
     try:
-        rental = session.query(Rental).filter(Rental.id == rental_id).first()
+        rental = session.query(Rental).options(
+            selectinload(Rental.items).joinedload(RentalItem.motorcycle)
+        ).filter(Rental.id == rental_id).first()
         if not rental:
             return jsonify({'success': False, 'message': 'Không tìm thấy đơn thuê!'}), 404
         
         # Get rental items to find categories
-        items = session.query(RentalItem).filter(RentalItem.rental_id == rental_id).all()
-        
-        category_ids = set()
-        for item in items:
-            # Try to get category from existing motorcycle
-            if item.motorcycle_id:
-                motorcycle = session.query(Motorcycles).filter(Motorcycles.id == item.motorcycle_id).first()
-                if motorcycle and motorcycle.category_id:
-                    category_ids.add(motorcycle.category_id)
-            # Or get from rental item's price to match with category
-            elif item.price_per_day:
-                category = session.query(Catagory_Motorcycle).filter(
-                    Catagory_Motorcycle.price_per_day == item.price_per_day
-                ).first()
-                if category:
-                    category_ids.add(category.id)
+        items = rental.items
+        category_ids = _rental_category_ids(session, items)
+        
+        # Free/busy for the rental's dates (the rental's own bikes count as free)
+        def is_available(mc):
+            if not rental.start_date or not rental.end_date:
+                return True
+            return availability_index.is_free(session, mc.id, rental.start_date, rental.end_date,
+                                              exclude_rental_id=rental_id)
+        
+        # Get all motorcycles from these categories (or all motorcycles if no category found)
+        query = session.query(Motorcycles).options(joinedload(Motorcycles.category))
+        if category_ids:
+            query = query.filter(Motorcycles.category_id.in_(list(category_ids)))
         
-        # Get all motorcycles from these categories
         motorcycles = []
-        if category_ids:
-            motorcycles_query = session.query(Motorcycles).filter(
-                Motorcycles.category_id.in_(list(category_ids))
-            ).all()
-            
-            for mc in motorcycles_query:
-                motorcycles.append({
-                    'id': mc.id,
-                    'license_plate': mc.license_plate,
-                    'category_name': mc.category.name if mc.category else '',
-                    'status': mc.status,
-                    'model_year': mc.model_year
-                })
-        else:
-            # If no category found, get all motorcycles
-            motorcycles_query = session.query(Motorcycles).all()
-            for mc in motorcycles_query:
-                motorcycles.append({
-                    'id': mc.id,
-                    'license_plate': mc.license_plate,
-                    'category_name': mc.category.name if mc.category else '',
-                    'status': mc.status,
-                    'model_year': mc.model_year
-                })
+        for mc in query.all():
+            motorcycles.append({
+                'id': mc.id,
+                'license_plate': mc.license_plate,
+                'category_name': mc.category.name if mc.category else '',
+                'status': mc.status,
+                'model_year': mc.model_year,
+                'available': is_available(mc)
+            })
         
         # Get rental items info with all assigned motorcycles
         items_info = []
         for item in items:
             # Get all motorcycles assigned to this item (if any)
             assigned_motorcycles = []
-            if item.motorcycle_id:
-                mc = session.query(Motorcycles).filter(Motorcycles.id == item.motorcycle_id).first()
-                if mc:
-                    assigned_motorcycles.append({
-                        'id': mc.id,
-                        'license_plate': mc.license_plate
-                    })
+            if item.motorcycle:
+                assigned_motorcycles.append({
+                    'id': item.motorcycle.id,
+                    'license_plate': item.motorcycle.license_plate
+                })
             
             items_info.append({
                 'id': item.id,
                 'motorcycle_id': item.motorcycle_id,
                 'motorcycles': assigned_motorcycles,
                 'motorcycle': {
-                    'license_plate': item.motorcycle.license_plate if item.motorcycle else None
+                    'license_plate': item.motorcycle.license_plate
                 } if item.motorcycle else None
             })
         
@@ -449,7 +572,9 @@ def payments():
         status = request.args.get('status', '').strip()
         method = request.args.get('method', '').strip()
         search = request.args.get('search', '').strip()
-        page = int(request.args.get('page', 1))
+        cursor = request.args.get('cursor')
+        direction = request.args.get('dir', 'next')
+        exact_count = request.args.get('count') == 'exact'
         per_page = 20
         
         query = session.query(Payment).outerjoin(Rental)
@@ -464,47 +589,46 @@ def payments():
         
         # Apply search filter
         if search:
+            text_filter = search_index.search_filter(session, 'payment', Payment.id, search)
             try:
                 # Try to convert search to int for ID search
                 search_int = int(search)
                 query = query.filter(
                     (Payment.id == search_int) |
-                    (Payment.payment_code.ilike(f'%{search}%')) |
-                    (Payment.vnpay_transaction_id.ilike(f'%{search}%')) |
+                    text_filter |
                     (Rental.id == search_int)
                 )
             except ValueError:
                 # If not a number, search in text fields
-                query = query.filter(
-                    (Payment.payment_code.ilike(f'%{search}%')) |
-                    (Payment.vnpay_transaction_id.ilike(f'%{search}%'))
-                )
+                query = query.filter(text_filter)
         
-        # Order by id desc (Payment doesn't have created_at in base model)
-        query = query.order_by(desc(Payment.id))
+        # Keyset pagination by id desc (Payment doesn't have created_at in base model)
+        pager = keyset_paginate(query, (Payment.id,), key=lambda p: (p.id,),
+                                cursor=cursor, direction=direction, per_page=per_page)
+        total, total_is_estimate = count_rows(session, query, 'payment',
+                                              filtered=bool(status or method or search), exact=exact_count)
         
-        # Pagination
-        total = query.count()
-        payments_list = query.offset((page - 1) * per_page).limit(per_page).all()
+        pager_params = {}
+        if status:
+            pager_params['status'] = status
+        if method:
+            pager_params['method'] = method
+        if search:
+            pager_params['search'] = search
         
-        # Get statistics
-        stats = {
-            'total': session.query(func.count(Payment.id)).scalar(),
-            'paid': session.query(func.count(Payment.id)).filter(Payment.payment_status == 'paid').scalar(),
-            'pending': session.query(func.count(Payment.id)).filter(Payment.payment_status == 'pending').scalar(),
-            'failed': session.query(func.count(Payment.id)).filter(Payment.payment_status == 'failed').scalar(),
-            'total_amount': session.query(func.sum(Payment.amount)).filter(Payment.payment_status == 'paid').scalar() or Decimal('0')
-        }
+        # Get statistics (maintained incrementally in payment_summary)
+        stats = payment_stats.get_stats(session)
         
         return render_template('admin/payments.html',
-                             payments=payments_list,
+                             payments=pager.items,
                              status=status,
                              method=method,
                              search=search,
-                             page=page,
+                             pager=pager,
+                             pager_params=pager_params,
                              per_page=per_page,
                              total=total,
-                             total_pages=(total + per_page - 1) // per_page,
+                             total_is_estimate=total_is_estimate,
                              stats=stats)
     finally:
         session.close()
@@ -536,11 +660,6 @@ def payment_detail(payment_id):
         session.close()
 
 
-def generate_order_id():
-    """Generate unique order ID"""
-    return datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(1000, 9999))
-
-
 @bp.route('/admin/rental/<int:rental_id>/calculate_payment', methods=['POST'])
 def rental_calculate_payment(rental_id):
     """Tính toán số tiền còn lại phải thanh toán"""
@@ -585,11 +704,8 @@ def rental_calculate_payment(rental_id):
         if not items:
             return jsonify({'success': False, 'message': 'Chưa có xe nào được gán cho đơn thuê!'}), 400
         
-        # Calculate total amount: sum of (price_per_day * actual_days) for each motorcycle
-        total_amount = Decimal('0')
-        for item in items:
-            if item.price_per_day:
-                total_amount += Decimal(str(item.price_per_day)) * actual_days
+        # Calculate total amount: cheapest day/week/month combination for each motorcycle
+        total_amount = pricing.items_total(items, actual_days)
         
         # Get paid amount
         paid_amount = rental.paid_amount or Decimal('0')
@@ -617,7 +733,8 @@ def rental_process_payment(rental_id):
     """Xử lý thanh toán và trả xe"""
     session = get_db_session()
     try:
-        rental = session.query(Rental).filter(Rental.id == rental_id).first()
+        # Khóa dòng rental trong lúc tính tiền (callback VNPay cùng đơn phải chờ)
+        rental = session.query(Rental).filter(Rental.id == rental_id).with_for_update().first()
         if not rental:
             return jsonify({'success': False, 'message': 'Không tìm thấy đơn thuê!'}), 404
         
@@ -658,10 +775,7 @@ def rental_process_payment(rental_id):
             return jsonify({'success': False, 'message': 'Chưa có xe nào được gán cho đơn thuê!'}), 400
         
         # Calculate total amount
-        total_amount = Decimal('0')
-        for item in items:
-            if item.price_per_day:
-                total_amount += Decimal(str(item.price_per_day)) * actual_days
+        total_amount = pricing.items_total(items, actual_days)
         
         # Update rental
         rental.actual_return_date = actual_return_date
@@ -670,9 +784,8 @@ def rental_process_payment(rental_id):
         
         if payment_method == 'cash':
             # Cash payment - process immediately
-            # Update paid amount
-            current_paid = rental.paid_amount or Decimal('0')
-            rental.paid_amount = current_paid + amount
+            # Update paid amount (cộng trong SQL, đọc lại giá trị mới sau flush)
+            rental.paid_amount = func.coalesce(Rental.paid_amount, 0) + amount
             rental.payment_method = 'cash'
             
             # Create payment record
@@ -685,6 +798,7 @@ def rental_process_payment(rental_id):
                 payment_date=datetime.now()
             )
             session.add(payment)
+            session.flush()
             
             # Update rental status
             if rental.paid_amount >= total_amount:
@@ -701,6 +815,7 @@ def rental_process_payment(rental_id):
                 rental.payment_status = 'partial'
             
             session.commit()
+            availability_index.sync_rental(session, rental_id)
             
             return jsonify({
                 'success': True,
@@ -728,7 +843,8 @@ def rental_process_payment(rental_id):
                 order_desc=order_desc,
                 ip_addr=ip_addr,
                 bank_code='',
-                return_url=return_url
+                return_url=return_url,
+                create_date=order_id[:14]  # = vnp_TransactionDate khi đối soát
             )
             
             # Create payment record (pending)
@@ -755,6 +871,9 @@ def rental_process_payment(rental_id):
         else:
             return jsonify({'success': False, 'message': 'Phương thức thanh toán không hợp lệ!'}), 400
             
+    except StaleDataError:
+        session.rollback()
+        return _stale_rental_response()
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'}), 500
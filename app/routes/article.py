@@ -1,13 +1,17 @@
 from flask import render_template, request, jsonify, redirect, url_for
 from sqlalchemy import desc
+from sqlalchemy.orm import defer
 from datetime import datetime
 
 from . import bp
+from .. import article_views, media_store
 from ..extensions import get_db_session
 from ..models import Article
+from ..page_cache import cached_page, page_cache
 
 
 @bp.route('/tintuc')
+@cached_page('article')
 def tintuc():
     """Trang tin tức công khai"""
     db = get_db_session()
@@ -25,11 +29,20 @@ def tintuc():
         return render_template('tintuc.html', articles=[])
 
 
+@bp.route('/api/article/<int:a_id>/view', methods=['POST'])
+def article_view(a_id):
+    """Ghi nhận một lượt xem bài viết (cộng trong bộ nhớ, job article-views ghi xuống DB)"""
+    article_views.record(a_id)
+    return '', 204
+
+
 @bp.route('/admin/articles')
 def articles():
     db = get_db_session()
     try:
-        articles = db.query(Article).order_by(desc(Article.created_at)).all()
+        # Danh sách không hiển thị nội dung; nội dung được tải khi mở form sửa
+        articles = db.query(Article).options(defer(Article.content))\
+            .order_by(desc(Article.created_at)).all()
         db.close()
         return render_template('admin/article.html', articles=articles)
     except Exception as e:
@@ -51,13 +64,10 @@ def article_create():
 
         # Xử lý upload ảnh nếu có
         if featured_image_file and featured_image_file.filename:
-            import os
-            save_dir = os.path.join('app', 'static', 'images', 'articles')
-            os.makedirs(save_dir, exist_ok=True)
-            filename = f"{int(datetime.now().timestamp())}_{featured_image_file.filename}"
-            filepath = os.path.join(save_dir, filename)
-            featured_image_file.save(filepath)
-            featured_image = f"images/articles/{filename}"
+            featured_image = media_store.store_upload(db, featured_image_file, perceptual=True)
+
+        # Ảnh base64 trong nội dung được tách ra thành file trong kho ảnh
+        content, _ = media_store.extract_inline_images(db, content)
 
         article = Article(
             title=title,
@@ -72,6 +82,7 @@ def article_create():
         db.add(article)
         db.commit()
         db.close()
+        page_cache.invalidate('article')
         return jsonify({"success": True})
     except Exception as e:
         db.rollback()
@@ -108,15 +119,9 @@ def article_edit(a_id):
         view_count = request.form.get('view_count', 0)
         featured_image_file = request.files.get('featured_image_file')
         if featured_image_file and featured_image_file.filename:
-            import os
-            save_dir = os.path.join('app', 'static', 'images', 'articles')
-            os.makedirs(save_dir, exist_ok=True)
-            filename = f"{int(datetime.now().timestamp())}_{featured_image_file.filename}"
-            filepath = os.path.join(save_dir, filename)
-            featured_image_file.save(filepath)
-            featured_image = f"images/articles/{filename}"
+            featured_image = media_store.store_upload(db, featured_image_file, perceptual=True)
         article.title = title
-        article.content = content
+        article.content, _ = media_store.extract_inline_images(db, content)
         article.featured_image = featured_image
         article.is_published = is_published
         article.published_at = datetime.strptime(published_at, "%Y-%m-%d") if published_at else None
@@ -124,6 +129,7 @@ def article_edit(a_id):
         article.updated_at = datetime.now()
         db.commit()
         db.close()
+        page_cache.invalidate('article')
         return jsonify({"success": True})
     except Exception as e:
         db.rollback()
@@ -142,6 +148,7 @@ def article_delete(a_id):
         db.delete(article)
         db.commit()
         db.close()
+        page_cache.invalidate('article')
         # After deletion, redirect back to the articles list (template expects reload)
         return redirect(url_for('admin.articles'))
     except Exception as e:
@@ -3,6 +3,7 @@ import re
 from . import bp
 from app.extensions import get_db_session
 from app.models import StoreInfo
+from app.page_cache import cached_page, page_cache
 
 
 def convert_google_drive_link(url):
@@ -55,6 +56,7 @@ def convert_google_drive_link(url):
 
 
 @bp.route('/gioithieu')
+@cached_page('store_info')
 def gioithieu():
     """Trang giới thiệu"""
     session = get_db_session()
@@ -66,6 +68,7 @@ def gioithieu():
 
 
 @bp.route('/lienhe')
+@cached_page('store_info')
 def lienhe():
     """Trang liên hệ - Load thông tin từ database"""
     session = get_db_session()
@@ -100,6 +103,7 @@ def store_info():
         
         store.description = request.form.get('description')
         session.commit()
+        page_cache.invalidate('store_info')
         flash('Cập nhật thông tin cửa hàng thành công!', 'success')
         session.close()
         return redirect(url_for('admin.store_info'))
@@ -4,9 +4,11 @@ from datetime import datetime
 from . import bp
 from app.extensions import get_db_session
 from app.models import StoreInfo, Catagory_Motorcycle, Article
+from app.page_cache import cached_page
 
 
 @bp.route('/')
+@cached_page('store_info', 'catalog', 'article')
 def home():
     session = get_db_session()
     try:
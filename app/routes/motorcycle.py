@@ -1,10 +1,18 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import render_template, request, redirect, url_for, flash, jsonify, current_app, Response, stream_with_context
 import os
-from werkzeug.utils import secure_filename
 from . import bp
 from ..extensions import get_db_session
 from ..models import Catagory_Motorcycle, Motorcycles
+from ..availability import availability_index
+from ..page_cache import page_cache
+from ..images import process_category_image
+from .. import media_store, motorcycle_io
+from ..uploads import UploadError
 from decimal import Decimal, InvalidOperation
+from sqlalchemy.exc import IntegrityError
+
+
+MAX_IMPORT_ERRORS = 200
 
 
 def _to_decimal(value):
@@ -34,29 +42,21 @@ def catagorie_motorcycle_create():
         price_per_month = _to_decimal(request.form.get('price_per_month'))
         
         image = (request.form.get('image') or '').strip()
+        uploaded = False
         
-        if 'image_file' in request.files:
-            file = request.files['image_file']
-            if file and file.filename:
-                subdir = os.path.join('images', 'catagories_motorcycle')
-                static_dir = current_app.static_folder
-                save_dir = os.path.join(static_dir, subdir)
-                os.makedirs(save_dir, exist_ok=True)
-                filename = secure_filename(file.filename)
-                base, ext = os.path.splitext(filename)
-                counter = 1
-                final_name = filename
-                while os.path.exists(os.path.join(save_dir, final_name)):
-                    final_name = f"{base}_{counter}{ext}"
-                    counter += 1
-                file_path = os.path.join(save_dir, final_name)
-                file.save(file_path)
-                image = os.path.join(subdir, final_name).replace('\\', '/')
-
         if not name:
             return jsonify({'success': False, 'message': 'Tên loại xe là bắt buộc'}), 400
 
         db = get_db_session()
+        if 'image_file' in request.files:
+            file = request.files['image_file']
+            if file and file.filename:
+                try:
+                    image = media_store.store_upload(db, file, perceptual=True)
+                except UploadError as e:
+                    return jsonify({'success': False, 'message': e.message}), e.status_code
+                uploaded = True
+
         m = Catagory_Motorcycle(
             name=name,
             brand=brand,
@@ -67,7 +67,11 @@ def catagorie_motorcycle_create():
             image=image,
         )
         db.add(m)
+        db.flush()
+        if uploaded:
+            process_category_image(db, m.id, m.image)
         db.commit()
+        page_cache.invalidate('catalog')
         try:
             print('Saved category', m.id, 'image =', m.image)
         except Exception:
@@ -98,24 +102,16 @@ def catagorie_motorcycle_edit(m_id):
             m.price_per_month = price_per_month
         new_image = None
         delete_old_image = False
+        uploaded = False
         if 'image_file' in request.files:
             file = request.files['image_file']
             if file and file.filename:
-                subdir = os.path.join('images', 'catagories_motorcycle')
-                static_dir = current_app.static_folder
-                save_dir = os.path.join(static_dir, subdir)
-                os.makedirs(save_dir, exist_ok=True)
-                filename = secure_filename(file.filename)
-                base, ext = os.path.splitext(filename)
-                counter = 1
-                final_name = filename
-                while os.path.exists(os.path.join(save_dir, final_name)):
-                    final_name = f"{base}_{counter}{ext}"
-                    counter += 1
-                file_path = os.path.join(save_dir, final_name)
-                file.save(file_path)
-                new_image = os.path.join(subdir, final_name).replace('\\', '/')
+                try:
+                    new_image = media_store.store_upload(db, file, perceptual=True)
+                except UploadError as e:
+                    return jsonify({'success': False, 'message': e.message}), e.status_code
                 delete_old_image = True 
+                uploaded = True
         if new_image is None:
             image_url = request.form.get('image', '').strip()
             if image_url:
@@ -126,7 +122,8 @@ def catagorie_motorcycle_edit(m_id):
                 if previous_image:
                     delete_old_image = True
                     new_image = None
-        if delete_old_image and previous_image:
+        # Ảnh trong kho có thể dùng chung, để media-gc dọn khi hết tham chiếu
+        if delete_old_image and previous_image and not media_store.is_managed(previous_image):
             try:
                 if not previous_image.startswith('http'):
                     old_path = os.path.join(current_app.static_folder, previous_image)
@@ -137,7 +134,10 @@ def catagorie_motorcycle_edit(m_id):
         if delete_old_image or new_image is not None:
             m.image = new_image
         db.add(m)
+        if uploaded:
+            process_category_image(db, m.id, m.image)
         db.commit()
+        page_cache.invalidate('catalog')
         try:
             print('Updated category', m.id, 'image =', m.image)
         except Exception:
@@ -165,7 +165,7 @@ def catagorie_motorcycle_delete(m_id):
     if not m:
         flash('Loại xe không tồn tại', 'warning')
         return redirect(url_for('admin.catagories_motorcycle'))
-    if m.image:
+    if m.image and not media_store.is_managed(m.image):
         try:
             if not m.image.startswith('http'):
                 old_path = os.path.join(current_app.static_folder, m.image)
@@ -177,6 +177,9 @@ def catagorie_motorcycle_delete(m_id):
 
     db.delete(m)
     db.commit()
+    # Xóa loại xe sẽ xóa luôn các xe thuộc loại đó
+    availability_index.invalidate()
+    page_cache.invalidate('catalog')
     flash('Xóa loại xe thành công', 'success')
     return redirect(url_for('admin.catagories_motorcycle'))
 
@@ -239,6 +242,7 @@ def motorcycle_create():
         )
         db.add(dm)
         db.commit()
+        availability_index.sync_motorcycle(dm.id, dm.category_id, dm.status)
         return jsonify({'success': True, 'message': 'Thêm xe thành công'})
     return jsonify({
         'success': True,
@@ -253,6 +257,45 @@ def motorcycle_create():
     })
 
 
+@bp.route('/admin/motorcycles/import', methods=['POST'])
+def motorcycles_import():
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'message': 'Vui lòng chọn file CSV hoặc Excel'}), 400
+    dry_run = request.form.get('dry_run') in ('1', 'true', 'on')
+    strict = request.form.get('strict') in ('1', 'true', 'on')
+    db = get_db_session()
+    try:
+        inserted, errors = motorcycle_io.import_motorcycles(db, upload.stream, upload.filename,
+                                                            dry_run=dry_run, strict=strict)
+    except motorcycle_io.ImportFileError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except IntegrityError:
+        return jsonify({'success': False,
+                        'message': 'Có biển số vừa được thêm trong lúc nhập, vui lòng thử lại'}), 409
+    return jsonify({
+        'success': not (strict and errors),
+        'dry_run': dry_run,
+        'inserted': inserted,
+        'error_count': len(errors),
+        'errors': [{'line': line, 'message': message} for line, message in errors[:MAX_IMPORT_ERRORS]],
+        'message': (f'Hợp lệ {inserted} xe' if dry_run else f'Đã thêm {inserted} xe')
+                   + (f', {len(errors)} dòng lỗi' if errors else ''),
+    })
+
+
+@bp.route('/admin/motorcycles/export.csv')
+def motorcycles_export():
+    category_id = request.args.get('motorcycle_id', type=int)
+    db = get_db_session()
+    filename = f'motorcycles-{category_id}.csv' if category_id else 'motorcycles.csv'
+    return Response(
+        stream_with_context(motorcycle_io.export_csv(db, category_id)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
 @bp.route('/admin/motorcycle/<int:dm_id>/edit', methods=['GET', 'POST'])
 def motorcycle_edit(dm_id):
     db = get_db_session()
@@ -291,6 +334,7 @@ def motorcycle_edit(dm_id):
         dm.status = status or 'ready'
         db.add(dm)
         db.commit()
+        availability_index.sync_motorcycle(dm.id, dm.category_id, dm.status)
         return jsonify({'success': True, 'message': 'Cập nhật chi tiết xe thành công'})
     return jsonify({
         'success': True,
@@ -315,5 +359,6 @@ def motorcycle_delete(dm_id):
     motorcycle_id = dm.category_id
     db.delete(dm)
     db.commit()
+    availability_index.remove_motorcycle(dm_id)
     flash('Xóa xe thành công', 'success')
     return redirect(url_for('admin.motorcycles', motorcycle_id=motorcycle_id))
@@ -1,51 +1,152 @@
 from flask import jsonify, request, redirect, url_for, render_template, flash
-from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 from decimal import Decimal
 import os
-import random
 from . import bp
 from app.extensions import get_db_session
+from app.order_ids import generate_order_id
 from app.models import Customer, Rental, RentalItem, Payment, Catagory_Motorcycle
 from app.vnpay_helper import VNPay, get_client_ip
+from app.availability import availability_index, lock_motorcycles, pick_free_motorcycles, verify_free
+from app import booking_holds, images, media_store, pricing, vnpay_ipn
+from app.uploads import UploadError, parse_streaming_form, upload_error_response
 
 
-def generate_order_id():
-    """Generate unique order ID"""
-    return datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(1000, 9999))
+@bp.route('/rental/health')
+def rental_health():
+    return jsonify({'ok': True, 'service': 'rental'})
 
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+@bp.route('/api/rental/availability', methods=['GET'])
+def rental_availability():
+    """Số xe còn trống của một loại xe trong khoảng ngày (dùng cho form đặt xe)"""
+    category_id = request.args.get('motorcycle_id', type=int)
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    if not category_id or not start_date_str or not end_date_str:
+        return jsonify({'success': False, 'message': 'Thiếu loại xe hoặc ngày thuê!'}), 400
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Định dạng ngày không hợp lệ!'}), 400
+    if end_date < start_date:
+        return jsonify({'success': False, 'message': 'Ngày kết thúc phải sau ngày bắt đầu!'}), 400
+    
+    session = get_db_session()
+    try:
+        available = availability_index.count_free(session, category_id, start_date, end_date)
+        return jsonify({'success': True, 'motorcycle_id': category_id, 'available': available})
+    finally:
+        session.close()
+
 
+@bp.route('/api/quote', methods=['POST'])
+def rental_quote():
+    """Báo giá nhiều (loại xe, ngày bắt đầu, ngày kết thúc, số lượng) trong một request"""
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': 'Thiếu danh sách cần báo giá!'}), 400
+    if len(items) > pricing.MAX_QUOTE_ITEMS:
+        return jsonify({'success': False,
+                        'message': f'Tối đa {pricing.MAX_QUOTE_ITEMS} mục mỗi lần báo giá!'}), 400
+    
+    requests_ = []
+    try:
+        for item in items:
+            start_date = datetime.strptime(item['start_date'], '%Y-%m-%d')
+            end_date = datetime.strptime(item['end_date'], '%Y-%m-%d')
+            quantity = int(item.get('quantity', 1))
+            if end_date < start_date or quantity < 1:
+                raise ValueError
+            requests_.append((int(item['category_id']), start_date, end_date, quantity))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Dữ liệu báo giá không hợp lệ!'}), 400
+    
+    session = get_db_session()
+    try:
+        return jsonify({'success': True, 'quotes': pricing.quote_many(session, requests_)})
+    finally:
+        session.close()
 
-def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+CITIZEN_ID_FILE_FIELDS = ('citizen_id_front_image', 'citizen_id_back_image')
 
-def save_uploaded_file(file, folder='uploads/citizen_id'):
-    """Save uploaded file and return relative path"""
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # Create unique filename with timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-        filename = timestamp + filename
-        
-        # Create upload directory if not exists (relative to app/static)
-        upload_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', folder)
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        filepath = os.path.join(upload_dir, filename)
-        file.save(filepath)
-        
-        # Return relative path for database (from static folder)
-        return os.path.join(folder, filename)
-    return None
 
+def _validate_booking(session, form):
+    """Check the text fields of the booking form (before any image is read).
 
-@bp.route('/rental/health')
-def rental_health():
-    return jsonify({'ok': True, 'service': 'rental'})
+    Returns the parsed values; raises UploadError with the JSON message.
+    """
+    motorcycle_id = form.get('motorcycle_id')
+    try:
+        quantity = int(form.get('quantity', 1))
+        days = int(form.get('days', 1))
+        
+        # Rental dates
+        start_date_str = form.get('start_date')
+        end_date_str = form.get('end_date')
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+        
+        date_of_birth_str = form.get('date_of_birth')
+        date_of_birth = datetime.strptime(date_of_birth_str, '%Y-%m-%d') if date_of_birth_str else None
+    except ValueError:
+        raise UploadError('Dữ liệu nhập không hợp lệ!')
+    
+    # Validate dates
+    if start_date and end_date:
+        if end_date < start_date:
+            raise UploadError('Ngày kết thúc phải sau ngày bắt đầu!')
+        # Recalculate days from dates
+        days = (end_date - start_date).days + 1
+        if days < 1:
+            raise UploadError('Số ngày thuê không hợp lệ!')
+    
+    # Customer information
+    booking = {
+        'quantity': quantity,
+        'days': days,
+        'start_date': start_date,
+        'end_date': end_date,
+        'full_name': form.get('full_name'),
+        'phone': form.get('phone'),
+        'email': form.get('email') or None,
+        'date_of_birth': date_of_birth,
+        'hometown': form.get('hometown'),
+        'address': form.get('address'),
+        'citizen_id': form.get('citizen_id'),
+    }
+    
+    # Validate required fields
+    required = ('full_name', 'phone', 'date_of_birth', 'hometown', 'address', 'citizen_id', 'start_date', 'end_date')
+    if not motorcycle_id or not all(booking[key] for key in required):
+        raise UploadError('Vui lòng điền đầy đủ thông tin bắt buộc!')
+    
+    if quantity < 1:
+        raise UploadError('Số lượng xe không hợp lệ!')
+    
+    # Get motorcycle category for price (motorcycle_id is actually category_id from form)
+    motorcycle = session.query(Catagory_Motorcycle).filter(Catagory_Motorcycle.id == motorcycle_id).first()
+    if not motorcycle:
+        raise UploadError('Không tìm thấy xe máy!', 404)
+    
+    # Check availability before reading any image
+    chosen_motorcycle_ids, free_count = pick_free_motorcycles(
+        session, motorcycle.id, start_date, end_date, quantity
+    )
+    if chosen_motorcycle_ids is None:
+        raise UploadError(
+            f'Chỉ còn {free_count} xe {motorcycle.name} trống trong khoảng thời gian này!',
+            409, available=free_count
+        )
+    
+    booking['motorcycle'] = motorcycle
+    booking['chosen_motorcycle_ids'] = chosen_motorcycle_ids
+    # Giữ tạm các xe này trong lúc ảnh còn đang upload (request song song sẽ chọn xe khác)
+    booking['reservation'] = booking_holds.reserve(chosen_motorcycle_ids, start_date, end_date)
+    return booking
 
 
 @bp.route('/api/rental/submit', methods=['POST'])
@@ -53,71 +154,43 @@ def submit_rental():
     """Xử lý submit form đặt xe"""
     try:
         session = get_db_session()
+        upload = None
+        booking = {}
         
         try:
-            # Get form data
-            motorcycle_id = request.form.get('motorcycle_id')
-            quantity = int(request.form.get('quantity', 1))
-            days = int(request.form.get('days', 1))
-            
-            # Rental dates
-            start_date_str = request.form.get('start_date')
-            end_date_str = request.form.get('end_date')
-            
-            # Parse rental dates
-            start_date = None
-            end_date = None
-            if start_date_str:
-                start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            if end_date_str:
-                end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            
-            # Validate dates
-            if start_date and end_date:
-                if end_date < start_date:
-                    return jsonify({'success': False, 'message': 'Ngày kết thúc phải sau ngày bắt đầu!'}), 400
-                # Recalculate days from dates
-                days = (end_date - start_date).days + 1
-                if days < 1:
-                    return jsonify({'success': False, 'message': 'Số ngày thuê không hợp lệ!'}), 400
-            
-            # Customer information
-            full_name = request.form.get('full_name')
-            phone = request.form.get('phone')
-            email = request.form.get('email') or None
-            date_of_birth_str = request.form.get('date_of_birth')
-            hometown = request.form.get('hometown')
-            address = request.form.get('address')
-            citizen_id = request.form.get('citizen_id')
-            
-            # Parse date of birth
-            date_of_birth = None
-            if date_of_birth_str:
-                date_of_birth = datetime.strptime(date_of_birth_str, '%Y-%m-%d')
+            # Field text được kiểm tra trước khi đọc ảnh; ảnh được ghi dần ra file tạm
+            upload = parse_streaming_form(
+                request,
+                on_fields=lambda form: booking.update(_validate_booking(session, form)),
+                file_fields=CITIZEN_ID_FILE_FIELDS,
+            )
+            motorcycle = booking['motorcycle']
+            chosen_motorcycle_ids = booking['chosen_motorcycle_ids']
+            quantity = booking['quantity']
+            days = booking['days']
+            start_date = booking['start_date']
+            end_date = booking['end_date']
+            full_name = booking['full_name']
+            phone = booking['phone']
+            email = booking['email']
+            date_of_birth = booking['date_of_birth']
+            hometown = booking['hometown']
+            address = booking['address']
+            citizen_id = booking['citizen_id']
+            
+            if any(name not in upload.files for name in CITIZEN_ID_FILE_FIELDS):
+                return jsonify({'success': False, 'message': 'Vui lòng upload đầy đủ ảnh CCCD!'}), 400
             
-            # Validate required fields
-            if not all([motorcycle_id, full_name, phone, date_of_birth, hometown, address, citizen_id, start_date, end_date]):
-                return jsonify({'success': False, 'message': 'Vui lòng điền đầy đủ thông tin bắt buộc!'}), 400
+            # Generate order ID for VNPay (trước lần ghi đầu tiên: bộ đếm dùng
+            # connection riêng, trên SQLite sẽ phải chờ khóa ghi của session này)
+            order_id = generate_order_id()
             
             # Check if customer exists by citizen_id
             customer = session.query(Customer).filter(Customer.citizen_id == citizen_id).first()
             
             # Save uploaded images
-            front_image = None
-            back_image = None
-            
-            if 'citizen_id_front_image' in request.files:
-                file = request.files['citizen_id_front_image']
-                if file.filename:
-                    front_image = save_uploaded_file(file, 'uploads/citizen_id')
-            
-            if 'citizen_id_back_image' in request.files:
-                file = request.files['citizen_id_back_image']
-                if file.filename:
-                    back_image = save_uploaded_file(file, 'uploads/citizen_id')
-            
-            if not front_image or not back_image:
-                return jsonify({'success': False, 'message': 'Vui lòng upload đầy đủ ảnh CCCD!'}), 400
+            front_image = media_store.store_upload(session, upload.files['citizen_id_front_image'], perceptual=False)
+            back_image = media_store.store_upload(session, upload.files['citizen_id_back_image'], perceptual=False)
             
             # Create or update customer
             if customer:
@@ -147,14 +220,12 @@ def submit_rental():
             
             session.flush()  # Get customer ID
             
-            # Get motorcycle category for price (motorcycle_id is actually category_id from form)
-            motorcycle = session.query(Catagory_Motorcycle).filter(Catagory_Motorcycle.id == motorcycle_id).first()
-            if not motorcycle:
-                return jsonify({'success': False, 'message': 'Không tìm thấy xe máy!'}), 404
+            # Giá rẻ nhất theo bậc ngày/tuần/tháng, đặt cọc 50%
+            total_amount = pricing.category_table(motorcycle).total(days) * quantity
+            deposit_amount = pricing.deposit_for(total_amount)
             
-            price_per_day = float(motorcycle.price_per_day) if motorcycle.price_per_day else 0
-            total_amount = price_per_day * quantity * days
-            deposit_amount = total_amount * 0.5  # 50% deposit
+            # Giữ xe tới hạn thanh toán VNPay (+ thời gian chờ IPN), quá hạn sẽ tự hủy
+            payment_expires_at = booking_holds.payment_deadline()
             
             # Create rental order (pending payment)
             rental = Rental(
@@ -163,28 +234,24 @@ def submit_rental():
                 end_date=end_date,
                 rental_days=days,
                 quantity=quantity,
-                total_amount=Decimal(str(total_amount)),
-                deposit_amount=Decimal(str(deposit_amount)),
+                total_amount=total_amount,
+                deposit_amount=deposit_amount,
                 paid_amount=Decimal('0'),
                 status='pending',
-                payment_status='pending'
+                payment_status='pending',
+                hold_expires_at=booking_holds.hold_deadline(payment_expires_at)
             )
             session.add(rental)
             session.flush()  # Get rental ID
             
-            # Create rental items
-            # Note: motorcycle_id in RentalItem refers to motorcycles table (Detail_Motorcycle)
-            # For now, we'll use category_id as reference, but ideally should select available motorcycles
-            # TODO: Implement logic to select available motorcycles from the category
-            rental_item = RentalItem(
-                rental_id=rental.id,
-                motorcycle_id=None,  # Will be assigned when actual motorcycle is selected
-                price_per_day=Decimal(str(price_per_day))
-            )
-            session.add(rental_item)
-            
-            # Generate order ID for VNPay
-            order_id = generate_order_id()
+            # Create one rental item per motorcycle picked by the availability engine
+            # (admin can still re-assign them in the rental detail page)
+            for chosen_id in chosen_motorcycle_ids:
+                session.add(RentalItem(
+                    rental_id=rental.id,
+                    motorcycle_id=chosen_id,
+                    **pricing.snapshot_prices(motorcycle)
+                ))
             
             # Get client IP
             ip_addr = get_client_ip(request)
@@ -201,7 +268,9 @@ def submit_rental():
                 order_desc=order_desc,
                 ip_addr=ip_addr,
                 bank_code='',  # Empty to let VNPay choose
-                return_url=return_url
+                return_url=return_url,
+                expire_date=payment_expires_at,
+                create_date=order_id[:14]  # = vnp_TransactionDate khi đối soát
             )
             
             # Store order_id in rental for reference
@@ -211,13 +280,26 @@ def submit_rental():
             payment = Payment(
                 rental_id=rental.id,
                 payment_code=order_id,
-                amount=Decimal(str(deposit_amount)),
+                amount=deposit_amount,
                 payment_method='vnpay',
                 payment_status='pending'
             )
             session.add(payment)
-            
+            session.flush()
+            
+            # Kiểm tra lại với DB: đơn của process khác có thể đã lấy xe trong lúc upload ảnh.
+            # Khóa các xe trước (giữ tới commit) để đơn song song phải chờ rồi mới kiểm tra
+            lock_motorcycles(session, chosen_motorcycle_ids)
+            if len(verify_free(session, chosen_motorcycle_ids, start_date, end_date,
+                               exclude_rental_id=rental.id)) < len(chosen_motorcycle_ids):
+                session.rollback()
+                availability_index.invalidate()
+                return jsonify({'success': False,
+                                'message': 'Xe vừa được người khác đặt, vui lòng thử lại!'}), 409
+            
+            images.process_customer_images(session, customer.id, front_image, back_image)
             session.commit()
+            availability_index.record_rental(rental.id, chosen_motorcycle_ids, start_date, end_date)
             
             return jsonify({
                 'success': True,
@@ -226,10 +308,16 @@ def submit_rental():
                 'message': 'Tạo yêu cầu thanh toán thành công!'
             })
             
+        except UploadError as e:
+            session.rollback()
+            return upload_error_response(e)
         except Exception as e:
             session.rollback()
             return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'}), 500
         finally:
+            booking_holds.release_reservation(booking.get('reservation'))
+            if upload is not None:
+                upload.close()
             session.close()
             
     except Exception as e:
@@ -252,13 +340,7 @@ def payment_return():
                                      message='Không có dữ liệu callback từ VNPay!')
             
             # Validate callback
-            vnp = VNPay()
-            vnp.responseData = callback_data
-            
-            # Debug: Print callback data
-            print(f"VNPay Callback Data: {callback_data}")
-            
-            if not vnp.validate_response():
+            if not VNPay().validate_response(callback_data):
                 return render_template('payment_return.html', 
                                      success=False,
                                      message='Sai chữ ký xác thực! Vui lòng kiểm tra lại cấu hình VNPAY_HASH_SECRET trong file .env')
@@ -270,98 +352,33 @@ def payment_return():
             transaction_no = callback_data.get('vnp_TransactionNo', '')
             amount = float(callback_data.get('vnp_Amount', 0)) / 100  # Convert from cents
             bank_code = callback_data.get('vnp_BankCode', '')
-            pay_date = callback_data.get('vnp_PayDate', '')
-            
-            # Determine payment success
-            payment_success = False
-            if response_code:
-                payment_success = (response_code == '00')
-            elif transaction_status:
-                payment_success = (transaction_status == '00')
-            else:
-                payment_success = (transaction_no and transaction_no != '0')
             
-            # Find payment by order_id (payment_code)
-            payment = session.query(Payment).filter(Payment.payment_code == order_id).first()
+            # Ghi vào inbox chung với IPN rồi xử lý ngay; nếu IPN (hoặc lần tải
+            # trang trước) đã xử lý thì chỉ đọc lại kết quả đã lưu
+            entry_id, _ = vnpay_ipn.record(session, callback_data, source='return')
+            outcome = vnpay_ipn.process_entry(session, entry_id)
             
-            if not payment:
-                # Try to find by rental's vnpay_transaction_id (for backward compatibility)
-                rental = session.query(Rental).filter(Rental.vnpay_transaction_id == order_id).first()
-                if rental:
-                    payment = session.query(Payment).filter(Payment.rental_id == rental.id).order_by(Payment.id.desc()).first()
+            if outcome is None:
+                return render_template('payment_return.html',
+                                     success=False,
+                                     message='Chưa xử lý được giao dịch, hệ thống sẽ tự thử lại. Vui lòng kiểm tra lại sau ít phút.')
             
-            if not payment:
+            if outcome == 'not_found':
                 return render_template('payment_return.html',
                                      success=False,
                                      message='Không tìm thấy giao dịch thanh toán!')
             
-            rental = session.query(Rental).filter(Rental.id == payment.rental_id).first()
-            if not rental:
+            if outcome == 'invalid_amount':
                 return render_template('payment_return.html',
                                      success=False,
-                                     message='Không tìm thấy đơn hàng!')
+                                     message='Số tiền thanh toán không khớp với giao dịch!')
             
-            if payment_success:  # Payment success
-                # Update payment record
-                payment.payment_status = 'paid'
-                payment.vnpay_transaction_id = transaction_no
-                payment.vnpay_bank_code = bank_code
-                if pay_date:
-                    try:
-                        payment.vnpay_pay_date = datetime.strptime(pay_date, '%Y%m%d%H%M%S')
-                    except:
-                        pass
-                payment.payment_date = datetime.now()
-                
-                # Update rental - add to paid amount
-                current_paid = rental.paid_amount or Decimal('0')
-                rental.paid_amount = current_paid + Decimal(str(amount))
-                rental.vnpay_bank_code = bank_code
-                rental.payment_method = 'vnpay'
-                
-                # If rental has actual_return_date, it means it's a return payment
-                # Calculate total amount and check if fully paid
-                if rental.actual_return_date:
-                    # Get all rental items with assigned motorcycles
-                    from app.models import RentalItem, Motorcycles
-                    items = session.query(RentalItem).filter(
-                        RentalItem.rental_id == rental.id,
-                        RentalItem.motorcycle_id.isnot(None)
-                    ).all()
-                    
-                    # Calculate total amount based on actual days
-                    if items and rental.start_date:
-                        time_diff = rental.actual_return_date - rental.start_date
-                        actual_days = max(1, (time_diff.days + 1))
-                        total_amount = Decimal('0')
-                        for item in items:
-                            if item.price_per_day:
-                                total_amount += Decimal(str(item.price_per_day)) * actual_days
-                        rental.total_amount = total_amount
-                        
-                        # Check if fully paid
-                        if rental.paid_amount >= total_amount:
-                            rental.payment_status = 'paid'
-                            rental.status = 'returned'
-                            
-                            # Update all motorcycles status to 'ready'
-                            for item in items:
-                                if item.motorcycle_id:
-                                    motorcycle = session.query(Motorcycles).filter(Motorcycles.id == item.motorcycle_id).first()
-                                    if motorcycle:
-                                        motorcycle.status = 'ready'
-                        else:
-                            rental.payment_status = 'partial'
-                    else:
-                        rental.payment_status = 'paid'
-                        rental.status = 'returned'
-                else:
-                    # Initial deposit payment
-                    rental.status = 'confirmed'
-                    rental.payment_status = 'paid'
-                
-                session.commit()
-                
+            if outcome == 'paid_after_cancel':
+                return render_template('payment_return.html',
+                                     success=False,
+                                     message='Đã nhận thanh toán nhưng đơn đặt xe đã hết hạn giữ chỗ và bị hủy. Chúng tôi sẽ liên hệ để hoàn tiền hoặc sắp xếp lại xe cho bạn.')
+
+            if outcome in ('paid', 'already_confirmed'):  # Payment success
                 # Check if payment is from admin (via query parameter)
                 is_admin = request.args.get('admin') == '1'
                 rental_id_param = request.args.get('rental_id')
@@ -371,6 +388,8 @@ def payment_return():
                     return redirect(url_for('admin.rentals'))
                 
                 # Get customer info for display
+                payment = vnpay_ipn.find_payment(session, order_id)
+                rental = session.query(Rental).filter(Rental.id == payment.rental_id).first()
                 customer = session.query(Customer).filter(Customer.id == rental.customer_id).first()
                 
                 return render_template('payment_return.html',
@@ -382,16 +401,6 @@ def payment_return():
                                      amount=amount)
             else:
                 # Payment failed or pending
-                # TransactionStatus '02' might mean pending, so we keep it as pending
-                if transaction_status == '02':
-                    rental.status = 'pending'
-                    rental.payment_status = 'pending'
-                else:
-                    rental.status = 'cancelled'
-                    rental.payment_status = 'failed'
-                
-                session.commit()
-                
                 # Determine error message
                 error_msg = 'Thanh toán thất bại!'
                 if transaction_status == '02':
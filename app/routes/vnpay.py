@@ -4,7 +4,9 @@ VNPay routes - Tích hợp VNPay vào Flask app
 from flask import jsonify, request, redirect, url_for
 from datetime import datetime
 from . import bp
+from app.extensions import get_db_session
 from app.vnpay_helper import VNPay, get_client_ip
+from app import vnpay_ipn
 
 
 @bp.route('/api/vnpay/create_payment', methods=['POST'])
@@ -68,9 +70,6 @@ def api_payment_callback():
                 'message': 'Invalid request'
             }), 400
         
-        vnp = VNPay()
-        vnp.responseData = input_data
-        
         order_id = input_data.get('vnp_TxnRef', '')
         amount = int(input_data.get('vnp_Amount', 0)) / 100
         order_desc = input_data.get('vnp_OrderInfo', '')
@@ -82,7 +81,7 @@ def api_payment_callback():
         vnp_CardType = input_data.get('vnp_CardType', '')
         vnp_TransactionStatus = input_data.get('vnp_TransactionStatus', '')
         
-        if vnp.validate_response():
+        if VNPay().validate_response(input_data):
             # Determine success
             is_success = False
             if vnp_ResponseCode:
@@ -120,3 +119,26 @@ def api_payment_callback():
             'message': f'Error: {str(e)}'
         }), 500
 
+
+@bp.route('/api/vnpay/ipn', methods=['GET'])
+def api_vnpay_ipn():
+    """IPN từ VNPay (server-to-server): ghi inbox rồi trả lời ngay, worker xử lý sau"""
+    input_data = {k: v for k, v in request.args.items() if k.startswith('vnp_')}
+    if not VNPay().validate_response(input_data):
+        return jsonify({'RspCode': '97', 'Message': 'Invalid Checksum'})
+
+    session = get_db_session()
+    try:
+        entry_id, created = vnpay_ipn.record(session, input_data, source='ipn')
+    except Exception as e:
+        session.rollback()
+        print(f"Lỗi ghi VNPay IPN: {e}")
+        return jsonify({'RspCode': '99', 'Message': 'Unknow error'})
+    finally:
+        session.close()
+
+    if not created:
+        # VNPay gửi lại IPN đã nhận: không xử lý lần hai
+        return jsonify({'RspCode': '02', 'Message': 'Order already confirmed'})
+    vnpay_ipn.inbox_worker.notify()
+    return jsonify({'RspCode': '00', 'Message': 'Confirm Success'})
@@ -0,0 +1,272 @@
+"""
+Tìm kiếm cho các ô search trong admin.
+
+Mỗi Customer / Rental / Payment có một dòng trong bảng `search_document`
+chứa văn bản đã chuẩn hóa (chữ thường, bỏ dấu tiếng Việt) của các cột cần
+tìm. Dòng này được cập nhật tự động bằng ORM event sau mỗi insert/update/
+delete (upsert theo (kind, ref_id), nên hai transaction cùng sửa một khách
+không đụng khóa duy nhất), nên "nguyen" khớp "Nguyễn". Dữ liệu có từ trước
+được nạp bởi migration 0013 (hoặc `flask search-reindex`).
+
+Index theo từng loại database:
+ - PostgreSQL: GIN index pg_trgm trên search_document.document (LIKE '%x%'
+   và word_similarity đều dùng index).
+ - SQLite: bảng ảo FTS5 (tokenizer trigram) đồng bộ bằng trigger.
+ - Khác: LIKE trên search_document (vẫn nhỏ hơn nhiều so với OR-chain ilike).
+"""
+import re
+import unicodedata
+
+from sqlalchemy import Integer, bindparam, delete, event, inspect, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import Customer, Payment, Rental, SearchDocument
+
+
+# Loại tài liệu -> (model, các cột được đánh chỉ mục)
+SEARCH_FIELDS = {
+    'customer': (Customer, ('full_name', 'phone', 'email', 'citizen_id')),
+    'rental': (Rental, ('vnpay_transaction_id',)),
+    'payment': (Payment, ('payment_code', 'vnpay_transaction_id')),
+}
+
+FTS_TABLE = 'search_document_fts'
+
+_search_table = SearchDocument.__table__
+_listeners_registered = False
+
+
+def normalize_text(value):
+    """Lowercase, strip Vietnamese diacritics (đ -> d) and collapse spaces."""
+    if not value:
+        return ''
+    value = str(value).replace('đ', 'd').replace('Đ', 'D')
+    value = unicodedata.normalize('NFD', value)
+    value = ''.join(ch for ch in value if unicodedata.category(ch) != 'Mn')
+    return re.sub(r'\s+', ' ', value).strip().lower()
+
+
+def build_document(obj, kind):
+    _, fields = SEARCH_FIELDS[kind]
+    return ' '.join(normalize_text(getattr(obj, field)) for field in fields if getattr(obj, field))
+
+
+# ---------- schema ----------
+
+def create_search_schema(conn):
+    """Create the dialect-specific search index on a connection (idempotent)."""
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_search_document_trgm "
+                    "ON search_document USING gin (document gin_trgm_ops)"
+                ))
+        except Exception as e:
+            print(f"Không thể tạo pg_trgm index (cần quyền CREATE EXTENSION): {e}")
+    elif dialect == 'sqlite':
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"document, content='search_document', content_rowid='id', tokenize='trigram')"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.id, new.document); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.id, old.document); END"
+        ))
+        # Upsert sửa dòng tại chỗ: bỏ văn bản cũ khỏi FTS rồi thêm văn bản mới
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.id, old.document); "
+            f"INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.id, new.document); END"
+        ))
+
+
+def ensure_search_schema(engine):
+    """Create the dialect-specific search index (idempotent)."""
+    with engine.begin() as conn:
+        create_search_schema(conn)
+
+
+def rebuild_fts(conn):
+    """Re-read the whole FTS index from search_document (SQLite; rows written before the triggers)."""
+    if conn.dialect.name == 'sqlite' and inspect(conn).has_table(FTS_TABLE):
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+# ---------- maintenance ----------
+
+_UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _write_document(connection, kind, ref_id, document):
+    match = (_search_table.c.kind == kind, _search_table.c.ref_id == ref_id)
+    if not document:
+        connection.execute(delete(_search_table).where(*match))
+        return
+    dialect_insert = _UPSERT_INSERTS.get(connection.dialect.name)
+    if dialect_insert is None:
+        connection.execute(delete(_search_table).where(*match))
+        connection.execute(insert(_search_table).values(kind=kind, ref_id=ref_id, document=document))
+        return
+    # ON CONFLICT trên ux_search_document_kind_ref: hai flush song song không lỗi IntegrityError
+    stmt = dialect_insert(_search_table).values(kind=kind, ref_id=ref_id, document=document)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[_search_table.c.kind, _search_table.c.ref_id],
+        set_={'document': stmt.excluded.document},
+    ))
+
+
+def _make_listeners(kind):
+    _, fields = SEARCH_FIELDS[kind]
+
+    def after_insert(mapper, connection, target):
+        _write_document(connection, kind, target.id, build_document(target, kind))
+
+    def after_update(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[field].history.has_changes() for field in fields):
+            _write_document(connection, kind, target.id, build_document(target, kind))
+
+    def after_delete(mapper, connection, target):
+        _write_document(connection, kind, target.id, '')
+
+    return after_insert, after_update, after_delete
+
+
+def register_listeners():
+    """Keep search_document in sync with the ORM (call once per process)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    for kind, (model, _) in SEARCH_FIELDS.items():
+        after_insert, after_update, after_delete = _make_listeners(kind)
+        event.listen(model, 'after_insert', after_insert)
+        event.listen(model, 'after_update', after_update)
+        event.listen(model, 'after_delete', after_delete)
+    _listeners_registered = True
+
+
+def reindex(conn, batch_size=1000):
+    """Rebuild every search document on a connection; return how many were written."""
+    total = 0
+    for kind, (model, fields) in SEARCH_FIELDS.items():
+        conn.execute(delete(_search_table).where(_search_table.c.kind == kind))
+        columns = [model.id] + [getattr(model, field) for field in fields]
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(*columns).where(model.id > last_id).order_by(model.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            values = []
+            for row in rows:
+                document = ' '.join(normalize_text(value) for value in row[1:] if value)
+                if document:
+                    values.append({'kind': kind, 'ref_id': row[0], 'document': document})
+            if values:
+                conn.execute(insert(_search_table), values)
+            total += len(values)
+            last_id = rows[-1][0]
+    rebuild_fts(conn)
+    return total
+
+
+def reindex_all(session, batch_size=1000):
+    """Rebuild every search document (for existing rows / after bulk imports)."""
+    total = reindex(session.connection(), batch_size)
+    session.commit()
+    return total
+
+
+# ---------- queries ----------
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _use_fts(session, term):
+    # Tokenizer trigram chỉ khớp được chuỗi từ 3 ký tự
+    return session.get_bind().dialect.name == 'sqlite' and len(term) >= 3
+
+
+def _fts_query(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def matching_ids(session, kind, term):
+    """Selectable of ref_ids of `kind` whose document contains `term`."""
+    term = normalize_text(term)
+    if _use_fts(session, term):
+        return select(SearchDocument.ref_id).where(
+            SearchDocument.kind == kind,
+            SearchDocument.id.in_(
+                text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_term")
+                .bindparams(fts_term=_fts_query(term))
+                .columns(rowid=Integer)
+            )
+        )
+    return select(SearchDocument.ref_id).where(
+        SearchDocument.kind == kind,
+        SearchDocument.document.like(f'%{_escape_like(term)}%', escape='\\')
+    )
+
+
+def search_filter(session, kind, column, term):
+    """SQL condition `column IN (matching ids)` for use in list queries."""
+    return column.in_(matching_ids(session, kind, term))
+
+
+def ranked_search(session, term, kinds=None, limit=10):
+    """Return [(kind, ref_id, score)] best matches first."""
+    term = normalize_text(term)
+    if not term:
+        return []
+    kinds = list(kinds or SEARCH_FIELDS.keys())
+    dialect = session.get_bind().dialect.name
+    params = {'kinds': kinds, 'limit': limit}
+
+    if _use_fts(session, term):
+        sql = text(
+            f"SELECT d.kind, d.ref_id, -bm25({FTS_TABLE}) AS score "
+            f"FROM {FTS_TABLE} JOIN search_document d ON d.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :fts_term AND d.kind IN :kinds "
+            f"ORDER BY bm25({FTS_TABLE}) LIMIT :limit"
+        )
+        params['fts_term'] = _fts_query(term)
+    elif dialect == 'postgresql':
+        sql = text(
+            "SELECT kind, ref_id, word_similarity(:term, document) AS score "
+            "FROM search_document "
+            "WHERE kind IN :kinds AND (document LIKE :pattern ESCAPE '\\' OR :term <% document) "
+            "ORDER BY score DESC, ref_id DESC LIMIT :limit"
+        )
+        params['term'] = term
+        params['pattern'] = f'%{_escape_like(term)}%'
+    else:
+        # Xếp hạng đơn giản: khớp ở đầu chuỗi trước
+        sql = text(
+            "SELECT kind, ref_id, CASE WHEN document LIKE :prefix ESCAPE '\\' THEN 1.0 ELSE 0.5 END AS score "
+            "FROM search_document "
+            "WHERE kind IN :kinds AND document LIKE :pattern ESCAPE '\\' "
+            "ORDER BY score DESC, ref_id DESC LIMIT :limit"
+        )
+        params['pattern'] = f'%{_escape_like(term)}%'
+        params['prefix'] = f'{_escape_like(term)}%'
+
+    sql = sql.bindparams(bindparam('kinds', expanding=True))
+    return [(row[0], row[1], float(row[2] or 0)) for row in session.execute(sql, params)]
+
+
+def init_app(app):
+    """Register ORM listeners and create the search index at startup."""
+    register_listeners()
+    if app.config.get('DB_CREATE_TABLES'):
+        from app.extensions import get_engine
+        ensure_search_schema(get_engine())
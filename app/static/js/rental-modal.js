@@ -39,6 +39,12 @@ function openRentalModal(motorcycleId, motorcycleName, pricePerDay) {
     document.getElementById('start_date').min = today;
     document.getElementById('end_date').min = today;
     
+    const availabilityInfo = document.getElementById('availabilityInfo');
+    if (availabilityInfo) {
+        availabilityInfo.textContent = '';
+    }
+    document.getElementById('quantity').removeAttribute('max');
+    
     // Clear image previews
     document.getElementById('preview-front').innerHTML = '';
     document.getElementById('preview-front').classList.remove('has-image');
@@ -87,6 +93,7 @@ function updateDays() {
             const diffDays = Math.ceil(diffTime / (1000 * 60 * 60 * 24)) + 1; // +1 để bao gồm cả ngày cuối
             daysInput.value = diffDays;
             calculateDeposit();
+            checkAvailability();
         } else {
             daysInput.value = 1;
             alert('Ngày kết thúc phải sau ngày bắt đầu!');
@@ -95,21 +102,152 @@ function updateDays() {
 }
 
 /**
- * Tính toán và hiển thị tổng giá thuê và tiền đặt cọc
+ * Lấy số xe còn trống của loại xe đang chọn trong khoảng ngày đã chọn
+ */
+function checkAvailability() {
+    const motorcycleId = document.getElementById('motorcycleId').value;
+    const startDate = document.getElementById('start_date').value;
+    const endDate = document.getElementById('end_date').value;
+    const info = document.getElementById('availabilityInfo');
+    const quantityInput = document.getElementById('quantity');
+    
+    if (!info || !motorcycleId || !startDate || !endDate) {
+        return;
+    }
+    
+    const params = new URLSearchParams({motorcycle_id: motorcycleId, start_date: startDate, end_date: endDate});
+    fetch('/api/rental/availability?' + params.toString())
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                info.textContent = '';
+                return;
+            }
+            quantityInput.max = Math.max(data.available, 1);
+            info.textContent = data.available > 0
+                ? 'Còn ' + data.available + ' xe trống trong khoảng thời gian này'
+                : 'Đã hết xe trong khoảng thời gian này, vui lòng chọn ngày khác';
+        })
+        .catch(() => {
+            info.textContent = '';
+        });
+}
+
+/**
+ * Tính toán và hiển thị tổng giá thuê và tiền đặt cọc.
+ * Hiển thị ngay giá theo ngày, sau đó lấy giá đúng (bậc tuần/tháng) từ /api/quote.
+ * Mỗi lần đổi ngày/số lượng, mọi loại xe trên trang được báo giá trong một
+ * request và lưu cache theo (ngày bắt đầu, ngày kết thúc, số lượng): mở xe
+ * khác với cùng lựa chọn không gọi lại API.
+ */
+let quoteRequestSeq = 0;
+const MAX_QUOTE_ITEMS = 200;    // = pricing.MAX_QUOTE_ITEMS
+const quoteCache = new Map();   // "start|end|quantity" -> Promise<{category_id: quote}>
+
+/**
+ * Id các loại xe đang hiển thị trên trang (luôn gồm loại xe của modal)
+ * @param {string} currentId - Loại xe đang mở trong modal
+ * @returns {Array<string>}
+ */
+function pageCategoryIds(currentId) {
+    const ids = new Set([String(currentId)]);
+    document.querySelectorAll('[data-category-id]').forEach(item => {
+        ids.add(String(item.dataset.categoryId));
+    });
+    return Array.from(ids);
+}
+
+/**
+ * Báo giá của mọi loại xe trên trang cho một lựa chọn ngày/số lượng (có cache)
+ * @returns {Promise<Object>} category_id -> quote
  */
+function quotesForPage(currentId, startDate, endDate, quantity) {
+    const key = [startDate, endDate, quantity].join('|');
+    let cached = quoteCache.get(key);
+    if (cached) {
+        return cached.then(quotes => {
+            if (String(currentId) in quotes) {
+                return quotes;
+            }
+            // Loại xe mới xuất hiện trên trang sau lần báo giá trước
+            quoteCache.delete(key);
+            return quotesForPage(currentId, startDate, endDate, quantity);
+        });
+    }
+    const items = pageCategoryIds(currentId).map(id => (
+        {category_id: id, start_date: startDate, end_date: endDate, quantity: quantity}
+    ));
+    const batches = [];
+    for (let i = 0; i < items.length; i += MAX_QUOTE_ITEMS) {
+        batches.push(fetchQuotes(items.slice(i, i + MAX_QUOTE_ITEMS)));
+    }
+    cached = Promise.all(batches).then(results => {
+        const quotes = {};
+        results.flat().forEach(quote => {
+            if (quote && !quote.error) {
+                quotes[String(quote.category_id)] = quote;
+            }
+        });
+        return quotes;
+    });
+    // Lỗi mạng thì lần sau thử lại
+    cached.catch(() => quoteCache.delete(key));
+    quoteCache.set(key, cached);
+    return cached;
+}
+
+function showPrice(totalPrice, depositAmount) {
+    document.getElementById('totalPrice').textContent = formatCurrency(totalPrice) + ' VND';
+    document.getElementById('depositAmount').textContent = formatCurrency(depositAmount) + ' VND';
+}
+
 function calculateDeposit() {
     const quantity = parseInt(document.getElementById('quantity').value) || 0;
     const days = parseInt(document.getElementById('days').value) || 0;
     
-    // Tính tổng giá thuê
+    // Tính tổng giá thuê theo ngày (tạm thời, khi chưa có báo giá)
     const totalPrice = currentMotorcyclePrice * quantity * days;
     
     // Tính tiền đặt cọc (50% tổng giá)
-    const depositAmount = totalPrice * 0.5;
+    showPrice(totalPrice, totalPrice * 0.5);
     
-    // Cập nhật UI
-    document.getElementById('totalPrice').textContent = formatCurrency(totalPrice) + ' VND';
-    document.getElementById('depositAmount').textContent = formatCurrency(depositAmount) + ' VND';
+    const motorcycleId = document.getElementById('motorcycleId').value;
+    const startDate = document.getElementById('start_date').value;
+    const endDate = document.getElementById('end_date').value;
+    if (!motorcycleId || !startDate || !endDate || quantity < 1) {
+        return;
+    }
+    
+    // Bỏ qua kết quả của các request cũ nếu người dùng đã đổi ngày/số lượng
+    const seq = ++quoteRequestSeq;
+    quotesForPage(motorcycleId, startDate, endDate, quantity)
+        .then(quotes => {
+            const quote = quotes[String(motorcycleId)];
+            if (seq === quoteRequestSeq && quote) {
+                showPrice(quote.total, quote.deposit);
+            }
+        })
+        .catch(() => {});
+}
+
+/**
+ * Báo giá nhiều lựa chọn trong một request
+ * @param {Array<{category_id, start_date, end_date, quantity}>} items
+ * @returns {Promise<Array>} Báo giá theo đúng thứ tự items
+ */
+function fetchQuotes(items) {
+    return fetch('/api/quote', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({items: items})
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.message);
+            }
+            return data.quotes;
+        });
 }
 
 /**
@@ -282,6 +420,8 @@ if (typeof module !== 'undefined' && module.exports) {
         openRentalModal,
         closeRentalModal,
         formatCurrency,
-        calculateDeposit
+        calculateDeposit,
+        fetchQuotes,
+        quotesForPage
     };
 }
@@ -0,0 +1,340 @@
+"""
+Hàng đợi tác vụ nền lưu trong database (bảng task_queue).
+
+ - Handler đăng ký bằng `@task('images.citizen_id')`, nhận (session,
+   **payload). Request gọi `enqueue(session, name, **payload)` trong cùng
+   transaction với thay đổi của nó (task chỉ tồn tại nếu commit thành công)
+   rồi trả về ngay; worker được đánh thức sau commit.
+ - Worker: `flask worker` (process riêng) và/hoặc TASK_INPROCESS_WORKERS
+   thread trong mỗi process web (mặc định 1; đặt 0 khi đã chạy flask
+   worker; chỉ process web mới start, xem app.start_background). Task
+   được nhận bằng SELECT ... FOR UPDATE SKIP LOCKED trên PostgreSQL;
+   SQLite bỏ qua mệnh đề đó nên việc nhận dựa vào UPDATE ... WHERE
+   status = 'queued' (kiểm tra rowcount) - hai worker không bao giờ chạy
+   cùng một task.
+ - Task đang chạy bị khóa tới locked_until (VISIBILITY_SECONDS); worker chết
+   giữa chừng thì task về lại hàng đợi khi hết hạn. Vì vậy handler phải
+   idempotent.
+ - Lỗi: thử lại sau BACKOFF_SECONDS * 2^(lần - 1) (tối đa BACKOFF_MAX_SECONDS,
+   có jitter); hết max_attempts thì chuyển sang task_dead_letter
+   (`flask tasks-retry-dead` để đưa lại vào hàng đợi).
+ - task_stat cộng dồn theo tên task: thành công / thử lại / chết, độ trễ
+   hàng đợi (tạo -> bắt đầu chạy) và thời gian chạy; `flask tasks-status`.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+from sqlalchemy import case, event, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as OrmSession
+
+from app.models import DeadTask, Task, TaskStat
+
+
+MAX_ATTEMPTS = 5
+VISIBILITY_SECONDS = int(os.getenv('TASK_VISIBILITY_SECONDS', '600'))
+BACKOFF_SECONDS = float(os.getenv('TASK_BACKOFF_SECONDS', '5'))
+BACKOFF_MAX_SECONDS = float(os.getenv('TASK_BACKOFF_MAX_SECONDS', '3600'))
+POLL_SECONDS = float(os.getenv('TASK_POLL_SECONDS', '5'))
+INPROCESS_WORKERS = int(os.getenv('TASK_INPROCESS_WORKERS', '1'))
+
+_tasks_table = Task.__table__
+_stats_table = TaskStat.__table__
+_listeners_registered = False
+_known_stats = set()
+
+
+# ---------- registry / enqueue ----------
+
+TaskSpec = namedtuple('TaskSpec', 'name func max_attempts')
+
+TASKS = {}
+
+
+def task(name, max_attempts=MAX_ATTEMPTS):
+    """Register `func(session, **payload)` as the handler of task `name`."""
+    def decorator(func):
+        TASKS[name] = TaskSpec(name, func, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(session, name, delay=None, **payload):
+    """Add a task to the caller's transaction; it becomes visible to workers on commit."""
+    spec = TASKS.get(name)
+    if spec is None:
+        raise ValueError(f'Chưa đăng ký task {name!r}')
+    now = datetime.utcnow()
+    row = Task(
+        name=name,
+        payload=json.dumps(payload, default=str),
+        max_attempts=spec.max_attempts,
+        run_at=now + delay if delay else now,
+        created_at=now,
+    )
+    session.add(row)
+    session.info['tasks_enqueued'] = True
+    return row
+
+
+def _after_commit(session):
+    if session.info.pop('tasks_enqueued', False):
+        worker.notify()
+
+
+def _after_rollback(session):
+    session.info.pop('tasks_enqueued', None)
+
+
+def register_listeners():
+    """Wake the local workers after a commit that enqueued tasks (call once per process)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(OrmSession, 'after_commit', _after_commit)
+    event.listen(OrmSession, 'after_rollback', _after_rollback)
+    _listeners_registered = True
+
+
+# ---------- claiming ----------
+
+def backoff_delay(attempts):
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim(session, worker_id, limit=1):
+    """Lock up to `limit` due tasks for this worker; return their ids."""
+    now = datetime.utcnow()
+    candidates = [row[0] for row in session.query(Task.id).filter(
+        Task.status == 'queued', Task.run_at <= now
+    ).order_by(Task.run_at, Task.id).limit(limit).with_for_update(skip_locked=True).all()]
+    claimed = []
+    for task_id in candidates:
+        result = session.execute(
+            update(_tasks_table)
+            .where(_tasks_table.c.id == task_id, _tasks_table.c.status == 'queued')
+            .values(status='running', locked_by=worker_id, started_at=now,
+                    locked_until=now + timedelta(seconds=VISIBILITY_SECONDS),
+                    attempts=_tasks_table.c.attempts + 1)
+        )
+        if result.rowcount:
+            claimed.append(task_id)
+    session.commit()
+    return claimed
+
+
+def requeue_expired(session):
+    """Return tasks of dead workers (lock expired) to the queue; return how many."""
+    now = datetime.utcnow()
+    expired = session.query(Task).filter(
+        Task.status == 'running', Task.locked_until < now
+    ).with_for_update(skip_locked=True).all()
+    for row in expired:
+        error = f'Worker {row.locked_by} không hoàn thành trước {row.locked_until:%Y-%m-%d %H:%M:%S}'
+        if row.attempts >= row.max_attempts:
+            _ensure_stat(session.get_bind(), row.name)
+            _bury(session, row, error)
+        else:
+            row.status, row.locked_by, row.locked_until, row.last_error = 'queued', None, None, error
+    session.commit()
+    return len(expired)
+
+
+# ---------- metrics ----------
+
+def _greatest(column, value):
+    return case((column < value, value), else_=column)
+
+
+def _ensure_stat(engine, name):
+    """Create the task_stat row outside the task's transaction (once per name and process)."""
+    if name in _known_stats:
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(_stats_table).values(
+                name=name, succeeded=0, retried=0, dead=0, total_latency_ms=0, max_latency_ms=0,
+                total_run_ms=0, max_run_ms=0,
+            ))
+    except IntegrityError:
+        pass    # đã có (hoặc worker khác vừa tạo)
+    _known_stats.add(name)
+
+
+def _record_stat(session, name, outcome, latency_ms=0, run_ms=0):
+    table = _stats_table
+    values = {outcome: getattr(table.c, outcome) + 1, 'updated_at': datetime.utcnow()}
+    if outcome == 'succeeded':
+        values.update(
+            total_latency_ms=table.c.total_latency_ms + latency_ms,
+            max_latency_ms=_greatest(table.c.max_latency_ms, latency_ms),
+            total_run_ms=table.c.total_run_ms + run_ms,
+            max_run_ms=_greatest(table.c.max_run_ms, run_ms),
+        )
+    session.execute(update(table).where(table.c.name == name).values(**values))
+
+
+def _bury(session, row, error):
+    session.add(DeadTask(task_id=row.id, name=row.name, payload=row.payload, attempts=row.attempts,
+                         error=error, created_at=row.created_at, failed_at=datetime.utcnow()))
+    session.delete(row)
+    _record_stat(session, row.name, 'dead')
+
+
+# ---------- running ----------
+
+def run_task(session, task_id, worker_id):
+    """Run one claimed task and record its outcome; return 'succeeded' | 'retried' | 'dead' | None."""
+    row = session.get(Task, task_id)
+    if row is None or row.locked_by != worker_id:
+        session.rollback()
+        return None
+    name, attempts, max_attempts = row.name, row.attempts, row.max_attempts
+    latency_ms = int((row.started_at - row.created_at).total_seconds() * 1000)
+    payload = json.loads(row.payload or '{}')
+    session.rollback()
+
+    spec = TASKS.get(name)
+    started = time.perf_counter()
+    error = None
+    try:
+        if spec is None:
+            raise LookupError(f'Chưa đăng ký task {name!r}')
+        on_commit = spec.func(session, **payload)
+        session.commit()
+        if callable(on_commit):
+            on_commit()
+    except Exception as e:
+        session.rollback()
+        error = f'{type(e).__name__}: {e}'[:2000]
+    run_ms = int((time.perf_counter() - started) * 1000)
+
+    _ensure_stat(session.get_bind(), name)
+    # Chỉ ghi kết quả nếu task vẫn do worker này giữ (chưa bị trả lại hàng đợi vì quá hạn)
+    row = session.query(Task).filter(Task.id == task_id, Task.locked_by == worker_id).with_for_update().first()
+    if row is None:
+        session.rollback()
+        return None
+    if error is None:
+        session.delete(row)
+        _record_stat(session, name, 'succeeded', latency_ms, run_ms)
+        outcome = 'succeeded'
+    elif attempts < max_attempts:
+        row.status, row.locked_by, row.locked_until = 'queued', None, None
+        row.run_at = datetime.utcnow() + backoff_delay(attempts)
+        row.last_error = error
+        _record_stat(session, name, 'retried')
+        outcome = 'retried'
+    else:
+        _bury(session, row, error)
+        outcome = 'dead'
+    session.commit()
+    if error is not None:
+        print(f"Lỗi task {name} #{task_id} (lần {attempts}/{max_attempts}): {error}")
+    return outcome
+
+
+def retry_dead(session, name=None):
+    """Move dead letters back into the queue with a fresh attempt budget; return how many."""
+    query = session.query(DeadTask)
+    if name:
+        query = query.filter(DeadTask.name == name)
+    count = 0
+    now = datetime.utcnow()
+    for dead in query.order_by(DeadTask.id).all():
+        spec = TASKS.get(dead.name)
+        session.add(Task(name=dead.name, payload=dead.payload, run_at=now, created_at=now,
+                         max_attempts=spec.max_attempts if spec else MAX_ATTEMPTS))
+        session.delete(dead)
+        count += 1
+    session.commit()
+    return count
+
+
+def queue_depth(session):
+    """{(name, status): (count, oldest created_at)} for tasks still in the queue."""
+    rows = session.query(Task.name, Task.status, func.count(Task.id), func.min(Task.created_at))\
+        .group_by(Task.name, Task.status).all()
+    return {(name, status): (count, oldest) for name, status, count, oldest in rows}
+
+
+class Worker:
+    """Threads that claim and run tasks; woken by notify(), else every POLL_SECONDS."""
+
+    def __init__(self, poll_seconds=POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.processed = 0
+
+    def start(self, threads=1, burst=False):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < threads:
+                thread = threading.Thread(target=self.loop, args=(burst,),
+                                          name=f'task-worker-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def join(self):
+        for thread in list(self._threads):
+            thread.join()
+
+    def loop(self, burst=False):
+        """Claim and run tasks until stop() (or, with burst, until the queue is empty)."""
+        from app.extensions import get_engine, Session
+        get_engine()
+        worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+        while not self._stop.is_set():
+            session = Session.session_factory()
+            try:
+                task_ids = claim(session, worker_id)
+                if not task_ids:
+                    requeue_expired(session)
+                    task_ids = claim(session, worker_id)
+                for task_id in task_ids:
+                    if run_task(session, task_id, worker_id):
+                        self.processed += 1
+            except Exception as e:
+                session.rollback()
+                task_ids = []
+                print(f"Lỗi worker task: {e}")
+            finally:
+                session.close()
+            if task_ids:
+                continue
+            if burst:
+                break
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+
+worker = Worker()
+
+
+def init_app(app):
+    # Các module khai báo handler phải được import để worker biết tên task
+    from app import images  # noqa: F401
+    register_listeners()
+
+
+def start_workers():
+    """Start the TASK_INPROCESS_WORKERS task threads of a web process."""
+    if INPROCESS_WORKERS > 0:
+        worker.start(INPROCESS_WORKERS)
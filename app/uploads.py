@@ -0,0 +1,170 @@
+"""
+Đọc multipart/form-data theo luồng cho form đặt xe (thay cho request.form/request.files).
+
+request.form đọc toàn bộ body trước khi handler được chạy, nên một request
+giả mạo hoặc ảnh quá lớn vẫn chiếm worker cho tới khi upload xong. Ở đây:
+ - các field text (đứng trước file trong form) được kiểm tra ngay khi gặp
+   part file đầu tiên, request sai bị từ chối mà không đọc phần ảnh;
+ - mỗi file được ghi dần vào SpooledTemporaryFile (chỉ SPOOL_SIZE nằm trong
+   RAM), có giới hạn kích thước riêng từng file và toàn request;
+ - loại ảnh được xác định bằng magic bytes chứ không tin phần mở rộng.
+"""
+import os
+import tempfile
+
+from flask import jsonify
+from werkzeug.datastructures import MultiDict
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+
+MAX_FILE_SIZE = int(os.getenv('UPLOAD_MAX_FILE_SIZE', str(15 * 1024 * 1024)))
+MAX_REQUEST_SIZE = int(os.getenv('UPLOAD_MAX_REQUEST_SIZE', str(32 * 1024 * 1024)))
+MAX_FIELD_SIZE = 64 * 1024
+SPOOL_SIZE = 512 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def sniff_image_type(head):
+    """Return the file extension matching the image signature, or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class UploadError(Exception):
+    """Request rejected while streaming; carries the JSON error response."""
+
+    def __init__(self, message, status_code=400, **payload):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.payload = payload
+
+
+def upload_error_response(error):
+    resp = jsonify(dict(error.payload, success=False, message=error.message))
+    resp.status_code = error.status_code
+    # Phần body chưa đọc bị bỏ lại: đóng kết nối thay vì để worker đọc nốt
+    resp.headers['Connection'] = 'close'
+    return resp
+
+
+class UploadedImage:
+    """One file part spooled to a temporary file."""
+
+    def __init__(self, field_name, filename):
+        self.field_name = field_name
+        self.filename = filename
+        self.stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.size = 0
+        self.extension = None
+        self._head = b''
+
+    def write(self, data, max_size):
+        self.size += len(data)
+        if self.size > max_size:
+            raise UploadError(f'Ảnh {self.filename} vượt quá {max_size // (1024 * 1024)} MB!', 413)
+        if self.extension is None and len(self._head) < 12:
+            self._head += data[:12 - len(self._head)]
+            if len(self._head) >= 12:
+                self._check_type()
+        self.stream.write(data)
+
+    def finish(self):
+        if self.extension is None:
+            self._check_type()
+        self.stream.seek(0)
+
+    def _check_type(self):
+        self.extension = sniff_image_type(self._head)
+        if self.extension is None:
+            raise UploadError(f'File {self.filename} không phải ảnh JPG, PNG, GIF hoặc WEBP!', 415)
+
+    def close(self):
+        self.stream.close()
+
+
+class StreamedForm:
+    def __init__(self):
+        self.fields = MultiDict()
+        self.files = {}
+
+    def close(self):
+        for upload in self.files.values():
+            upload.close()
+
+
+def parse_streaming_form(req, on_fields=None, file_fields=None,
+                         max_file_size=MAX_FILE_SIZE, max_request_size=MAX_REQUEST_SIZE):
+    """Parse `req`'s multipart body chunk by chunk.
+
+    `on_fields(fields)` is called with the text fields before the first file
+    byte is read (or at the end if there are no files) and may raise
+    UploadError to stop reading. Only parts named in `file_fields` are kept.
+    """
+    if req.mimetype != 'multipart/form-data' or not req.mimetype_params.get('boundary'):
+        raise UploadError('Dữ liệu gửi lên không đúng định dạng multipart/form-data!')
+    if req.content_length and req.content_length > max_request_size:
+        raise UploadError(f'Dữ liệu gửi lên vượt quá {max_request_size // (1024 * 1024)} MB!', 413)
+
+    decoder = MultipartDecoder(req.mimetype_params['boundary'].encode('latin-1'), MAX_FIELD_SIZE)
+    form = StreamedForm()
+    stream = req.stream
+    received = 0
+    eof = False
+    fields_checked = False
+    field_name, field_value, upload = None, None, None
+    try:
+        while True:
+            try:
+                event = decoder.next_event()
+            except ValueError:
+                raise UploadError('Dữ liệu form không hợp lệ!')
+
+            if isinstance(event, NeedData):
+                if eof:
+                    raise UploadError('Dữ liệu form bị cắt ngang!')
+                chunk = stream.read(CHUNK_SIZE)
+                received += len(chunk)
+                if received > max_request_size:
+                    raise UploadError(f'Dữ liệu gửi lên vượt quá {max_request_size // (1024 * 1024)} MB!', 413)
+                eof = not chunk
+                decoder.receive_data(chunk or None)
+            elif isinstance(event, File):
+                if not fields_checked and on_fields:
+                    on_fields(form.fields)
+                fields_checked = True
+                field_name = None
+                upload = None
+                if event.filename and (file_fields is None or event.name in file_fields):
+                    upload = UploadedImage(event.name, event.filename)
+                    form.files[event.name] = upload
+            elif isinstance(event, Field):
+                field_name, field_value, upload = event.name, bytearray(), None
+            elif isinstance(event, Data):
+                if upload is not None:
+                    upload.write(event.data, max_file_size)
+                    if not event.more_data:
+                        upload.finish()
+                elif field_name is not None:
+                    field_value += event.data
+                    if len(field_value) > MAX_FIELD_SIZE:
+                        raise UploadError(f'Trường {field_name} quá dài!', 413)
+                    if not event.more_data:
+                        form.fields.add(field_name, field_value.decode('utf-8', 'replace'))
+                        field_name = None
+            elif isinstance(event, Epilogue):
+                break
+
+        if not fields_checked and on_fields:
+            on_fields(form.fields)
+        return form
+    except Exception:
+        form.close()
+        raise
@@ -1,118 +1,159 @@
 """
 VNPay helper - Chuyển đổi từ Django vnpay_python
+
+`VNPaySigner` không giữ trạng thái theo request nên một instance được dùng
+chung cho mọi thread: HMAC-SHA512 đã nạp khóa được tạo một lần và mỗi lần
+ký chỉ `copy()` nó. Query string chuẩn (sắp xếp theo key, quote_plus) được
+ghép trong một lần join. `VNPay` giữ nguyên giao diện cũ cho các route.
+
+Mọi mốc thời gian gửi VNPay (vnp_CreateDate, vnp_ExpireDate) là giờ Việt Nam
+(GMT+7) theo quy định của VNPay, bất kể múi giờ của server: `vnpay_timestamp`
+đổi thời điểm UTC naive (cách app lưu `hold_expires_at`) sang giờ VN.
+
+So sánh tốc độ với cách cũ: `python bench_vnpay.py`.
 """
 import hashlib
 import hmac
+import re
+import threading
 import urllib.parse
-from datetime import datetime
+from datetime import datetime, timezone
 import os
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+VNPAY_TZ = ZoneInfo('Asia/Ho_Chi_Minh')
+_HASH_PARAMS = ('vnp_SecureHash', 'vnp_SecureHashType')
+# Ký tự quote_plus giữ nguyên: phần lớn giá trị (số tiền, mã, ngày) không cần quote
+_is_safe = re.compile(r'[A-Za-z0-9_.~-]*').fullmatch
+
+
+def vnpay_timestamp(moment=None):
+    """`yyyyMMddHHmmss` in Vietnam time; naive datetimes are taken as UTC."""
+    if moment is None:
+        moment = datetime.now(timezone.utc)
+    elif moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(VNPAY_TZ).strftime('%Y%m%d%H%M%S')
+
+
+def vnpay_now():
+    """Current Vietnam time as a naive datetime (the clock of VNPay timestamps)."""
+    return datetime.now(VNPAY_TZ).replace(tzinfo=None)
+
+
+def _quote(value):
+    value = str(value)
+    return value if _is_safe(value) else urllib.parse.quote_plus(value)
+
+
+def canonical_query(params):
+    """`k1=v1&k2=v2...` sorted by key with quote_plus values, as VNPay signs it."""
+    return '&'.join([f'{key}={_quote(value)}' for key, value in sorted(params.items())])
+
+
+class VNPaySigner:
+    """Stateless HMAC-SHA512 signer/verifier for one secret (thread-safe)."""
+
+    def __init__(self, hash_secret):
+        self._keyed = hmac.new(hash_secret.encode('utf-8'), digestmod=hashlib.sha512)
+
+    def sign(self, query):
+        mac = self._keyed.copy()
+        mac.update(query.encode('utf-8'))
+        return mac.hexdigest()
+
+    def payment_url(self, base_url, params):
+        query = canonical_query(params)
+        return f'{base_url}?{query}&vnp_SecureHash={self.sign(query)}'
+
+    def verify(self, params):
+        """True if params['vnp_SecureHash'] matches the other vnp_* params."""
+        secure_hash = params.get('vnp_SecureHash') or ''
+        if not secure_hash:
+            return False
+        query = '&'.join([
+            f'{key}={_quote(value)}' for key, value in sorted(params.items())
+            if key.startswith('vnp_') and key not in _HASH_PARAMS
+        ])
+        return hmac.compare_digest(self.sign(query), secure_hash.lower())
+
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+
+def get_signer(hash_secret):
+    """Shared signer per secret (the HMAC key schedule is computed once)."""
+    signer = _signers.get(hash_secret)
+    if signer is None:
+        with _signers_lock:
+            signer = _signers.get(hash_secret)
+            if signer is None:
+                signer = _signers[hash_secret] = VNPaySigner(hash_secret)
+    return signer
+
+
 class VNPay:
     """VNPay payment integration helper - Ported from Django"""
-    requestData = {}
-    responseData = {}
-    
+
     def __init__(self):
+        # Dữ liệu theo từng instance (trước đây là dict dùng chung ở mức class)
+        self.requestData = {}
+        self.responseData = {}
         # Load config from environment variables
         self.tmn_code = os.getenv('VNPAY_TMN_CODE', '08XB68MP')
         self.hash_secret = os.getenv('VNPAY_HASH_SECRET') or os.getenv('VNPAY_HASH_SECRET_KEY', 'J387G5VO8FUMTRBMPSANSJXOSMCNLKBK')
         self.payment_url = os.getenv('VNPAY_PAYMENT_URL', 'https://sandbox.vnpayment.vn/paymentv2/vpcpay.html')
         self.api_url = os.getenv('VNPAY_API_URL', 'https://sandbox.vnpayment.vn/merchant_webapi/api/transaction')
         self.return_url = os.getenv('VNPAY_RETURN_URL', 'http://localhost:5000/payment/return')
-    
+
     def get_payment_url(self, vnpay_payment_url=None, secret_key=None):
         """Generate VNPay payment URL"""
-        if vnpay_payment_url is None:
-            vnpay_payment_url = self.payment_url
-        if secret_key is None:
-            secret_key = self.hash_secret
-            
-        inputData = sorted(self.requestData.items())
-        queryString = ''
-        hasData = ''
-        seq = 0
-        for key, val in inputData:
-            if seq == 1:
-                queryString = queryString + "&" + key + '=' + urllib.parse.quote_plus(str(val))
-            else:
-                seq = 1
-                queryString = key + '=' + urllib.parse.quote_plus(str(val))
-
-        hashValue = self._hmacsha512(secret_key, queryString)
-        return vnpay_payment_url + "?" + queryString + '&vnp_SecureHash=' + hashValue
-
-    def validate_response(self, secret_key=None):
-        """Validate VNPay response signature"""
-        if secret_key is None:
-            secret_key = self.hash_secret
-            
-        vnp_SecureHash = self.responseData.get('vnp_SecureHash', '')
-        if not vnp_SecureHash:
-            return False
-            
-        # Remove hash params
-        response_data_copy = dict(self.responseData)
-        if 'vnp_SecureHash' in response_data_copy:
-            response_data_copy.pop('vnp_SecureHash')
-
-        if 'vnp_SecureHashType' in response_data_copy:
-            response_data_copy.pop('vnp_SecureHashType')
-
-        inputData = sorted(response_data_copy.items())
-        hasData = ''
-        seq = 0
-        for key, val in inputData:
-            if str(key).startswith('vnp_'):
-                if seq == 1:
-                    hasData = hasData + "&" + str(key) + '=' + urllib.parse.quote_plus(str(val))
-                else:
-                    seq = 1
-                    hasData = str(key) + '=' + urllib.parse.quote_plus(str(val))
-        hashValue = self._hmacsha512(secret_key, hasData)
-
-        print('Validate debug, HashData:' + hasData + "\n HashValue:" + hashValue + "\nInputHash:" + vnp_SecureHash)
-
-        return vnp_SecureHash == hashValue
+        return get_signer(secret_key or self.hash_secret).payment_url(
+            vnpay_payment_url or self.payment_url, self.requestData
+        )
+
+    def validate_response(self, response_data=None, secret_key=None):
+        """Validate VNPay response signature (constant-time comparison)"""
+        if response_data is None:
+            response_data = self.responseData
+        return get_signer(secret_key or self.hash_secret).verify(response_data)
 
     @staticmethod
     def _hmacsha512(key, data):
         """Generate HMAC SHA512 hash"""
-        byteKey = key.encode('utf-8')
-        byteData = data.encode('utf-8')
-        return hmac.new(byteKey, byteData, hashlib.sha512).hexdigest()
-    
-    def create_payment_request(self, order_id, amount, order_desc, ip_addr, 
-                              order_type='other', bank_code='', locale='vn', return_url=None):
-        """Create payment request data"""
+        return get_signer(key).sign(data)
+
+    def create_payment_request(self, order_id, amount, order_desc, ip_addr,
+                              order_type='other', bank_code='', locale='vn', return_url=None, expire_date=None,
+                              create_date=None):
+        """Create payment request data (create_date: `yyyyMMddHHmmss` GMT+7, default now)"""
         if return_url is None:
             return_url = self.return_url
-            
-        self.requestData = {}
-        self.requestData['vnp_Version'] = '2.1.0'
-        self.requestData['vnp_Command'] = 'pay'
-        self.requestData['vnp_TmnCode'] = self.tmn_code
-        self.requestData['vnp_Amount'] = int(amount * 100)  # Convert to cents
-        self.requestData['vnp_CurrCode'] = 'VND'
-        self.requestData['vnp_TxnRef'] = str(order_id)
-        self.requestData['vnp_OrderInfo'] = order_desc
-        self.requestData['vnp_OrderType'] = order_type
-        
-        if locale and locale != '':
-            self.requestData['vnp_Locale'] = locale
-        else:
-            self.requestData['vnp_Locale'] = 'vn'
-        
-        if bank_code and bank_code != "":
+
+        self.requestData = {
+            'vnp_Version': '2.1.0',
+            'vnp_Command': 'pay',
+            'vnp_TmnCode': self.tmn_code,
+            'vnp_Amount': int(amount * 100),  # Convert to cents
+            'vnp_CurrCode': 'VND',
+            'vnp_TxnRef': str(order_id),
+            'vnp_OrderInfo': order_desc,
+            'vnp_OrderType': order_type,
+            'vnp_Locale': locale or 'vn',
+            'vnp_CreateDate': create_date or vnpay_timestamp(),
+            'vnp_IpAddr': ip_addr,
+            'vnp_ReturnUrl': return_url,
+        }
+        if bank_code:
             self.requestData['vnp_BankCode'] = bank_code
-        
-        self.requestData['vnp_CreateDate'] = datetime.now().strftime('%Y%m%d%H%M%S')
-        self.requestData['vnp_IpAddr'] = ip_addr
-        self.requestData['vnp_ReturnUrl'] = return_url
-        
+        if expire_date:
+            self.requestData['vnp_ExpireDate'] = vnpay_timestamp(expire_date)
+
         return self.get_payment_url()
 
 
@@ -123,4 +164,3 @@ def get_client_ip(request):
     else:
         ip = request.remote_addr
     return ip
-
@@ -0,0 +1,304 @@
+"""
+Xử lý kết quả thanh toán VNPay đúng một lần (IPN server-to-server + trang return).
+
+ - Mỗi callback đã kiểm tra chữ ký được ghi vào bảng `vnpay_inbox`, khóa
+   duy nhất (vnp_TxnRef, vnp_TransactionNo). VNPay gửi lại IPN hoặc khách
+   bấm F5 ở trang return chỉ tốn một lần insert bị trùng.
+ - IPN trả lời VNPay ngay sau khi ghi inbox; thread worker trong mỗi process
+   web áp dụng chuyển trạng thái Payment/Rental. Dòng inbox được "nhận" bằng
+   UPDATE ... WHERE processed_at IS NULL trong cùng transaction với thay đổi
+   đơn hàng, nên dù nhiều worker/process cùng chạy mỗi dòng chỉ được áp
+   dụng một lần.
+ - Trang return ghi vào cùng inbox và xử lý ngay dòng của mình để hiển thị
+   kết quả; nếu IPN đã xử lý trước thì chỉ đọc lại kết quả.
+ - Tiền về sau khi giữ chỗ đã hết hạn (đơn đã 'cancelled', xe có thể đã cho
+   người khác thuê): payment vẫn được ghi 'paid' nhưng đơn KHÔNG được xác
+   nhận lại; đơn giữ 'cancelled' với payment_status 'refund_pending' và ghi
+   chú để admin hoàn tiền hoặc xử lý tay.
+"""
+from datetime import datetime
+from decimal import Decimal
+import json
+import os
+import threading
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import pricing
+from app.models import Motorcycles, Payment, Rental, RentalItem, VnpayInbox
+
+
+MAX_ATTEMPTS = 5
+STALE_RETRIES = 3
+POLL_SECONDS = float(os.getenv('VNPAY_IPN_POLL_SECONDS', '30'))
+BATCH_SIZE = 50
+
+
+def is_success(params):
+    response_code = params.get('vnp_ResponseCode', '')
+    transaction_status = params.get('vnp_TransactionStatus', '')
+    transaction_no = params.get('vnp_TransactionNo', '')
+    if response_code:
+        return response_code == '00'
+    if transaction_status:
+        return transaction_status == '00'
+    return bool(transaction_no and transaction_no != '0')
+
+
+def find_payment(session, order_id, for_update=False):
+    """Payment for a vnp_TxnRef (payment_code, or the rental's last payment for old orders)."""
+    query = session.query(Payment).filter(Payment.payment_code == order_id)
+    if for_update:
+        query = query.with_for_update()
+    payment = query.first()
+    if not payment:
+        # Try to find by rental's vnpay_transaction_id (for backward compatibility)
+        rental = session.query(Rental).filter(Rental.vnpay_transaction_id == order_id).first()
+        if rental:
+            query = session.query(Payment).filter(Payment.rental_id == rental.id).order_by(Payment.id.desc())
+            if for_update:
+                query = query.with_for_update()
+            payment = query.first()
+    return payment
+
+
+def apply_result(session, params):
+    """Apply one verified VNPay result; return (outcome, rental_id). Caller commits.
+
+    outcome: paid | paid_after_cancel | pending | failed | already_confirmed
+             | invalid_amount | not_found
+    """
+    order_id = params.get('vnp_TxnRef', '')
+    transaction_status = params.get('vnp_TransactionStatus', '')
+    transaction_no = params.get('vnp_TransactionNo', '')
+    bank_code = params.get('vnp_BankCode', '')
+    pay_date = params.get('vnp_PayDate', '')
+    amount = Decimal(params.get('vnp_Amount') or 0) / 100  # Convert from cents
+
+    payment = find_payment(session, order_id, for_update=True)
+    if not payment:
+        return 'not_found', None
+    rental = session.query(Rental).filter(Rental.id == payment.rental_id).with_for_update().first()
+    if not rental:
+        return 'not_found', None
+    if payment.payment_status == 'paid':
+        return 'already_confirmed', rental.id
+    if abs(amount - Decimal(str(payment.amount or 0))) >= 1:
+        return 'invalid_amount', rental.id
+
+    if not is_success(params):
+        # TransactionStatus '02' might mean pending, so we keep it as pending
+        if transaction_status == '02':
+            rental.status = 'pending'
+            rental.payment_status = 'pending'
+            return 'pending', rental.id
+        rental.status = 'cancelled'
+        rental.payment_status = 'failed'
+        rental.hold_expires_at = None
+        return 'failed', rental.id
+
+    # Update payment record
+    payment.payment_status = 'paid'
+    payment.vnpay_transaction_id = transaction_no
+    payment.vnpay_bank_code = bank_code
+    if pay_date:
+        try:
+            payment.vnpay_pay_date = datetime.strptime(pay_date, '%Y%m%d%H%M%S')
+        except ValueError:
+            pass
+    payment.payment_date = datetime.now()
+
+    # Update rental - add to paid amount (cộng trong SQL; giá trị mới được đọc lại sau flush)
+    rental.paid_amount = func.coalesce(Rental.paid_amount, 0) + amount
+    rental.vnpay_bank_code = bank_code
+    rental.payment_method = 'vnpay'
+    session.flush()
+
+    if rental.status == 'cancelled':
+        # Giữ chỗ đã hết hạn trước khi tiền về: không xác nhận lại đơn, chờ admin hoàn tiền
+        rental.payment_status = 'refund_pending'
+        note = (f"[{datetime.now():%d/%m/%Y %H:%M}] VNPay {transaction_no} thanh toán "
+                f"{amount:,.0f} VNĐ sau khi đơn đã hủy - cần hoàn tiền hoặc xử lý thủ công")
+        rental.notes = f"{rental.notes}\n{note}" if rental.notes else note
+        print(f"Đơn #{rental.id} đã hủy nhưng nhận thanh toán VNPay {order_id}: chờ hoàn tiền")
+        return 'paid_after_cancel', rental.id
+
+    # If rental has actual_return_date, it means it's a return payment
+    # Calculate total amount and check if fully paid
+    if rental.actual_return_date:
+        items = session.query(RentalItem).filter(
+            RentalItem.rental_id == rental.id,
+            RentalItem.motorcycle_id.isnot(None)
+        ).all()
+
+        # Calculate total amount based on actual days
+        if items and rental.start_date:
+            actual_days = max(1, (rental.actual_return_date - rental.start_date).days + 1)
+            total_amount = pricing.items_total(items, actual_days)
+            rental.total_amount = total_amount
+
+            # Check if fully paid
+            if rental.paid_amount >= total_amount:
+                rental.payment_status = 'paid'
+                rental.status = 'returned'
+                motorcycle_ids = [item.motorcycle_id for item in items]
+                session.query(Motorcycles).filter(Motorcycles.id.in_(motorcycle_ids))\
+                    .update({Motorcycles.status: 'ready'}, synchronize_session=False)
+            else:
+                rental.payment_status = 'partial'
+        else:
+            rental.payment_status = 'paid'
+            rental.status = 'returned'
+    else:
+        # Initial deposit payment (giữ chỗ thành đơn đã xác nhận)
+        rental.status = 'confirmed'
+        rental.payment_status = 'paid'
+        rental.hold_expires_at = None
+    return 'paid', rental.id
+
+
+# ---------- inbox ----------
+
+def record(session, params, source='ipn'):
+    """Insert the callback into the inbox; return (entry_id, created). Commits."""
+    txn_ref = params.get('vnp_TxnRef', '')
+    transaction_no = params.get('vnp_TransactionNo', '') or ''
+    entry = VnpayInbox(
+        txn_ref=txn_ref,
+        transaction_no=transaction_no,
+        source=source,
+        payload=json.dumps(params, sort_keys=True),
+        received_at=datetime.utcnow(),
+    )
+    session.add(entry)
+    try:
+        session.commit()
+        return entry.id, True
+    except IntegrityError:
+        session.rollback()
+        existing = session.query(VnpayInbox.id).filter(
+            VnpayInbox.txn_ref == txn_ref, VnpayInbox.transaction_no == transaction_no
+        ).first()
+        return existing[0], False
+
+
+def _claim_and_apply(session, entry_id):
+    claimed = session.execute(
+        update(VnpayInbox)
+        .where(VnpayInbox.id == entry_id, VnpayInbox.processed_at.is_(None))
+        .values(processed_at=datetime.utcnow(), attempts=VnpayInbox.attempts + 1)
+    )
+    if claimed.rowcount == 0:
+        session.rollback()
+        result = session.query(VnpayInbox.result).filter(VnpayInbox.id == entry_id).scalar()
+        return result, None
+    entry = session.get(VnpayInbox, entry_id)
+    outcome, rental_id = apply_result(session, json.loads(entry.payload))
+    entry.result = outcome
+    entry.error = None
+    session.commit()
+    return outcome, rental_id
+
+
+def process_entry(session, entry_id):
+    """Apply one inbox entry exactly once; return its outcome (stored result if already done)."""
+    outcome, rental_id, error = None, None, None
+    for _ in range(STALE_RETRIES + 1):
+        try:
+            outcome, rental_id = _claim_and_apply(session, entry_id)
+            error = None
+            break
+        except StaleDataError as e:
+            # Rental/Payment vừa được ghi bởi transaction khác (vd. admin): làm lại với dữ liệu mới
+            session.rollback()
+            error = e
+        except Exception as e:
+            session.rollback()
+            error = e
+            break
+    if error is not None:
+        # processed_at vẫn NULL nên worker sẽ thử lại (tối đa MAX_ATTEMPTS lần)
+        session.execute(
+            update(VnpayInbox)
+            .where(VnpayInbox.id == entry_id)
+            .values(attempts=VnpayInbox.attempts + 1, error=str(error)[:1000])
+        )
+        session.commit()
+        print(f"Lỗi xử lý VNPay inbox #{entry_id}: {error}")
+        return None
+
+    if rental_id:
+        from app.availability import availability_index
+        availability_index.sync_rental(session, rental_id)
+    return outcome
+
+
+def process_pending(session, limit=BATCH_SIZE):
+    """Claim and apply pending inbox entries one by one; return how many were applied.
+
+    Each entry is selected with FOR UPDATE SKIP LOCKED (ignored on SQLite), so
+    several workers drain the inbox side by side without waiting on each other.
+    """
+    done = 0
+    tried = []
+    while len(tried) < limit:
+        query = session.query(VnpayInbox.id).filter(
+            VnpayInbox.processed_at.is_(None), VnpayInbox.attempts < MAX_ATTEMPTS
+        )
+        if tried:
+            query = query.filter(VnpayInbox.id.notin_(tried))
+        entry_id = query.order_by(VnpayInbox.id).limit(1).with_for_update(skip_locked=True).scalar()
+        if entry_id is None:
+            session.rollback()
+            break
+        tried.append(entry_id)
+        if process_entry(session, entry_id) is not None:
+            done += 1
+    return done
+
+
+# ---------- worker ----------
+
+class InboxWorker:
+    """Background thread draining the inbox: woken by notify(), else every POLL_SECONDS."""
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='vnpay-inbox', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        # Chỉ đánh thức: thread do start_worker() khởi động (VNPAY_IPN_WORKER=0 thì không có)
+        self._wakeup.set()
+
+    def _run(self):
+        from app.extensions import get_engine, Session
+        get_engine()
+        while True:
+            self._wakeup.wait(POLL_SECONDS)
+            self._wakeup.clear()
+            session = Session.session_factory()
+            try:
+                while process_pending(session) == BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"Lỗi worker VNPay inbox: {e}")
+            finally:
+                session.close()
+
+
+inbox_worker = InboxWorker()
+
+
+def start_worker():
+    """Start the inbox thread of a web process (VNPAY_IPN_WORKER=0 disables it)."""
+    if os.getenv('VNPAY_IPN_WORKER', '1').lower() in ('1', 'true', 'yes'):
+        inbox_worker.start()
@@ -0,0 +1,186 @@
+"""
+Client cho API truy vấn giao dịch (querydr) của VNPay.
+
+ - Mỗi thread gửi request qua một `requests.Session` riêng (giữ kết nối
+   keep-alive), nhiều truy vấn chạy song song trong một ThreadPoolExecutor.
+ - `RateLimiter` (token bucket dùng chung giữa các thread) giữ tổng số
+   request/giây dưới hạn mức của VNPay, kể cả các lần thử lại.
+ - Lỗi mạng, HTTP 429/5xx và mã 94 (request trùng) được thử lại với backoff
+   tăng dần; chữ ký của phản hồi luôn được kiểm tra trước khi dùng.
+
+Dùng với server giả lập khi chạy thử / đo tốc độ: `python fake_vnpay.py`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hmac
+import os
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.vnpay_helper import VNPay, get_signer, vnpay_timestamp
+
+
+# Thứ tự trường trong chuỗi ký (nối bằng '|') theo tài liệu querydr 2.1.0
+REQUEST_FIELDS = (
+    'vnp_RequestId', 'vnp_Version', 'vnp_Command', 'vnp_TmnCode', 'vnp_TxnRef',
+    'vnp_TransactionDate', 'vnp_CreateDate', 'vnp_IpAddr', 'vnp_OrderInfo',
+)
+RESPONSE_FIELDS = (
+    'vnp_ResponseId', 'vnp_Command', 'vnp_ResponseCode', 'vnp_Message', 'vnp_TmnCode',
+    'vnp_TxnRef', 'vnp_Amount', 'vnp_BankCode', 'vnp_PayDate', 'vnp_TransactionNo',
+    'vnp_TransactionType', 'vnp_TransactionStatus', 'vnp_OrderInfo',
+    'vnp_PromotionCode', 'vnp_PromotionAmount',
+)
+RETRY_HTTP_STATUS = {429, 500, 502, 503, 504}
+RETRY_RESPONSE_CODES = {'94', '99'}   # 94: request trùng trong 5 phút, 99: lỗi khác
+
+
+class QueryError(Exception):
+    pass
+
+
+def pipe_data(params, fields):
+    return '|'.join([str(params.get(field) or '') for field in fields])
+
+
+class RateLimiter:
+    """Token bucket shared by all threads: at most `rate` acquisitions per second."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = burst or max(1, int(self.rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Giữ chỗ ngay (token có thể âm) để thread sau chờ lâu hơn
+            wait = 0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+
+class QueryClient:
+    """Concurrent, rate-limited querydr client; use as a context manager."""
+
+    def __init__(self, api_url=None, tmn_code=None, hash_secret=None, workers=8, rate=20,
+                 timeout=10, retries=3, backoff=0.5, ip_addr='127.0.0.1'):
+        config = VNPay()
+        self.api_url = api_url or config.api_url
+        self.tmn_code = tmn_code or config.tmn_code
+        self.signer = get_signer(hash_secret or config.hash_secret)
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.ip_addr = ip_addr
+        self.limiter = RateLimiter(rate)
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vnpay-query')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._sessions_lock:
+            for http in self._sessions:
+                http.close()
+            self._sessions = []
+
+    def _session(self):
+        http = getattr(self._local, 'session', None)
+        if http is None:
+            http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            http.mount('http://', adapter)
+            http.mount('https://', adapter)
+            self._local.session = http
+            with self._sessions_lock:
+                self._sessions.append(http)
+        return http
+
+    def build_request(self, txn_ref, transaction_date, order_info=None):
+        params = {
+            'vnp_RequestId': uuid.uuid4().hex,
+            'vnp_Version': '2.1.0',
+            'vnp_Command': 'querydr',
+            'vnp_TmnCode': self.tmn_code,
+            'vnp_TxnRef': str(txn_ref),
+            'vnp_OrderInfo': order_info or f'Truy van giao dich {txn_ref}',
+            'vnp_TransactionDate': transaction_date,
+            'vnp_CreateDate': vnpay_timestamp(),
+            'vnp_IpAddr': self.ip_addr,
+        }
+        params['vnp_SecureHash'] = self.signer.sign(pipe_data(params, REQUEST_FIELDS))
+        return params
+
+    def verify_response(self, data):
+        secure_hash = (data.get('vnp_SecureHash') or '').lower()
+        expected = self.signer.sign(pipe_data(data, RESPONSE_FIELDS))
+        return bool(secure_hash) and hmac.compare_digest(expected, secure_hash)
+
+    def query(self, txn_ref, transaction_date, order_info=None):
+        """Signed querydr response for one transaction; raise QueryError when retries run out."""
+        http = self._session()
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            self.limiter.acquire()
+            # RequestId mới cho mỗi lần gửi (VNPay từ chối RequestId trùng)
+            payload = self.build_request(txn_ref, transaction_date, order_info)
+            try:
+                resp = http.post(self.api_url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                last_error = f'{type(e).__name__}: {e}'
+                continue
+            if resp.status_code in RETRY_HTTP_STATUS:
+                last_error = f'HTTP {resp.status_code}'
+                continue
+            try:
+                data = resp.json()
+            except ValueError:
+                last_error = f'HTTP {resp.status_code}: phản hồi không phải JSON'
+                continue
+            if data.get('vnp_ResponseCode') in RETRY_RESPONSE_CODES:
+                last_error = f"mã {data.get('vnp_ResponseCode')}: {data.get('vnp_Message', '')}"
+                continue
+            if not self.verify_response(data):
+                raise QueryError(f'{txn_ref}: sai chữ ký phản hồi')
+            return data
+        raise QueryError(f'{txn_ref}: {last_error}')
+
+    def _query_safe(self, item):
+        try:
+            return self.query(*item), None
+        except QueryError as e:
+            return None, str(e)
+
+    def query_many(self, items):
+        """[(response, error), ...] in the order of `items` ((txn_ref, transaction_date) pairs)."""
+        return list(self._executor.map(self._query_safe, items))
+
+
+def client_from_env(**overrides):
+    options = {
+        'workers': int(os.getenv('VNPAY_QUERY_WORKERS', '8')),
+        'rate': float(os.getenv('VNPAY_QUERY_RATE', '20')),
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return QueryClient(**options)
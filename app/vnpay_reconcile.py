@@ -0,0 +1,164 @@
+"""
+Đối soát các Payment VNPay còn 'pending' với API querydr (lệnh `flask vnpay-reconcile`).
+
+Payment được đọc theo lô (keyset theo id), mỗi lô truy vấn song song qua
+`QueryClient` rồi áp dụng kết quả:
+ - đã thanh toán: ghi vào vnpay_inbox (source='querydr') và xử lý như IPN,
+   nên không bị cộng tiền hai lần nếu IPN đã về hoặc về sau;
+ - thất bại: một câu UPDATE cho cả lô, cập nhật payment_summary theo tổng
+   và hủy đơn thuê chưa có thanh toán nào khác;
+ - không tồn tại bên VNPay (mã 91), đang xử lý / chưa rõ: giữ nguyên. Mã 91
+   không chắc là thất bại (khách chưa tới trang VNPay, hoặc ngày tạo gửi
+   sai) nên để giữ chỗ hết hạn tự hủy đơn (booking_holds).
+
+Chỉ xét giao dịch cũ hơn `min_age` (khách có thể vẫn đang ở trang VNPay).
+Ngày tạo giao dịch lấy từ payment_code (yyyymmddHHMMSS giờ VN + số thứ tự),
+đúng bằng vnp_CreateDate đã gửi khi tạo link thanh toán (app/order_ids.py).
+Chỉ mục tình trạng xe ở các worker web tự làm mới sau REFRESH_SECONDS.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, func
+
+from app import payment_stats, vnpay_ipn
+from app.vnpay_helper import vnpay_now
+from app.models import Payment, Rental
+
+
+PAID_STATUSES = {'00'}
+FAILED_STATUSES = {'02', '04'}     # 02: giao dịch lỗi, 04: giao dịch đảo
+NOT_FOUND_CODE = '91'
+
+
+def transaction_date(payment_code):
+    """Creation time encoded in a payment code, or None for codes in another format."""
+    if not payment_code or len(payment_code) < 14:
+        return None
+    try:
+        return datetime.strptime(payment_code[:14], '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+
+
+def classify(response, error):
+    """paid | failed | pending | not_found | error for one querydr result."""
+    if error or not response:
+        return 'error'
+    code = response.get('vnp_ResponseCode')
+    if code == NOT_FOUND_CODE:
+        # Có thể khách chưa tới bước thanh toán - không đủ chắc để hủy đơn
+        return 'not_found'
+    if code != '00':
+        return 'error'
+    status = response.get('vnp_TransactionStatus')
+    if status in PAID_STATUSES:
+        return 'paid'
+    if status in FAILED_STATUSES:
+        return 'failed'
+    return 'pending'
+
+
+def apply_paid(session, responses):
+    """Route confirmed payments through the IPN inbox; return Counter of outcomes."""
+    outcomes = Counter()
+    for response in responses:
+        params = {k: v for k, v in response.items()
+                  if k.startswith('vnp_') and k not in ('vnp_SecureHash', 'vnp_SecureHashType')}
+        entry_id, _ = vnpay_ipn.record(session, params, source='querydr')
+        outcomes[vnpay_ipn.process_entry(session, entry_id) or 'error'] += 1
+    return outcomes
+
+
+def mark_failed(session, payment_ids):
+    """Bulk-mark still-pending payments failed and cancel their pending rentals; return (payments, rentals)."""
+    if not payment_ids:
+        return 0, 0
+    # Dòng đang bị callback khóa thì bỏ qua: callback sẽ tự cập nhật, lần chạy sau kiểm tra lại
+    rows = session.query(Payment.id, Payment.rental_id, Payment.amount).filter(
+        Payment.id.in_(payment_ids), Payment.payment_status == 'pending'
+    ).with_for_update(skip_locked=True).all()
+    if not rows:
+        session.rollback()
+        return 0, 0
+
+    ids = [row.id for row in rows]
+    session.query(Payment).filter(Payment.id.in_(ids))\
+        .update({Payment.payment_status: 'failed', Payment.version: Payment.version + 1},
+                synchronize_session=False)
+    payment_stats.record_bulk_transition(
+        session.connection(), 'pending', 'failed', len(rows), sum(row.amount or 0 for row in rows)
+    )
+
+    rental_ids = {row.rental_id for row in rows if row.rental_id}
+    cancelled = 0
+    if rental_ids:
+        other_open = exists().where(
+            Payment.rental_id == Rental.id, Payment.payment_status.in_(('pending', 'paid'))
+        )
+        cancelled = session.query(Rental).filter(
+            Rental.id.in_(rental_ids), Rental.status == 'pending', ~other_open
+        ).update({Rental.status: 'cancelled', Rental.payment_status: 'failed', Rental.hold_expires_at: None,
+                  Rental.version: Rental.version + 1},
+                 synchronize_session=False)
+    session.commit()
+    return len(rows), cancelled
+
+
+def count_pending(session):
+    return session.query(func.count(Payment.id)).filter(
+        Payment.payment_status == 'pending', Payment.payment_method == 'vnpay'
+    ).scalar()
+
+
+def reconcile(session, client, batch_size=500, min_age=timedelta(minutes=15),
+              limit=None, dry_run=False, echo=None):
+    """Reconcile pending VNPay payments batch by batch; return a Counter of results."""
+    stats = Counter()
+    cutoff = vnpay_now() - min_age
+    last_id = 0
+    while limit is None or stats['queried'] < limit:
+        size = batch_size if limit is None else min(batch_size, limit - stats['queried'])
+        rows = session.query(Payment.id, Payment.payment_code).filter(
+            Payment.id > last_id,
+            Payment.payment_status == 'pending',
+            Payment.payment_method == 'vnpay',
+        ).order_by(Payment.id).limit(size).all()
+        session.rollback()   # không giữ transaction đọc trong lúc chờ HTTP
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        batch = []
+        for row in rows:
+            created = transaction_date(row.payment_code)
+            if created is None:
+                stats['skipped'] += 1
+            elif created > cutoff:
+                stats['too_recent'] += 1
+            else:
+                batch.append((row.id, row.payment_code, created.strftime('%Y%m%d%H%M%S')))
+
+        results = client.query_many([(code, created) for _, code, created in batch])
+        stats['queried'] += len(batch)
+        paid, failed_ids = [], []
+        for (payment_id, _, _), (response, error) in zip(batch, results):
+            outcome = classify(response, error)
+            stats[outcome] += 1
+            if outcome == 'paid':
+                paid.append(response)
+            elif outcome == 'failed':
+                failed_ids.append(payment_id)
+            elif outcome == 'error' and echo:
+                echo(f'  ! {error or response.get("vnp_ResponseCode")}')
+
+        if not dry_run:
+            for outcome, count in apply_paid(session, paid).items():
+                stats[f'applied_{outcome}'] += count
+            marked, cancelled = mark_failed(session, failed_ids)
+            stats['marked_failed'] += marked
+            stats['rentals_cancelled'] += cancelled
+        if echo:
+            echo(f'... id <= {last_id}: {stats["queried"]} đã truy vấn, '
+                 f'{stats["paid"]} thành công, {stats["failed"]} thất bại, {stats["error"]} lỗi')
+    return stats
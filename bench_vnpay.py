@@ -0,0 +1,168 @@
+"""Micro-benchmark: VNPay request signing / callback validation, cũ vs mới.
+
+Chạy: python bench_vnpay.py [số lần lặp]
+
+Bản cũ (chép nguyên từ app/vnpay_helper.py trước khi đổi sang VNPaySigner)
+được giữ trong file này để so sánh; print debug của nó được chuyển vào
+os.devnull để không đo tốc độ terminal.
+"""
+import contextlib
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import timeit
+import urllib.parse
+
+from app.vnpay_helper import VNPaySigner, canonical_query
+
+
+SECRET = 'J387G5VO8FUMTRBMPSANSJXOSMCNLKBK'
+BASE_URL = 'https://sandbox.vnpayment.vn/paymentv2/vpcpay.html'
+
+REQUEST = {
+    'vnp_Version': '2.1.0',
+    'vnp_Command': 'pay',
+    'vnp_TmnCode': '08XB68MP',
+    'vnp_Amount': 150000000,
+    'vnp_CurrCode': 'VND',
+    'vnp_TxnRef': '202601011200001234',
+    'vnp_OrderInfo': 'Dat xe Honda Air Blade - 2 xe - 3 ngay',
+    'vnp_OrderType': 'other',
+    'vnp_Locale': 'vn',
+    'vnp_CreateDate': '20260101120000',
+    'vnp_IpAddr': '203.0.113.7',
+    'vnp_ReturnUrl': 'https://example.com/payment/return',
+}
+
+CALLBACK = {
+    'vnp_Amount': '150000000',
+    'vnp_BankCode': 'NCB',
+    'vnp_BankTranNo': 'VNP14226112',
+    'vnp_CardType': 'ATM',
+    'vnp_OrderInfo': 'Dat xe Honda Air Blade - 2 xe - 3 ngay',
+    'vnp_PayDate': '20260101120512',
+    'vnp_ResponseCode': '00',
+    'vnp_TmnCode': '08XB68MP',
+    'vnp_TransactionNo': '14226112',
+    'vnp_TransactionStatus': '00',
+    'vnp_TxnRef': '202601011200001234',
+}
+
+
+class LegacyVNPay:
+    """Bản cũ: dict ở mức class, ghép chuỗi bằng +, hmac.new mỗi lần, so sánh ==."""
+    requestData = {}
+    responseData = {}
+
+    def get_payment_url(self, vnpay_payment_url, secret_key):
+        inputData = sorted(self.requestData.items())
+        queryString = ''
+        seq = 0
+        for key, val in inputData:
+            if seq == 1:
+                queryString = queryString + "&" + key + '=' + urllib.parse.quote_plus(str(val))
+            else:
+                seq = 1
+                queryString = key + '=' + urllib.parse.quote_plus(str(val))
+        hashValue = self._hmacsha512(secret_key, queryString)
+        return vnpay_payment_url + "?" + queryString + '&vnp_SecureHash=' + hashValue
+
+    def validate_response(self, secret_key):
+        vnp_SecureHash = self.responseData.get('vnp_SecureHash', '')
+        if not vnp_SecureHash:
+            return False
+        response_data_copy = dict(self.responseData)
+        if 'vnp_SecureHash' in response_data_copy:
+            response_data_copy.pop('vnp_SecureHash')
+        if 'vnp_SecureHashType' in response_data_copy:
+            response_data_copy.pop('vnp_SecureHashType')
+        inputData = sorted(response_data_copy.items())
+        hasData = ''
+        seq = 0
+        for key, val in inputData:
+            if str(key).startswith('vnp_'):
+                if seq == 1:
+                    hasData = hasData + "&" + str(key) + '=' + urllib.parse.quote_plus(str(val))
+                else:
+                    seq = 1
+                    hasData = str(key) + '=' + urllib.parse.quote_plus(str(val))
+        hashValue = self._hmacsha512(secret_key, hasData)
+        print('Validate debug, HashData:' + hasData + "\n HashValue:" + hashValue + "\nInputHash:" + vnp_SecureHash)
+        return vnp_SecureHash == hashValue
+
+    @staticmethod
+    def _hmacsha512(key, data):
+        return hmac.new(key.encode('utf-8'), data.encode('utf-8'), hashlib.sha512).hexdigest()
+
+
+def check_equivalent(signer):
+    legacy = LegacyVNPay()
+    legacy.requestData = dict(REQUEST)
+    assert legacy.get_payment_url(BASE_URL, SECRET) == signer.payment_url(BASE_URL, REQUEST)
+    signed = dict(CALLBACK, vnp_SecureHash=signer.sign(canonical_query(CALLBACK)), vnp_SecureHashType='SHA512')
+    legacy.responseData = signed
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        assert legacy.validate_response(SECRET)
+    assert signer.verify(signed)
+    assert not signer.verify(dict(signed, vnp_Amount='1'))
+    return signed
+
+
+def check_threads(signer, signed, threads=8, rounds=2000):
+    """Sign/verify from several threads at once; every result must be correct."""
+    errors = []
+    expected = signer.payment_url(BASE_URL, REQUEST)
+
+    def worker():
+        for _ in range(rounds):
+            if signer.payment_url(BASE_URL, REQUEST) != expected or not signer.verify(signed):
+                errors.append(1)
+                return
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    assert not errors, 'kết quả sai khi chạy song song'
+
+
+def report(name, legacy_seconds, new_seconds, number):
+    legacy_us = legacy_seconds / number * 1e6
+    new_us = new_seconds / number * 1e6
+    print(f'{name:<22} cũ {legacy_us:8.2f} µs   mới {new_us:8.2f} µs   x{legacy_us / new_us:.2f}')
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    signer = VNPaySigner(SECRET)
+    signed = check_equivalent(signer)
+    check_threads(signer, signed)
+
+    legacy = LegacyVNPay()
+    legacy.requestData = dict(REQUEST)
+    legacy.responseData = signed
+
+    def legacy_build():
+        return legacy.get_payment_url(BASE_URL, SECRET)
+
+    def new_build():
+        return signer.payment_url(BASE_URL, REQUEST)
+
+    def new_verify():
+        return signer.verify(signed)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        legacy_verify_time = min(timeit.repeat(lambda: legacy.validate_response(SECRET), number=number, repeat=3))
+
+    print(f'{number} lần lặp, lấy kết quả tốt nhất trong 3 lượt')
+    report('tạo payment URL', min(timeit.repeat(legacy_build, number=number, repeat=3)),
+           min(timeit.repeat(new_build, number=number, repeat=3)), number)
+    report('kiểm tra callback', legacy_verify_time,
+           min(timeit.repeat(new_verify, number=number, repeat=3)), number)
+
+
+if __name__ == '__main__':
+    main()
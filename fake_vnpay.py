@@ -0,0 +1,252 @@
+"""Server VNPay giả lập cho API querydr, để chạy thử / đo tốc độ `flask vnpay-reconcile` offline.
+
+Chạy server:
+    python fake_vnpay.py serve --port 8765 --latency-ms 40 --error-rate 0.02
+    flask --app wsgi vnpay-reconcile --api-url http://127.0.0.1:8765/merchant_webapi/api/transaction
+
+Tạo dữ liệu thử (N đơn thuê + payment 'pending' đã cũ, số tiền khớp với server):
+    python fake_vnpay.py seed 20000
+
+Đo riêng phần HTTP (không cần database), server chạy trong cùng process:
+    python fake_vnpay.py bench 5000 --latency-ms 40
+
+Kết quả mỗi giao dịch được suy ra cố định từ vnp_TxnRef (theo tỉ lệ --paid /
+--failed / --not-found, còn lại là "chưa hoàn tất"), nên chạy lại cho cùng
+kết quả. Server kiểm tra chữ ký request, từ chối RequestId trùng (mã 94) và
+có thể trả HTTP 503 ngẫu nhiên (--error-rate) để thử cơ chế retry.
+"""
+import argparse
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.vnpay_helper import VNPay, get_signer
+from app.vnpay_query import REQUEST_FIELDS, RESPONSE_FIELDS, QueryClient, pipe_data
+
+
+def _digest(txn_ref):
+    return int(hashlib.sha256(txn_ref.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def fake_amount(txn_ref):
+    """Deterministic amount (VND) for a transaction, shared by the server and `seed`."""
+    return (_digest(txn_ref) % 50 + 1) * 10000
+
+
+def fake_status(txn_ref, paid, failed, not_found):
+    bucket = (_digest(txn_ref) >> 8) % 100
+    if bucket < paid:
+        return '00', '00'
+    if bucket < paid + failed:
+        return '00', '02'
+    if bucket < paid + failed + not_found:
+        return '91', ''
+    return '00', '01'
+
+
+class FakeVNPay(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, error_rate=0.0, paid=60, failed=20, not_found=10):
+        super().__init__(address, Handler)
+        config = VNPay()
+        self.tmn_code = config.tmn_code
+        self.signer = get_signer(config.hash_secret)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.ratios = (paid, failed, not_found)
+        self.request_ids = set()
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'http_503': 0, 'duplicate': 0, 'bad_hash': 0}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def answer(self, req):
+        if self.signer.sign(pipe_data(req, REQUEST_FIELDS)) != req.get('vnp_SecureHash'):
+            self.count('bad_hash')
+            return self.signed(req, '97', 'Invalid Checksum')
+        with self.lock:
+            duplicate = req.get('vnp_RequestId') in self.request_ids
+            self.request_ids.add(req.get('vnp_RequestId'))
+        if duplicate:
+            self.count('duplicate')
+            return self.signed(req, '94', 'Duplicate request')
+
+        txn_ref = req.get('vnp_TxnRef', '')
+        code, status = fake_status(txn_ref, *self.ratios)
+        if code != '00':
+            return self.signed(req, code, 'Transaction not found')
+        created = datetime.strptime(req['vnp_TransactionDate'], '%Y%m%d%H%M%S')
+        return self.signed(
+            req, '00', 'QueryDR Success',
+            vnp_Amount=str(fake_amount(txn_ref) * 100),
+            vnp_BankCode='NCB',
+            vnp_PayDate=(created + timedelta(minutes=2)).strftime('%Y%m%d%H%M%S'),
+            vnp_TransactionNo=str(10000000 + _digest(txn_ref) % 90000000) if status != '01' else '0',
+            vnp_TransactionType='01',
+            vnp_TransactionStatus=status,
+            vnp_OrderInfo=req.get('vnp_OrderInfo', ''),
+        )
+
+    def signed(self, req, code, message, **fields):
+        data = {
+            'vnp_ResponseId': req.get('vnp_RequestId', ''),
+            'vnp_Command': 'querydr',
+            'vnp_ResponseCode': code,
+            'vnp_Message': message,
+            'vnp_TmnCode': self.tmn_code,
+            'vnp_TxnRef': req.get('vnp_TxnRef', ''),
+            **fields,
+        }
+        data['vnp_SecureHash'] = self.signer.sign(pipe_data(data, RESPONSE_FIELDS))
+        return data
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive như server thật
+
+    def setup(self):
+        super().setup()
+        # Header và body được ghi riêng: tắt Nagle để không dính delayed ACK ~40ms
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        server = self.server
+        server.count('requests')
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            server.count('http_503')
+            return self.reply(503, {'message': 'Service Unavailable'})
+        try:
+            req = json.loads(body)
+        except ValueError:
+            return self.reply(400, {'message': 'Bad Request'})
+        self.reply(200, server.answer(req))
+
+    def reply(self, status, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, **options):
+    server = FakeVNPay(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve(args):
+    server = FakeVNPay(('127.0.0.1', args.port), **server_options(args))
+    print(f'Fake VNPay querydr: http://127.0.0.1:{args.port}/merchant_webapi/api/transaction')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.counts)
+
+
+def seed(args):
+    """Insert N pending rentals/payments dated an hour ago (bulk insert, then rebuild payment_summary)."""
+    from app import payment_stats
+    from app.extensions import get_db_session
+    from app.models import Payment, Rental
+
+    session = get_db_session()
+    try:
+        base = datetime.now() - timedelta(hours=1)
+        done = 0
+        while done < args.count:
+            size = min(1000, args.count - done)
+            codes = [
+                (base - timedelta(seconds=done + i)).strftime('%Y%m%d%H%M%S') + f'{(done + i) % 10000:04d}'
+                for i in range(size)
+            ]
+            rentals = [
+                {'status': 'pending', 'payment_status': 'pending', 'payment_method': 'vnpay',
+                 'vnpay_transaction_id': code, 'deposit_amount': fake_amount(code),
+                 'total_amount': fake_amount(code), 'paid_amount': 0}
+                for code in codes
+            ]
+            session.bulk_insert_mappings(Rental, rentals)
+            ids = dict(session.query(Rental.vnpay_transaction_id, Rental.id)
+                       .filter(Rental.vnpay_transaction_id.in_(codes)).all())
+            session.bulk_insert_mappings(Payment, [
+                {'rental_id': ids[code], 'payment_code': code, 'amount': fake_amount(code),
+                 'payment_method': 'vnpay', 'payment_status': 'pending'}
+                for code in codes
+            ])
+            session.commit()
+            done += size
+            print(f'... {done}/{args.count}')
+        payment_stats.reconcile(session)
+    finally:
+        session.close()
+    print(f'Đã tạo {args.count} thanh toán pending.')
+
+
+def bench(args):
+    server = start_server(args.port, **server_options(args))
+    url = f'http://127.0.0.1:{args.port}/merchant_webapi/api/transaction'
+    base = datetime.now() - timedelta(hours=1)
+    items = [(base.strftime('%Y%m%d%H%M%S') + f'{i:06d}', base.strftime('%Y%m%d%H%M%S'))
+             for i in range(args.count)]
+    print(f'{args.count} truy vấn, độ trễ server {args.latency_ms} ms, lỗi {args.error_rate:.0%}')
+    for workers in args.workers:
+        with QueryClient(api_url=url, workers=workers, rate=args.rate, backoff=0.05) as client:
+            started = time.monotonic()
+            results = client.query_many(items)
+            elapsed = time.monotonic() - started
+        errors = sum(1 for _, error in results if error)
+        print(f'workers={workers:<3} {elapsed:7.2f}s  {args.count / elapsed:8.0f} truy vấn/s  lỗi {errors}')
+    server.shutdown()
+    print(server.counts)
+
+
+def server_options(args):
+    return {
+        'latency': args.latency_ms / 1000,
+        'error_rate': args.error_rate,
+        'paid': args.paid,
+        'failed': args.failed,
+        'not_found': args.not_found,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'bench'):
+        p = sub.add_parser(name)
+        p.add_argument('--port', type=int, default=8765)
+        p.add_argument('--latency-ms', type=float, default=40)
+        p.add_argument('--error-rate', type=float, default=0.0)
+        p.add_argument('--paid', type=int, default=60, help='% giao dịch thành công')
+        p.add_argument('--failed', type=int, default=20, help='% giao dịch lỗi')
+        p.add_argument('--not-found', type=int, default=10, help='% không có bên VNPay')
+        if name == 'bench':
+            p.add_argument('count', type=int, nargs='?', default=2000)
+            p.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32])
+            p.add_argument('--rate', type=float, default=0)
+    p = sub.add_parser('seed')
+    p.add_argument('count', type=int)
+
+    args = parser.parse_args()
+    {'serve': serve, 'seed': seed, 'bench': bench}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+"""
+Cấu hình gunicorn (tự đọc từ thư mục chạy, vd. Procfile `gunicorn wsgi:app`).
+
+Thread nền (worker VNPay inbox, lập lịch job, worker task) được start trong
+từng worker sau khi fork - không chạy trong process master và không chạy
+cho các lệnh `flask ...` dùng chung create_app().
+"""
+
+
+def post_worker_init(worker):
+    from app import start_background
+    start_background(worker.wsgi)
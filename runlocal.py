@@ -32,6 +32,9 @@ if flask_app is not None:
     host = os.getenv('HOST', '127.0.0.1')
     port = int(os.getenv('PORT', '8000'))
     debug = os.getenv('DEBUG', '1').lower() in ('1', 'true', 'yes')
+    # Reloader của debug chạy server trong process con: chỉ start thread nền ở đó
+    if hasattr(app_module, 'start_background') and (not debug or os.getenv('WERKZEUG_RUN_MAIN') == 'true'):
+        app_module.start_background(flask_app)
     print(f"Starting dev server on http://{host}:{port} (debug={debug})")
     flask_app.run(host=host, port=port, debug=debug)
 else:
@@ -0,0 +1,98 @@
+"""Kiểm tra tải cho app/order_ids.py: nhiều process cùng sinh mã, không được trùng.
+
+Chạy: python stress_order_ids.py [--processes 8] [--per-process 250000] [--block 200]
+      python stress_order_ids.py --legacy     (đếm mã trùng của cách cũ để so sánh)
+
+Mặc định dùng một file SQLite tạm; đặt --url (vd. DATABASE_URL của PostgreSQL
+test) để thử với database thật. Mỗi process ghi mã của mình ra file, process
+cha kiểm tra: mã tăng dần trong từng process, không trùng trên toàn bộ, độ
+dài / ký tự hợp lệ cho vnp_TxnRef.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+from app.models import IdBlock
+from app.order_ids import BlockAllocator, OrderIdGenerator
+
+
+def legacy_order_id():
+    return datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(1000, 9999))
+
+
+def worker(url, count, block, legacy, out_path, start_event):
+    engine = create_engine(url, connect_args={'timeout': 30} if url.startswith('sqlite') else {})
+    generator = OrderIdGenerator(BlockAllocator('stress', block_size=block, engine=engine))
+    next_id = legacy_order_id if legacy else generator.next_id
+    start_event.wait()
+    started = time.perf_counter()
+    ids = [next_id() for _ in range(count)]
+    elapsed = time.perf_counter() - started
+    ordered = all(a < b for a, b in zip(ids, ids[1:]))
+    with open(out_path, 'w') as f:
+        f.write('\n'.join(ids))
+    engine.dispose()
+    return elapsed, ordered, generator.allocator.blocks_allocated
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--per-process', type=int, default=250000)
+    parser.add_argument('--block', type=int, default=200)
+    parser.add_argument('--url', default=None)
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='order_ids_')
+    url = args.url or f"sqlite:///{os.path.join(workdir, 'ids.db')}"
+    engine = create_engine(url)
+    IdBlock.__table__.create(engine, checkfirst=True)
+    engine.dispose()
+
+    total = args.processes * args.per_process
+    print(f"{'cách cũ (ngẫu nhiên)' if args.legacy else f'khối {args.block}'}: "
+          f"{args.processes} process x {args.per_process} = {total} mã, {url}")
+    manager = multiprocessing.Manager()
+    start_event = manager.Event()
+    paths = [os.path.join(workdir, f'ids_{i}.txt') for i in range(args.processes)]
+    with multiprocessing.Pool(args.processes) as pool:
+        jobs = [pool.apply_async(worker, (url, args.per_process, args.block, args.legacy, path, start_event))
+                for path in paths]
+        time.sleep(0.5)
+        wall = time.perf_counter()
+        start_event.set()
+        results = [job.get() for job in jobs]
+        wall = time.perf_counter() - wall
+
+    seen = set()
+    duplicates = 0
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                code = line.rstrip('\n')
+                if code in seen:
+                    duplicates += 1
+                seen.add(code)
+        os.remove(path)
+    lengths = {len(code) for code in seen}
+    valid = all(code.isalnum() for code in seen)
+
+    print(f'thời gian: {wall:.2f}s, {total / wall:,.0f} mã/s '
+          f'(chậm nhất một process: {max(r[0] for r in results):.2f}s)')
+    print(f'khối đã xin từ DB: {sum(r[2] for r in results)}')
+    print(f'tăng dần trong từng process: {all(r[1] for r in results)}')
+    print(f'độ dài: {sorted(lengths)}, chỉ chữ/số: {valid}')
+    print(f'trùng: {duplicates}')
+    if duplicates and not args.legacy:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
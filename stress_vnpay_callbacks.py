@@ -0,0 +1,191 @@
+"""Kiểm tra đồng thời: hàng trăm callback VNPay song song không được làm lệch tiền.
+
+Chạy: python stress_vnpay_callbacks.py [--rentals 50] [--payments 4] [--duplicates 3]
+                                       [--threads 32] [--drainers 4] [--url postgresql://...]
+
+Mỗi đơn thuê có vài payment VNPay 'pending'; mỗi payment được gửi nhiều lần
+(IPN lặp lại + trang return) từ nhiều thread cùng lúc, trong khi vài thread
+khác xử lý inbox (như nhiều worker) và một thread "admin" liên tục sửa ghi
+chú các đơn đó (để va chạm version). Cuối cùng kiểm tra:
+ - paid_amount của mỗi đơn đúng bằng tổng các payment (không mất, không cộng hai lần);
+ - mỗi payment 'paid', mỗi giao dịch đúng một dòng inbox;
+ - payment_summary khớp với bảng payment.
+
+Mặc định dùng file SQLite tạm (SQLite khóa cả database nên mọi ghi chạy lần
+lượt); dùng --url PostgreSQL để thấy các đơn khác nhau không phải chờ nhau.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rentals', type=int, default=50)
+    parser.add_argument('--payments', type=int, default=4)
+    parser.add_argument('--duplicates', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--drainers', type=int, default=4)
+    parser.add_argument('--url', default=None)
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ['DATABASE_URL'] = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='vnpay_stress_'), 'stress.db')}"
+os.environ['VNPAY_IPN_WORKER'] = '0'     # các thread drain bên dưới đóng vai worker
+
+from sqlalchemy.orm.exc import StaleDataError  # noqa: E402
+
+from app import create_app, payment_stats, vnpay_ipn  # noqa: E402
+from app.extensions import Session  # noqa: E402
+from app.models import Payment, Rental, VnpayInbox  # noqa: E402
+from app.order_ids import generate_order_id  # noqa: E402
+from app.vnpay_helper import VNPay, canonical_query, get_signer  # noqa: E402
+
+
+def seed(session):
+    """Rentals with several pending VNPay payments each; return {rental_id: expected paid}."""
+    expected = {}
+    # Xin mã trước: trên SQLite bộ đếm dùng connection riêng, không chờ được khóa ghi của session
+    codes = iter([generate_order_id() for _ in range(args.rentals * args.payments)])
+    for _ in range(args.rentals):
+        rental = Rental(status='pending', payment_status='pending', paid_amount=Decimal('0'))
+        session.add(rental)
+        session.flush()
+        total = Decimal('0')
+        for _ in range(args.payments):
+            amount = Decimal(random.randint(1, 200) * 1000)
+            session.add(Payment(rental_id=rental.id, payment_code=next(codes), amount=amount,
+                                payment_method='vnpay', payment_status='pending'))
+            total += amount
+        expected[rental.id] = total
+    session.commit()
+    return expected
+
+
+def signed_callback(payment, signer):
+    params = {
+        'vnp_Amount': str(int(payment.amount * 100)),
+        'vnp_BankCode': 'NCB',
+        'vnp_PayDate': '20260101120000',
+        'vnp_ResponseCode': '00',
+        'vnp_TmnCode': VNPay().tmn_code,
+        'vnp_TransactionNo': payment.payment_code[-8:],
+        'vnp_TransactionStatus': '00',
+        'vnp_TxnRef': payment.payment_code,
+    }
+    params['vnp_SecureHash'] = signer.sign(canonical_query(params))
+    return params
+
+
+def main():
+    app = create_app()
+    session = Session.session_factory()
+    expected = seed(session)
+    signer = get_signer(VNPay().hash_secret)
+    requests_to_send = []
+    for payment in session.query(Payment).filter(Payment.rental_id.in_(expected)):
+        params = signed_callback(payment, signer)
+        requests_to_send += [('/api/vnpay/ipn', params)] * args.duplicates
+        requests_to_send.append(('/payment/return', params))
+    session.close()
+    random.shuffle(requests_to_send)
+
+    local = threading.local()
+    responses = Counter()
+    responses_lock = threading.Lock()
+
+    def send(item):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        path, params = item
+        resp = client.get(path, query_string=params)
+        key = resp.get_json()['RspCode'] if path.endswith('/ipn') else f'return {resp.status_code}'
+        with responses_lock:
+            responses[key] += 1
+
+    sending = threading.Event()
+    sending.set()
+    conflicts = Counter()
+
+    def drain():
+        drain_session = Session.session_factory()
+        try:
+            while True:
+                busy = sending.is_set()
+                if not vnpay_ipn.process_pending(drain_session) and not busy:
+                    break
+        finally:
+            drain_session.close()
+
+    def admin_editor():
+        # Sửa ghi chú qua ORM (kiểm tra version) trong lúc callback đang cộng tiền
+        edit_session = Session.session_factory()
+        rental_ids = list(expected)
+        try:
+            while sending.is_set():
+                rental = edit_session.get(Rental, random.choice(rental_ids))
+                rental.notes = f'admin {time.monotonic():.6f}'
+                try:
+                    edit_session.commit()
+                    conflicts['admin_edits'] += 1
+                except StaleDataError:
+                    edit_session.rollback()
+                    conflicts['admin_stale'] += 1
+                edit_session.expire_all()
+        finally:
+            edit_session.close()
+
+    workers = [threading.Thread(target=drain) for _ in range(args.drainers)]
+    workers.append(threading.Thread(target=admin_editor))
+    for worker in workers:
+        worker.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(send, requests_to_send))
+    sending.clear()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    session = Session.session_factory()
+    try:
+        wrong = []
+        for rental in session.query(Rental).filter(Rental.id.in_(expected)):
+            if rental.paid_amount != expected[rental.id] or rental.status != 'confirmed':
+                wrong.append((rental.id, rental.paid_amount, expected[rental.id], rental.status))
+        not_paid = session.query(Payment).filter(
+            Payment.rental_id.in_(expected), Payment.payment_status != 'paid'
+        ).count()
+        inbox = Counter(result for (result,) in session.query(VnpayInbox.result))
+        unprocessed = session.query(VnpayInbox).filter(VnpayInbox.processed_at.is_(None)).count()
+        drift = payment_stats.reconcile(session)
+    finally:
+        session.close()
+
+    total = len(requests_to_send)
+    print(f'{total} callback ({args.rentals} đơn x {args.payments} payment x {args.duplicates + 1} lần) '
+          f'trong {elapsed:.2f}s, {total / elapsed:.0f}/s, {os.environ["DATABASE_URL"].split(":")[0]}')
+    print(f'phản hồi: {dict(responses)}')
+    print(f'inbox: {dict(inbox)}, chưa xử lý: {unprocessed}')
+    print(f'admin sửa song song: {dict(conflicts)}')
+    print(f'đơn sai tiền/trạng thái: {len(wrong)}, payment chưa paid: {not_paid}, '
+          f'payment_summary lệch: {len(drift)}')
+    for row in wrong[:10]:
+        print('  ', row)
+    ok = not wrong and not not_paid and not unprocessed and not drift \
+        and sum(inbox.values()) == args.rentals * args.payments
+    print('OK' if ok else 'SAI')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Shared fixtures: one app on a throwaway SQLite database per test session."""
+from contextlib import contextmanager
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+_db_dir = tempfile.mkdtemp(prefix='motorent-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'test.db')
+# Không chạy thread nền trong test (create_app chỉ start khi BACKGROUND_THREADS=1)
+os.environ['BACKGROUND_THREADS'] = '0'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def db(app):
+    from app.extensions import get_db_session
+
+    with app.app_context():
+        session = get_db_session()
+        yield session
+        session.rollback()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['account_id'] = 1
+    return client
+
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager collecting the SQL statements executed inside it."""
+    from app.extensions import get_engine
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = get_engine()
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    return counter
@@ -0,0 +1,29 @@
+"""create_app() (shared by every `flask` command and script) starts no background threads."""
+import threading
+
+from app import create_app, tasks
+
+BACKGROUND_THREADS = ('vnpay-inbox', 'job-scheduler', 'task-worker')
+
+
+def _background_threads():
+    return [t.name for t in threading.enumerate() if t.name.startswith(BACKGROUND_THREADS)]
+
+
+def test_create_app_starts_no_threads(app, monkeypatch):
+    monkeypatch.setenv('VNPAY_IPN_WORKER', '1')
+    monkeypatch.setenv('JOB_SCHEDULER', '1')
+    monkeypatch.setattr(tasks, 'INPROCESS_WORKERS', 2)
+    before = _background_threads()
+
+    cli_app = create_app()
+    result = cli_app.test_cli_runner().invoke(args=['db-current'])
+    assert result.exit_code == 0, result.output
+    assert _background_threads() == before == []
+
+
+def test_ipn_notify_does_not_start_inbox_worker(app):
+    from app import vnpay_ipn
+
+    vnpay_ipn.inbox_worker.notify()
+    assert _background_threads() == []
@@ -0,0 +1,51 @@
+"""A leader job runs once per due time, even when it outlives the lease."""
+from datetime import datetime, timedelta
+import time
+
+from app import jobs
+from app.models import ScheduledJob, SchedulerLease
+
+
+def _due_job(db, monkeypatch, func):
+    job = jobs.Job('test-long-job', jobs.Cron('0 3 * * *'), func, True, 60)
+    monkeypatch.setattr(jobs, 'JOBS', {job.name: job})
+    state = db.get(ScheduledJob, job.name) or ScheduledJob(name=job.name)
+    state.next_run_at = datetime.now() - timedelta(minutes=1)
+    db.add(state)
+    db.commit()
+    return job
+
+
+def _expire_lease(db):
+    db.query(SchedulerLease).filter(SchedulerLease.name == 'test-jobs')\
+        .update({SchedulerLease.expires_at: datetime.now() - timedelta(seconds=1)})
+    db.commit()
+
+
+def test_second_leader_does_not_rerun_claimed_job(db, monkeypatch):
+    first, second = jobs.JobScheduler(), jobs.JobScheduler()
+    first.lease = jobs.Lease('test-jobs', seconds=60)
+    second.lease = jobs.Lease('test-jobs', seconds=60)
+    runs = []
+
+    def long_job(ctx):
+        runs.append(1)
+        # Lease của leader hết hạn giữa chừng: process khác thành leader và tick
+        _expire_lease(ctx.session)
+        assert second.tick(ctx.session) == []
+        return 'ok'
+
+    _due_job(db, monkeypatch, long_job)
+    assert first.tick(db) == ['test-long-job']
+    assert runs == [1]
+    assert db.get(ScheduledJob, 'test-long-job').next_run_at > datetime.now()
+
+
+def test_lease_heartbeat_outlives_lease_seconds(db):
+    lease, other = jobs.Lease('test-heartbeat', seconds=0.3), jobs.Lease('test-heartbeat', seconds=0.3)
+    assert lease.acquire()
+    with lease.keep_alive():
+        time.sleep(1)
+        assert not other.acquire()
+    time.sleep(0.4)
+    assert other.acquire()
@@ -0,0 +1,48 @@
+"""Perceptual-hash dedup never applies to CCCD images; GC never deletes a reused file."""
+from datetime import datetime, timedelta
+import io
+import os
+
+from app import media_store
+from app.models import StoredFile
+
+
+def test_citizen_id_uploads_skip_perceptual_match(db, monkeypatch, tmp_path):
+    monkeypatch.setattr(media_store, 'STATIC_DIR', str(tmp_path))
+    monkeypatch.setattr(media_store, 'STORE_DIR', os.path.join(str(tmp_path), 'uploads', 'store'))
+    monkeypatch.setattr(media_store, 'USE_PHASH', True)
+    # Mọi ảnh cùng mẫu thẻ -> cùng dHash
+    monkeypatch.setattr(media_store, 'perceptual_hash', lambda path: 'ffff0000ffff0000')
+
+    first = media_store.store_stream(db, io.BytesIO(b'cccd of customer A'), 'jpg')
+    second = media_store.store_stream(db, io.BytesIO(b'cccd of customer B'), 'jpg')
+    assert first != second
+    assert db.query(StoredFile).filter(StoredFile.path == first).one().phash is None
+
+    catalog = media_store.store_stream(db, io.BytesIO(b'catalog photo'), 'jpg', perceptual=True)
+    lookalike = media_store.store_stream(db, io.BytesIO(b'recompressed catalog photo'), 'jpg', perceptual=True)
+    assert lookalike == catalog != first
+
+
+def test_gc_keeps_orphan_reused_by_dedup(db, monkeypatch, tmp_path):
+    monkeypatch.setattr(media_store, 'STATIC_DIR', str(tmp_path))
+    monkeypatch.setattr(media_store, 'STORE_DIR', os.path.join(str(tmp_path), 'uploads', 'store'))
+    old = datetime.utcnow() - timedelta(days=3)
+
+    def orphan(data):
+        path = media_store.store_stream(db, io.BytesIO(data), 'jpg')
+        db.query(StoredFile).filter(StoredFile.path == path).update({StoredFile.created_at: old})
+        db.commit()
+        os.utime(os.path.join(str(tmp_path), path), (old.timestamp(), old.timestamp()))
+        return path
+
+    reused, abandoned = orphan(b'old cccd, uploaded again'), orphan(b'old cccd, never reused')
+    # Khách upload lại đúng ảnh cũ: dedup trả về file mồ côi (chưa commit tham chiếu)
+    assert media_store.store_stream(db, io.BytesIO(b'old cccd, uploaded again'), 'jpg') == reused
+    db.commit()
+
+    media_store.collect_garbage(db, grace=timedelta(days=1))
+    assert os.path.isfile(os.path.join(str(tmp_path), reused))
+    assert db.query(StoredFile).filter(StoredFile.path == reused).count() == 1
+    assert not os.path.exists(os.path.join(str(tmp_path), abandoned))
+    assert db.query(StoredFile).filter(StoredFile.path == abandoned).count() == 0
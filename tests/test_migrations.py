@@ -0,0 +1,82 @@
+"""Migrations upgrade a pre-migration database, and the hot route queries use indexes."""
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrations
+from app.models import Base
+
+# Schema trước migration 0001 (chỉ các cột mà migration đụng tới)
+BASELINE_DDL = [
+    "CREATE TABLE catagory_motorcycle (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL,"
+    " created_at DATETIME, updated_at DATETIME)",
+    "CREATE TABLE motorcycles (id INTEGER PRIMARY KEY, category_id INTEGER NOT NULL,"
+    " license_plate VARCHAR(100) NOT NULL UNIQUE, status VARCHAR(50), created_at DATETIME, updated_at DATETIME)",
+    "CREATE INDEX ix_motorcycles_license ON motorcycles (license_plate)",
+    "CREATE TABLE customer (id INTEGER PRIMARY KEY, full_name VARCHAR(255) NOT NULL,"
+    " phone VARCHAR(50), email VARCHAR(255), citizen_id VARCHAR(50), citizen_id_front_image VARCHAR(1000), citizen_id_back_image VARCHAR(1000),"
+    " created_at DATETIME, updated_at DATETIME)",
+    "CREATE TABLE rental (id INTEGER PRIMARY KEY, customer_id INTEGER, quantity INTEGER NOT NULL,"
+    " status VARCHAR(50), vnpay_transaction_id VARCHAR(255), created_at DATETIME, updated_at DATETIME)",
+    "CREATE TABLE rental_item (id INTEGER PRIMARY KEY, rental_id INTEGER NOT NULL, motorcycle_id INTEGER,"
+    " price_per_day NUMERIC(12, 2))",
+    "CREATE TABLE payment (id INTEGER PRIMARY KEY, rental_id INTEGER, payment_code VARCHAR(255),"
+    " vnpay_transaction_id VARCHAR(255), amount NUMERIC(12, 2) NOT NULL, payment_status VARCHAR(100))",
+    "CREATE TABLE article (id INTEGER PRIMARY KEY, is_published BOOLEAN, published_at DATETIME,"
+    " created_at DATETIME, updated_at DATETIME)",
+]
+
+
+@pytest.fixture
+def baseline_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as conn:
+        for ddl in BASELINE_DDL:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO customer (id, full_name, phone) VALUES (1, 'Nguyễn Văn An', '0901234567')"))
+        conn.execute(text("INSERT INTO rental (id, customer_id, quantity, status) VALUES (1, 1, 1, 'pending')"))
+        # Mã trùng do hậu tố ngẫu nhiên cũ
+        for payment_id in (1, 2, 3):
+            conn.execute(text("INSERT INTO payment (id, rental_id, payment_code, amount, payment_status)"
+                              " VALUES (:id, 1, 'ORD1', 100, 'pending')"), {'id': payment_id})
+    yield engine
+    engine.dispose()
+
+
+def test_upgrade_from_baseline(baseline_engine):
+    # Như init_db: create_all chỉ tạo bảng mới, rồi chạy migration
+    Base.metadata.create_all(baseline_engine)
+    messages = []
+    applied = migrations.upgrade(baseline_engine, echo=messages.append)
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.upgrade(baseline_engine) == []
+    assert any('ORD1 -> ORD1-2' in message for message in messages)
+
+    with baseline_engine.connect() as conn:
+        codes = [row[0] for row in conn.execute(text("SELECT payment_code FROM payment ORDER BY id"))]
+        assert codes == ['ORD1', 'ORD1-2', 'ORD1-3']
+        indexes = {index['name']: index for table in ('rental', 'payment', 'motorcycles')
+                   for index in inspect(conn).get_indexes(table)}
+    assert 'ix_rental_status_hold' in indexes
+    assert indexes['ux_payment_payment_code']['unique']
+    assert 'ix_payment_payment_code' not in indexes
+    assert 'ix_motorcycles_license' not in indexes
+
+
+def test_upgrade_backfills_search_documents(baseline_engine):
+    Base.metadata.create_all(baseline_engine)
+    migrations.upgrade(baseline_engine, echo=None)
+    with baseline_engine.connect() as conn:
+        kinds = dict(conn.execute(text("SELECT kind, COUNT(*) FROM search_document GROUP BY kind")).all())
+        assert kinds == {'customer': 1, 'payment': 3}
+        # FTS đã được rebuild cho các dòng có trước trigger
+        found = conn.execute(text(
+            "SELECT d.ref_id FROM search_document_fts f JOIN search_document d ON d.id = f.rowid"
+            " WHERE search_document_fts MATCH '\"nguyen van\"' AND d.kind = 'customer'"
+        )).scalars().all()
+    assert found == [1]
+
+
+def test_hot_queries_use_indexes(db):
+    for name, query in migrations.hot_queries(db):
+        uses_index, plan = migrations.explain_uses_index(db, query)
+        assert uses_index, f'{name}:\n{plan}'
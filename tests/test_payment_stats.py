@@ -0,0 +1,39 @@
+"""payment_summary + deltas always match a full GROUP BY over payment."""
+from decimal import Decimal
+
+from app import payment_stats
+from app.models import Customer, Payment, PaymentSummaryDelta, Rental
+
+
+def _assert_consistent(db):
+    expected = payment_stats.compute_totals(db)
+    stored = payment_stats.read_summary(db)
+    for status in set(expected) | set(stored):
+        assert stored.get(status, (0, Decimal('0'))) == expected.get(status, (0, Decimal('0'))), status
+
+
+def test_deltas_fold_into_summary(db):
+    rental = Rental(customer=Customer(full_name='Trần Thị B'), quantity=1, status='pending')
+    payments = [Payment(rental=rental, payment_code=f'PS-{i}', amount=Decimal('250000.50'),
+                        payment_status='pending') for i in range(4)]
+    db.add(rental)
+    db.commit()
+    _assert_consistent(db)
+
+    payments[0].payment_status = 'paid'
+    payments[1].amount = Decimal('300000')
+    db.delete(payments[2])
+    db.commit()
+    # UPDATE hàng loạt ngoài ORM (như booking_holds.expire_holds)
+    db.query(Payment).filter(Payment.id == payments[3].id).update(
+        {Payment.payment_status: 'failed'}, synchronize_session=False)
+    payment_stats.record_bulk_transition(db.connection(), 'pending', 'failed', 1, payments[3].amount)
+    db.commit()
+    assert db.query(PaymentSummaryDelta).count() > 0
+    _assert_consistent(db)
+
+    while payment_stats.fold(db, limit=3):
+        pass
+    assert db.query(PaymentSummaryDelta).count() == 0
+    _assert_consistent(db)
+    assert payment_stats.reconcile(db) == {}
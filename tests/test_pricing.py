@@ -0,0 +1,33 @@
+"""PriceTable quotes are the cheapest tier combination, also beyond HORIZON_DAYS."""
+from decimal import Decimal
+
+import pytest
+
+from app import pricing
+
+
+def _brute_force(days, tiers):
+    """Cheapest cover of `days` (over-coverage allowed) by a plain DP without horizon."""
+    cost = [Decimal('0')] + [None] * days
+    for n in range(1, days + 1):
+        cost[n] = min(cost[max(0, n - length)] + price for length, price in tiers)
+    return cost[days]
+
+
+@pytest.mark.parametrize('day, week, month', [
+    ('100', '600', '2000'),     # tháng rẻ nhất theo ngày
+    ('100', '500', '2700'),     # tuần rẻ nhất theo ngày (71.4 < 90)
+    ('50', '600', '2000'),      # ngày rẻ nhất
+    ('100', None, '3500'),
+    (None, '600', None),
+])
+def test_total_matches_brute_force(day, week, month):
+    prices = [Decimal(value) if value else None for value in (day, week, month)]
+    table = pricing.PriceTable(*prices)
+    tiers = [(length, price) for length, price in zip((1, pricing.WEEK_DAYS, pricing.MONTH_DAYS), prices) if price]
+    for days in list(range(1, 60)) + list(range(pricing.HORIZON_DAYS - 40, pricing.HORIZON_DAYS + 400, 7)):
+        assert table.total(days) == _brute_force(days, tiers), days
+        months, weeks, extra = table.breakdown(days)
+        assert months * pricing.MONTH_DAYS + weeks * pricing.WEEK_DAYS + extra >= days
+        billed = zip((extra, weeks, months), prices)
+        assert sum((count * price for count, price in billed if count), Decimal('0')) == table.total(days)
@@ -0,0 +1,68 @@
+"""The admin rental pages run a fixed number of queries, whatever the number of items."""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from app.models import Catagory_Motorcycle, Customer, Motorcycles, Payment, Rental, RentalItem
+
+
+def _make_rental(db, items):
+    category = Catagory_Motorcycle(name='Vision', price_per_day=Decimal('150000'))
+    other = Catagory_Motorcycle(name='Air Blade', price_per_day=Decimal('180000'))
+    db.add_all([category, other])
+    db.flush()
+    bikes = [Motorcycles(category_id=category.id, license_plate=f'QC-{category.id}-{i}', status='ready')
+             for i in range(items + 5)]
+    bikes.append(Motorcycles(category_id=other.id, license_plate=f'QC-{other.id}-0', status='ready'))
+    db.add_all(bikes)
+    customer = Customer(full_name='Nguyễn Văn A', phone='0900000000')
+    start = datetime(2030, 1, 1)
+    rental = Rental(customer=customer, start_date=start, end_date=start + timedelta(days=2),
+                    quantity=items, status='confirmed')
+    db.add(rental)
+    db.flush()
+    for i in range(items):
+        # Một nửa đã gán xe, nửa còn lại chỉ có giá (tìm loại xe theo giá)
+        db.add(RentalItem(rental_id=rental.id, motorcycle_id=bikes[i].id if i % 2 == 0 else None,
+                          price_per_day=category.price_per_day))
+    db.add_all([Payment(rental_id=rental.id, payment_code=f'QC{rental.id}-{i}', amount=Decimal('100000'),
+                        payment_status='paid') for i in range(3)])
+    db.commit()
+    return rental.id
+
+
+def _rental_detail_queries(db, admin_client, count_queries, items):
+    rental_id = _make_rental(db, items)
+    with count_queries() as statements:
+        response = admin_client.get(f'/admin/rental/{rental_id}')
+    assert response.status_code == 200
+    return statements
+
+
+def _available_motorcycles_queries(db, admin_client, count_queries, items):
+    from app.availability import availability_index
+
+    rental_id = _make_rental(db, items)
+    availability_index.invalidate()
+    admin_client.get(f'/admin/rental/{rental_id}/get_available_motorcycles')    # nạp chỉ mục
+    with count_queries() as statements:
+        response = admin_client.get(f'/admin/rental/{rental_id}/get_available_motorcycles')
+    data = response.get_json()
+    assert response.status_code == 200 and data['success']
+    assert len(data['items']) == items
+    return statements
+
+
+def test_rental_detail_query_count(db, admin_client, count_queries):
+    few = _rental_detail_queries(db, admin_client, count_queries, 2)
+    many = _rental_detail_queries(db, admin_client, count_queries, 12)
+    # rental + khách, items (+ xe + loại xe), payments, loại xe theo giá, danh sách xe
+    assert len(few) <= 5, few
+    assert len(many) == len(few), many
+
+
+def test_available_motorcycles_query_count(db, admin_client, count_queries):
+    few = _available_motorcycles_queries(db, admin_client, count_queries, 2)
+    many = _available_motorcycles_queries(db, admin_client, count_queries, 12)
+    # rental, items (+ xe), loại xe theo giá, danh sách xe
+    assert len(few) <= 4, few
+    assert len(many) == len(few), many
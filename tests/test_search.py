@@ -0,0 +1,28 @@
+"""search_document follows the ORM: upserted in place and visible to FTS / LIKE searches."""
+from app import search
+from app.models import Customer, SearchDocument
+
+
+def _customer_ids(db, term):
+    return [ref_id for kind, ref_id, _ in search.ranked_search(db, term, kinds=['customer'])]
+
+
+def test_update_upserts_document_in_place(db):
+    customer = Customer(full_name='Trần Văn Bình', phone='0911000111')
+    db.add(customer)
+    db.commit()
+    doc_id = db.query(SearchDocument.id).filter_by(kind='customer', ref_id=customer.id).scalar()
+    assert customer.id in _customer_ids(db, 'binh')
+
+    customer.full_name = 'Lê Thị Cúc'
+    db.commit()
+    assert db.query(SearchDocument.id).filter_by(kind='customer', ref_id=customer.id).scalar() == doc_id
+    assert customer.id in _customer_ids(db, 'le thi cuc')
+    assert customer.id not in _customer_ids(db, 'tran van binh')
+
+    # Lần ghi trùng (kind, ref_id) như của transaction song song: không lỗi khóa duy nhất
+    search._write_document(db.connection(), 'customer', customer.id, 'le thi cuc 0911000111')
+    db.delete(customer)
+    db.commit()
+    assert db.query(SearchDocument).filter_by(kind='customer', ref_id=customer.id).count() == 0
+    assert customer.id not in _customer_ids(db, 'le thi cuc')
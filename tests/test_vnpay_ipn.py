@@ -0,0 +1,73 @@
+"""VNPay results against expiring holds, and the GMT+7 timestamps sent to VNPay."""
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from app import booking_holds, vnpay_ipn
+from app.models import Catagory_Motorcycle, Customer, Motorcycles, Payment, Rental, RentalItem
+from app.vnpay_helper import vnpay_timestamp
+
+
+def _pending_rental(db, code, hold_expires_at):
+    rental = Rental(customer=Customer(full_name='Lê Văn C'), quantity=1, start_date=date(2026, 5, 1),
+                    end_date=date(2026, 5, 3), status='pending', payment_status='pending',
+                    paid_amount=Decimal('0'), hold_expires_at=hold_expires_at)
+    db.add(Payment(rental=rental, payment_code=code, amount=Decimal('500000'),
+                   payment_method='vnpay', payment_status='pending'))
+    db.commit()
+    return rental
+
+
+def _success(code):
+    return {'vnp_TxnRef': code, 'vnp_ResponseCode': '00', 'vnp_TransactionStatus': '00',
+            'vnp_TransactionNo': '14000001', 'vnp_BankCode': 'NCB', 'vnp_Amount': '50000000'}
+
+
+def test_payment_after_expiry_does_not_reconfirm(db):
+    rental = _pending_rental(db, 'IPN-LATE', datetime.utcnow() - timedelta(minutes=1))
+    assert rental.id in booking_holds.expire_holds(db)
+
+    outcome, rental_id = vnpay_ipn.apply_result(db, _success('IPN-LATE'))
+    db.commit()
+    assert (outcome, rental_id) == ('paid_after_cancel', rental.id)
+    db.refresh(rental)
+    assert rental.status == 'cancelled'
+    assert rental.payment_status == 'refund_pending'
+    assert 'hoàn tiền' in rental.notes
+    assert db.query(Payment.payment_status).filter(Payment.payment_code == 'IPN-LATE').scalar() == 'paid'
+
+
+def test_payment_within_hold_confirms(db):
+    rental = _pending_rental(db, 'IPN-OK', booking_holds.hold_deadline(booking_holds.payment_deadline()))
+    assert rental.id not in booking_holds.expire_holds(db)
+
+    outcome, _ = vnpay_ipn.apply_result(db, _success('IPN-OK'))
+    db.commit()
+    db.refresh(rental)
+    assert outcome == 'paid'
+    assert (rental.status, rental.payment_status, rental.hold_expires_at) == ('confirmed', 'paid', None)
+
+
+def test_vnpay_timestamps_are_vietnam_time():
+    # hold_expires_at / payment_deadline là UTC naive; VNPay đọc giờ GMT+7
+    assert vnpay_timestamp(datetime(2026, 1, 1, 20, 30)) == '20260102033000'
+    assert vnpay_timestamp(datetime(2026, 1, 1, 20, 30, tzinfo=timezone.utc)) == '20260102033000'
+
+    deadline = booking_holds.payment_deadline()
+    expected = datetime.utcnow() + timedelta(minutes=booking_holds.HOLD_MINUTES)
+    assert abs(deadline - expected) < timedelta(seconds=5)
+    now_vn = datetime.strptime(vnpay_timestamp(), '%Y%m%d%H%M%S')
+    assert abs(now_vn - (datetime.utcnow() + timedelta(hours=7))) < timedelta(seconds=5)
+
+
+def test_held_counts_only_unexpired_pending(db):
+    category = Catagory_Motorcycle(name='Hold test', price_per_day=Decimal('100000'))
+    bikes = [Motorcycles(category=category, license_plate=f'HOLD-{i}', status='ready') for i in range(3)]
+    db.add_all(bikes)
+    db.flush()
+    now = datetime.utcnow()
+    for bike, expires_at in ((bikes[0], now + timedelta(minutes=5)), (bikes[1], now + timedelta(minutes=9)),
+                             (bikes[2], now - timedelta(minutes=1))):
+        rental = _pending_rental(db, f'HOLD-{bike.id}', expires_at)
+        db.add(RentalItem(rental_id=rental.id, motorcycle_id=bike.id))
+    db.commit()
+    assert booking_holds.held_counts(db, now).get(category.id) == 2
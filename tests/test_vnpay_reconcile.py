@@ -0,0 +1,40 @@
+"""querydr reconciliation: transaction dates and what counts as a failed payment."""
+from datetime import timedelta
+from decimal import Decimal
+
+from app import vnpay_reconcile
+from app.models import Customer, Payment, Rental
+from app.order_ids import generate_order_id
+from app.vnpay_helper import vnpay_now
+
+
+class FakeClient:
+    def __init__(self, response_code):
+        self.response_code = response_code
+        self.queries = []
+
+    def query_many(self, items):
+        self.queries.extend(items)
+        return [({'vnp_ResponseCode': self.response_code, 'vnp_TxnRef': code}, None) for code, _ in items]
+
+
+def test_order_id_stamp_is_vnpay_create_date():
+    before = vnpay_now().replace(microsecond=0)
+    created = vnpay_reconcile.transaction_date(generate_order_id())
+    assert before <= created <= vnpay_now()
+
+
+def test_not_found_is_left_to_hold_expiry(db):
+    code = (vnpay_now() - timedelta(hours=1)).strftime('%Y%m%d%H%M%S') + '0000000001'
+    rental = Rental(customer=Customer(full_name='Phạm Văn D'), quantity=1, status='pending',
+                    payment_status='pending')
+    db.add(Payment(rental=rental, payment_code=code, amount=Decimal('100000'),
+                   payment_method='vnpay', payment_status='pending'))
+    db.commit()
+
+    client = FakeClient('91')
+    stats = vnpay_reconcile.reconcile(db, client, min_age=timedelta(minutes=30))
+    assert client.queries == [(code, code[:14])]
+    assert stats['not_found'] == 1 and stats['marked_failed'] == 0
+    assert db.query(Payment.payment_status).filter(Payment.payment_code == code).scalar() == 'pending'
+    assert db.query(Rental.status).filter(Rental.id == rental.id).scalar() == 'pending'